@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+
+''' A local stand-in of the OpenAI completion APIs to benchmark and test llano without spending tokens.
+
+Example:
+    with FakeOpenAIServer(default_response='positive', latency='lognormal:-2,0.5', rate_limit_ratio=0.01) as server:
+        model = GPTModel('fake-key', api_base=server.url, cache=False)
+'''
+
+import json
+import time
+import random
+import threading
+import multiprocessing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Union
+
+
+def make_latency(spec: Union[str, float, None]) -> Callable[[], float]:
+    ''' Build a latency sampler in seconds from a spec:
+    `constant:0.2`, `uniform:0.1,0.5`, `lognormal:mu,sigma` or a number of seconds.
+    '''
+    if spec is None:
+        return lambda: 0.
+    if isinstance(spec, (int, float)):
+        return lambda: float(spec)
+    name, _, args = spec.partition(':')
+    args = [float(x) for x in args.split(',') if x]
+    if name == 'constant':
+        return lambda: args[0]
+    if name == 'uniform':
+        return lambda: random.uniform(*args)
+    if name == 'lognormal':
+        return lambda: random.lognormvariate(*args)
+    raise ValueError(f'Unknown latency distribution `{name}`, expected constant, uniform or lognormal.')
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.n_connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body: Dict, headers: Optional[Dict] = None) -> None:
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_stream(self, chat: bool, response: str) -> None:
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        for i in range(0, len(response), 4):
+            piece = response[i: i + 4]
+            choice = {'index': 0, 'delta': {'content': piece}} if chat else {'index': 0, 'text': piece}
+            self.wfile.write(f'data: {json.dumps({"choices": [choice]})}\n\n'.encode('utf-8'))
+        self.wfile.write(b'data: [DONE]\n\n')
+        self.close_connection = True
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        chat = self.path.rstrip('/').endswith('chat/completions')
+        if not chat and not self.path.rstrip('/').endswith('completions'):
+            self._send_json(404, {'error': {'message': f'Unknown path {self.path}', 'type': 'invalid_request_error'}})
+            return
+        with server.lock:
+            server.n_requests += 1
+            server.max_tokens.append(body.get('max_tokens'))
+        time.sleep(server.latency())
+        if random.random() < server.rate_limit_ratio:
+            with server.lock:
+                server.n_throttled += 1
+            self._send_json(429, {'error': {'message': 'Rate limit reached.', 'type': 'requests'}},
+                            headers={'Retry-After': '1'})
+            return
+        prompt = body['messages'][-1]['content'] if chat else body.get('prompt', '')
+        responses = server.respond(prompt)
+        # a list of responses holds the completions of a request sampling several, they are cycled
+        if isinstance(responses, str):
+            responses = [responses]
+        if body.get('stream'):
+            self._send_stream(chat, responses[0])
+            return
+        choices, n_completion_tokens = [], 0
+        max_tokens = body.get('max_tokens')
+        for i in range(body.get('n') or 1):
+            response = responses[i % len(responses)]
+            # a token is a word, the completion is cut at `max_tokens` words
+            words = response.split(' ')
+            finish_reason = 'stop'
+            if max_tokens is not None and len(words) > max_tokens:
+                response, finish_reason = ' '.join(words[:max_tokens]), 'length'
+            n_completion_tokens += len(response.split())
+            choice = {'index': i, 'finish_reason': finish_reason}
+            if chat:
+                choice['message'] = {'role': 'assistant', 'content': response}
+            else:
+                choice['text'] = response
+            choices.append(choice)
+        n_prompt_tokens = len(prompt.split())
+        self._send_json(200, {
+            'id': f'fake-{server.n_requests}',
+            'object': 'chat.completion' if chat else 'text_completion',
+            'model': body.get('model'),
+            'choices': choices,
+            'usage': {'prompt_tokens': n_prompt_tokens,
+                      'completion_tokens': n_completion_tokens,
+                      'total_tokens': n_prompt_tokens + n_completion_tokens},
+        })
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    ''' Fake OpenAI server with configurable latency, 429 injection and canned responses.
+
+    Args:
+        responses: canned responses keyed by a substring of the prompt, the first matched one is returned.
+            A list of responses is cycled through by the completions of a request with `n`.
+        default_response: response of the prompts not matched by `responses`.
+        latency: latency spec of `make_latency`.
+        rate_limit_ratio: ratio of the requests answered with HTTP 429.
+        host: host to bind, the port is picked by the OS.
+    '''
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self,
+                 responses: Optional[Dict[str, Union[str, List[str]]]] = None,
+                 default_response: str = '',
+                 latency: Union[str, float, None] = None,
+                 rate_limit_ratio: float = 0.,
+                 host: str = '127.0.0.1') -> None:
+        super().__init__((host, 0), FakeOpenAIHandler)
+        self.responses = responses or {}
+        self.default_response = default_response
+        self.latency = make_latency(latency)
+        self.rate_limit_ratio = rate_limit_ratio
+        self.n_requests = 0
+        self.n_throttled = 0
+        self.n_connections = 0
+        # `max_tokens` of the requests
+        self.max_tokens = []
+        self.lock = threading.Lock()
+        self._runner = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    def respond(self, prompt: str) -> Union[str, List[str]]:
+        for key, response in self.responses.items():
+            if key in prompt:
+                return response
+        return self.default_response
+
+    def start(self, process: bool = False) -> 'FakeOpenAIServer':
+        ''' Serve in a background thread, or in a forked process so that the CPU time of the server
+        is not counted in the benchmarked process. The request counters are only updated in thread mode.
+        '''
+        if process:
+            self._runner = multiprocessing.get_context('fork').Process(target=self.serve_forever, daemon=True)
+        else:
+            self._runner = threading.Thread(target=self.serve_forever, daemon=True)
+        self._runner.start()
+        return self
+
+    def stop(self) -> None:
+        if isinstance(self._runner, threading.Thread):
+            self.shutdown()
+            self._runner.join()
+        elif self._runner is not None:
+            self._runner.terminate()
+            self._runner.join()
+        self._runner = None
+        self.server_close()
+
+    def __enter__(self) -> 'FakeOpenAIServer':
+        return self.start() if self._runner is None else self
+
+    def __exit__(self, *args) -> None:
+        self.stop()
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+
+''' Benchmark the throughput of llano without spending tokens.
+
+`server` mode sends the requests of `GPTModel` to a local fake OpenAI server, which measures the whole client
+path: scheduling, HTTP, parsing and formatting. `replay` mode answers the prompts with recorded responses,
+which measures the CPU cost of the annotators alone.
+
+Example:
+    python -m benchmarks.run --mode server --latency lognormal:-2,0.5 --concurrency 1,8,32 --n-items 500
+    python -m benchmarks.run --mode replay --records responses.jsonl --input corpus.jsonl --tasks ner
+'''
+
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import tracemalloc
+from typing import Dict, List, Optional
+
+from llano import GPTAnnotator, GPTModel
+from llano.cli import read_texts
+from llano.config import Tasks
+from llano.models.replay import ReplayModel
+from llano.utils import imap_ordered
+
+from .fake_server import FakeOpenAIServer
+
+
+LABEL_MAPPINGS = {
+    Tasks.NER: {'people': 'PEO', 'location': 'LOC', 'organization': 'ORG'},
+    Tasks.Classification: {'positive': 'POS', 'negative': 'NEG'},
+    Tasks.MultiLabelClassification: {'sports': 'SPO', 'politics': 'POL', 'technology': 'TEC'},
+    Tasks.DataAugmentation: None,
+    Tasks.RelationExtraction: {'live in': 'LIVE_IN', 'work at': 'WORK_AT'},
+}
+
+TASK_RESPONSES = {
+    Tasks.NER: '(Alice Smith, people), (London, location), (Acme Corp, organization), (Paris, location)',
+    Tasks.Classification: 'positive',
+    Tasks.MultiLabelClassification: 'sports, technology',
+    Tasks.DataAugmentation: '1. Alice Smith relocated to London.\n2. Alice Smith now works in London.\n',
+    Tasks.RelationExtraction: '[(Alice Smith, live in, London), (Alice Smith, work at, Acme Corp)]',
+}
+
+NAMES = ['Alice Smith', 'Bob Brown', 'Carol White']
+PLACES = ['London', 'Paris', 'Berlin', 'Tokyo']
+ORGANIZATIONS = ['Acme Corp', 'Globex', 'Initech']
+
+
+def make_texts(n_items: int, seed: int = 42) -> List[str]:
+    ''' Generate distinct synthetic texts, so that no response is served from a cache.
+    '''
+    rand = random.Random(seed)
+    return [
+        f'{rand.choice(NAMES)} moved from {rand.choice(PLACES)} to {rand.choice(PLACES)} in {1900 + i % 120} '
+        f'to work for {rand.choice(ORGANIZATIONS)}, report #{i}.'
+        for i in range(n_items)
+    ]
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def measure(annotator: GPTAnnotator, texts: List[str], concurrency: int, trace_memory: bool = False,
+            **kwargs) -> Dict:
+    ''' Annotate the texts with `concurrency` workers and measure the throughput, latency, CPU and memory.
+    '''
+    def timed_tag(text):
+        start = time.perf_counter()
+        try:
+            annotator.tag(text, **kwargs)
+            error = False
+        except Exception:
+            error = True
+        return time.perf_counter() - start, error
+
+    if trace_memory:
+        tracemalloc.start()
+    start_time, start_cpu = time.perf_counter(), time.process_time()
+    results = list(imap_ordered(timed_tag, texts, concurrency))
+    wall_time, cpu_time = time.perf_counter() - start_time, time.process_time() - start_cpu
+    stats = {}
+    if trace_memory:
+        stats['peak_traced_mb'] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 2)
+        tracemalloc.stop()
+    latencies = [latency for latency, _ in results]
+    stats.update({
+        'items': len(texts),
+        'errors': sum(error for _, error in results),
+        'items_per_s': round(len(texts) / wall_time, 2),
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'cpu_ms_per_item': round(cpu_time * 1000 / len(texts), 4),
+        # maxrss is in kilobytes on linux
+        'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 2),
+    })
+    return stats
+
+
+def make_replay_model(annotator: GPTAnnotator, texts: List[str], records: Optional[str] = None,
+                      **kwargs) -> ReplayModel:
+    ''' Load recorded responses, or record the canned response of the task for every text.
+    '''
+    if records is not None:
+        if records.endswith('.jsonl'):
+            return ReplayModel.from_jsonl(records)
+        return ReplayModel.from_cache(records)
+    response = TASK_RESPONSES[annotator.task]
+    return ReplayModel({'request': {'prompt': annotator.render_prompt(text.replace('\n', ''), **kwargs)},
+                        'response': response} for text in texts)
+
+
+def run_task(task: str, args: argparse.Namespace, texts: List[str]) -> List[Dict]:
+    kwargs = {'size': 2} if task == Tasks.DataAugmentation else {}
+    label_mapping = LABEL_MAPPINGS[task]
+    server = None
+    if args.mode == 'server':
+        server = FakeOpenAIServer(default_response=TASK_RESPONSES[task],
+                                  latency=args.latency,
+                                  rate_limit_ratio=args.rate_limit_ratio).start(process=True)
+        model = GPTModel([f'fake-key-{i}' for i in range(args.n_keys)], api_base=server.url, cache=False)
+        annotator = GPTAnnotator(model, task=task, language=args.language, label_mapping=label_mapping)
+    else:
+        # the replay model is built from the prompts rendered by a first annotator
+        annotator = GPTAnnotator(ReplayModel([]), task=task, language=args.language, label_mapping=label_mapping)
+        annotator.model = make_replay_model(annotator, texts, records=args.records, **kwargs)
+    try:
+        rows = []
+        for concurrency in args.concurrency:
+            stats = measure(annotator, texts, concurrency, trace_memory=args.trace_memory, **kwargs)
+            rows.append(dict(task=task, mode=args.mode, concurrency=concurrency, **stats))
+            print(json.dumps(rows[-1]), flush=True)
+        return rows
+    finally:
+        if server is not None:
+            server.stop()
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description='Benchmark llano against a fake OpenAI server or replayed responses.')
+    parser.add_argument('--mode', default='server', choices=['server', 'replay'])
+    parser.add_argument('--tasks', default=','.join(Tasks.values()), help='comma separated tasks.')
+    parser.add_argument('--language', default='en')
+    parser.add_argument('--concurrency', default='1,8,32', help='comma separated concurrency levels.')
+    parser.add_argument('--n-items', type=int, default=200)
+    parser.add_argument('--n-keys', type=int, default=4, help='number of fake api keys.')
+    parser.add_argument('--latency', default='lognormal:-2.3,0.5', help='latency distribution of the fake server.')
+    parser.add_argument('--rate-limit-ratio', type=float, default=0., help='ratio of requests answered with 429.')
+    parser.add_argument('--records', help='recorded responses to replay, a JSONL file or a response cache.')
+    parser.add_argument('--input', help='JSONL corpus of the texts of the recorded responses.')
+    parser.add_argument('--trace-memory', action='store_true', help='report the peak memory traced by tracemalloc.')
+    parser.add_argument('--output', help='write the results to a JSON file.')
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = build_parser().parse_args(argv)
+    args.concurrency = [int(x) for x in args.concurrency.split(',')]
+    if args.input:
+        texts = list(read_texts(args.input, 'jsonl'))[:args.n_items]
+    else:
+        texts = make_texts(args.n_items)
+    rows = []
+    for task in args.tasks.split(','):
+        if task not in Tasks.values():
+            sys.exit(f'Unknown task `{task}`')
+        rows.extend(run_task(task, args, texts))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as writer:
+            json.dump(rows, writer, indent=2)
+
+
+if __name__ == '__main__':
+    main()
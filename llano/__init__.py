@@ -3,5 +3,36 @@
 __version__ = '0.1.8'
 
 
-from .annotators import GPTAnnotator  # NOQA
-from .models import GPTModel  # NOQA
+import importlib
+from typing import TYPE_CHECKING
+
+# the public classes are imported on first access, so that `import llano` does not import
+# openai, tiktoken or jinja2 until they are needed
+LAZY_ATTRIBUTES = {
+    'GPTAnnotator': '.annotators',
+    'GPTModel': '.models',
+    'ResponseCache': '.cache',
+    'Instrumentation': '.instrumentation',
+    'default_instrumentation': '.instrumentation',
+}
+
+__all__ = list(LAZY_ATTRIBUTES)
+
+if TYPE_CHECKING:
+    from .annotators import GPTAnnotator  # NOQA
+    from .models import GPTModel  # NOQA
+    from .cache import ResponseCache  # NOQA
+    from .instrumentation import Instrumentation, default_instrumentation  # NOQA
+
+
+def __getattr__(name: str):
+    module = LAZY_ATTRIBUTES.get(name)
+    if module is None:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(LAZY_ATTRIBUTES))
@@ -1,3 +1,14 @@
 # -*- coding: utf-8 -*-
 
-from .gpt import GPTAnnotator  # NOQA
+import importlib
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .gpt import GPTAnnotator  # NOQA
+
+
+def __getattr__(name: str):
+    # jinja2 is only imported when GPTAnnotator is used
+    if name == 'GPTAnnotator':
+        return importlib.import_module('.gpt', __name__).GPTAnnotator
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -1,68 +1,161 @@
 # -*- coding: utf-8 -*-
 
-import os
 import re
 import json
-from copy import deepcopy
-from typing import Dict, Optional, List, Tuple
+import bisect
+import time
+import asyncio
+import threading
+from collections import OrderedDict, deque
+from functools import partial
+from typing import (
+    TYPE_CHECKING, Callable, Dict, Optional, List, Tuple, Union, Iterable, Iterator, AsyncIterable, AsyncIterator
+)
 
 from jinja2 import Template
 
-from ..config import Tasks, Languages, Formatter, NERFormatter, TEMPLATE_DIR
-from ..models import GPTModel
+from ..config import (
+    Tasks, Languages, Formatter, NERFormatter, OutputFormat, Stages,
+    DEFAULT_CONCURRENCY, DEFAULT_PACK_MAX_TOKENS, DEFAULT_PACK_SIZE, DEFAULT_CHUNK_OVERLAP_TOKENS,
+    DEFAULT_CHUNK_WORKERS, DEFAULT_N_EXAMPLES, DEFAULT_MAX_EXAMPLE_TOKENS, DEFAULT_VOTE_THRESHOLD
+)
+from ..budget import CompletionBudget
+from ..dedup import NearDuplicateIndex, align_normalized
+from ..export import get_ner_segments, iter_bio, iter_segment
+from ..instrumentation import Instrumentation, default_instrumentation, timed
+from ..models.base import BaseModel
+from ..matcher import AhoCorasick
+from ..parsing import iter_json_strings, iter_json_tuples, iter_tuples
+from ..prompt import Prompt
+from ..registry import TemplateRegistry, get_default_registry
+from ..results import Annotation
+from ..utils import imap_ordered, chunk_text
+from ..voting import vote_results
 from .base import BaseAnnotator
+from .stream import StreamParser
+
+if TYPE_CHECKING:
+    from ..fewshot import ExampleIndex
+
+
+PACKED_ITEM_REGEX = re.compile(r'^[ \t]*\[(?P<index>[0-9]+)\]', re.M)
+# completion tokens of the number and line break of an output of a packed prompt
+PACKED_ITEM_TOKENS = 4
+DATA_AUGMENTATION_REGEX = re.compile(r'(?P<ordial>[0-9]+?)\.?(?P<sentence>.+)\n')
+TEXT_SLOT = '\x00'
+MAX_STATIC_TOKENS_CACHE_SIZE = 1024
+RE_STRIP_REGEX = re.compile(r'(^[\'"\s]+|[\'"\s]+$)')
 
 
 class GPTAnnotator(BaseAnnotator):
     def __init__(self,
-                 model: GPTModel,
+                 model: BaseModel,
                  task: Tasks,
                  language: Languages,
                  label_mapping: Optional[Dict] = None,
+                 max_chunk_tokens: Optional[int] = None,
+                 chunk_overlap_tokens: int = DEFAULT_CHUNK_OVERLAP_TOKENS,
+                 instrumentation: Optional[Instrumentation] = None,
+                 examples: Optional['ExampleIndex'] = None,
+                 n_examples: int = DEFAULT_N_EXAMPLES,
+                 max_example_tokens: Optional[int] = DEFAULT_MAX_EXAMPLE_TOKENS,
+                 vote_threshold: float = DEFAULT_VOTE_THRESHOLD,
+                 cascade: Optional[List[BaseModel]] = None,
+                 min_confidence: Optional[float] = None,
+                 registry: Optional[TemplateRegistry] = None,
+                 typed_results: bool = False,
+                 output_format: str = OutputFormat.Tuple,
+                 completion_budget: Union[CompletionBudget, bool] = False,
                  **kwargs) -> None:
+        ''' GPT annotator.
+
+        Args:
+            max_chunk_tokens: NER and relation extraction split texts longer than it into overlapping chunks,
+                which are annotated concurrently. Defaults to half of the max tokens of the model.
+            chunk_overlap_tokens: number of tokens shared by consecutive chunks.
+            instrumentation: collects the stage timings and token usage of the requests,
+                defaults to the instance shared by all annotators.
+            examples: index of labeled examples, see `fewshot.ExampleIndex`. The `n_examples` examples most
+                similar to a text are added to the hint of its prompt, within `max_example_tokens` tokens.
+                Packed prompts do not use examples.
+            vote_threshold: when the model samples several completions of a prompt, e.g. `GPTModel(n=5)`,
+                the results of the completions are voted, see `voting.vote_results`. Labels of multi-label
+                classification, NER spans and relation triples are kept if more than this fraction of the
+                completions agree on them. Packed prompts and streams only use the first completion.
+            cascade: stronger models, from the cheaper to the stronger one. Texts are annotated by `model` first,
+                and an output is sent to the next model when `should_escalate` it: nothing can be parsed from
+                its response, or the agreement of its sampled completions is below `min_confidence`.
+                See `cascade_stats`. Streams and the texts answered within a pack are not escalated.
+            registry: registry of the prompt templates, defaults to the one shared by the process.
+                The part of a prompt which depends on the labels, hint and size is rendered once,
+                so annotating a text only fills its slot in.
+            typed_results: return immutable `results.Annotation` records instead of dicts. They share the
+                response of the model instead of copying it, their entities and triples are tuples, and their
+                `formatted_result` is only formatted when it is read. `to_dict` returns the dict output.
+            output_format: `json` asks the model for JSON outputs with the `{task}.json.{language}` templates.
+                Their responses are parsed as JSON first, then as tuples, see `parsing`. Packed prompts ask
+                for tuples.
+            completion_budget: `max_tokens` of the requests, estimated per task from the labels, the size and
+                the text, then from the completion tokens of the responses, see `budget.CompletionBudget`.
+                `True` creates a budget per annotator, `False`, the default, asks for the whole context of
+                the model. A completion truncated by its budget is requested again with the whole context.
+                It requires the tokenizer of the model. A packed prompt asks for the budgets of its texts.
+        '''
         super().__init__()
         self.model = model
         self.task = task
+        self.language = language
         self.label_mapping = label_mapping
-        # load template
-        with open(os.path.join(TEMPLATE_DIR, 'texts', f'{task}.{language}.jinja')) as reader:
-            self.template = Template(reader.read())
+        self.max_chunk_tokens = max_chunk_tokens
+        self.chunk_overlap_tokens = chunk_overlap_tokens
+        self.instrumentation = instrumentation or default_instrumentation
+        self.examples = examples
+        self.n_examples = n_examples
+        self.max_example_tokens = max_example_tokens
+        self.vote_threshold = vote_threshold
+        self.cascade = list(cascade or [])
+        self.min_confidence = min_confidence
+        # number of outputs answered by each level of the cascade
+        self._cascade_counts = [0] * (len(self.cascade) + 1)
+        self._cascade_lock = threading.Lock()
+        self.typed_results = typed_results
+        if completion_budget is True:
+            completion_budget = CompletionBudget()
+        self.completion_budget = completion_budget if isinstance(completion_budget, CompletionBudget) else None
+        self._completion_prior = None
+        self.registry = registry or get_default_registry()
+        if output_format not in OutputFormat.values():
+            raise ValueError(f'Invalid output format `{output_format}`, '
+                             f'please specify output format from {OutputFormat.values()}.')
+        self.output_format = output_format
+        name = f'{task}.json.{language}' if output_format == OutputFormat.JSON else f'{task}.{language}'
+        self.template = self.registry.get_template(name)
+        self._packed_template = None
+        self._regexes = {}
+        self._static_tokens = {}
+        self._static_parts = {}
+
+    @staticmethod
+    def load_template(name: str) -> Template:
+        return get_default_registry().get_template(name)
+
+    @property
+    def packed_template(self) -> Template:
+        if self._packed_template is None:
+            self._packed_template = self.registry.get_template(f'{self.task}.packed.{self.language}')
+        return self._packed_template
 
     @staticmethod
     def get_all_ner_segments(text: str, entities: List[str]) -> List[Tuple]:
-        prev_start = 0
-        segments = []
-        for start, end, entity, entity_type in entities:
-            if start > prev_start:
-                segments.append((text[prev_start: start], 'O'))
-            segments.append((entity, entity_type))
-            prev_start = end
-        if prev_start < len(text):
-            segments.append((text[prev_start:], 'O'))
-        return segments
+        return get_ner_segments(text, entities)
 
     @staticmethod
     def format_ner_to_bio(text: str, entities: List[str]) -> str:
-        segments = GPTAnnotator.get_all_ner_segments(text, entities)
-        ret = []
-        for segment, label in segments:
-            if label == 'O':
-                ret.append('\n'.join([f'{w}\t{t}' for w, t in zip(segment, [label] * len(segment))]))
-            else:
-                head = f'{segment[0]}\tB-{label}'
-                if len(segment) > 1:
-                    head += '\n'
-                    head += '\n'.join([f'{w}\tI-{t}' for w, t in zip(segment[1:], [label] * len(segment[1:]))])
-                ret.append(head)
-        return '\n'.join(ret)
+        return ''.join(iter_bio(text, entities))
 
     @staticmethod
     def format_ner_to_segment(text: str, entities: List[str]) -> str:
-        segments = GPTAnnotator.get_all_ner_segments(text, entities)
-        ret = []
-        for segment, label in segments:
-            ret.append(f'{segment}\t{label}')
-        return '\n'.join(ret)
+        return ''.join(iter_segment(text, entities))
 
     @staticmethod
     def make_ner_extraction_regex(labels: List[str]):
@@ -83,9 +176,7 @@ class GPTAnnotator(BaseAnnotator):
 
     @staticmethod
     def make_data_augmentation_regex():
-        return re.compile(
-            r'(?P<ordial>[0-9]+?)\.?(?P<sentence>.+)\n'
-        )
+        return DATA_AUGMENTATION_REGEX
 
     @staticmethod
     def make_relation_extraction_regex(labels: List[str]):
@@ -98,26 +189,252 @@ class GPTAnnotator(BaseAnnotator):
             r'(?P<object>((?!\)).)+)\)'  # object
         )
 
+    def get_regex(self, name: str, factory: Callable) -> re.Pattern:
+        ''' Return the extraction regex of the labels, which is compiled once and recompiled only if
+        `label_mapping` changes.
+        '''
+        labels = tuple(self.label_mapping)
+        cached = self._regexes.get(name)
+        if cached is None or cached[0] != labels:
+            cached = (labels, factory(list(labels)))
+            self._regexes[name] = cached
+        return cached[1]
+
+    def iter_items(self, response: str, size: int) -> Iterator[Tuple]:
+        ''' Yield the raw (entity, entity_type) pairs of a response if `size` is 2, or its
+        (subject, predicate, object) triples if it is 3. With the JSON output format, they are read from
+        the JSON records of the response, or from its tuples if it has none.
+        '''
+        if self.output_format == OutputFormat.JSON:
+            items = list(iter_json_tuples(response, size))
+            if items:
+                return iter(items)
+        return (item for _, item in iter_tuples(response, list(self.label_mapping), size))
+
     @staticmethod
     def re_strip(text: str) -> str:
-        return re.sub(r'(^[\'"\s]+|[\'"\s]+$)', '', text)
+        return RE_STRIP_REGEX.sub('', text)
 
-    def ner(self, text: str, hint: Optional[str] = None, formatter: Optional[NERFormatter] = None):
-        if formatter is not None and formatter not in NERFormatter.values():
+    @staticmethod
+    def _check_formatter(formatter: Optional[str], formatters: type, task_name: str) -> None:
+        if formatter is not None and formatter not in formatters.values():
             raise ValueError(
-                f'Invalid formatter `{formatter}`, please specify formatter from NERFormatter for the NER task.')
-        prompt = self.template.render(
-            labels=list(self.label_mapping.keys()),
-            text=text,
-            hint=hint)
-        resp = self.model.predict(prompt)
-        ret = deepcopy(resp)
+                f'Invalid formatter `{formatter}`, '
+                f'please specify formatter from {formatters.__name__} for the {task_name} task.')
+
+    def split_text(self, text: str) -> List[Tuple[int, str]]:
+        ''' Split a long text into overlapping chunks, see `utils.chunk_text`.
+        '''
+        tokenizer = getattr(self.model, 'tokenizer', None)
+        if tokenizer is None:
+            return [(0, text)]
+        max_chunk_tokens = self.max_chunk_tokens or self.model.max_tokens // 2
+        return chunk_text(text, tokenizer, max_chunk_tokens, self.chunk_overlap_tokens)
+
+    def _finish(self, prompt: str, data: Dict, parse: Callable, observe: bool = True) -> Dict:
+        ''' Parse the model output, record the timings of the prompt and of parsing, then report the request.
+        '''
+        start_time = time.perf_counter()
+        data['meta'] = meta = data['meta'] or {}
+        timings = meta['timings'] = dict(meta.get('timings') or {})
+        for stage, seconds in getattr(prompt, 'timings', {}).items():
+            timings[stage] = timings.get(stage, 0.) + seconds
+        ret = self._parse(data, parse)
+        timings = ret['meta']['timings']
+        timings[Stages.Parse] = time.perf_counter() - start_time - timings.get(Stages.Format, 0.)
+        self._observe_completion(prompt, ret)
+        if observe:
+            self.instrumentation.observe(self.task, ret['meta'])
+        return ret
+
+    def _observe_completion(self, prompt: str, ret: Dict) -> None:
+        meta = ret['meta']
+        scale = getattr(prompt, 'completion_scale', None)
+        if self.completion_budget is None or scale is None or meta.get('cache_hit') or 'completion_tokens' not in meta:
+            return
+        # the budget is per completion, the usage sums the sampled ones and the truncated one
+        n_tokens = meta['completion_tokens'] - meta.get('truncated_tokens', 0)
+        self.completion_budget.observe(scale, n_tokens / len(ret.get('responses') or [None]))
+
+    def _parse(self, data: Dict, parse: Callable) -> Dict:
+        ''' Parse the response, or vote the results parsed from each completion if several are sampled.
+        '''
+        responses = data.get('responses')
+        if not responses or len(responses) < 2:
+            return parse(data)
+        # the voted result is formatted once
+        formatter = parse.keywords.get('formatter')
+        rets = [parse(dict(data, response=response), formatter=None) for response in responses]
+        ret = self._copy_output(rets[0])
+        ret['result'] = vote_results(self.task, [r['result'] for r in rets], threshold=self.vote_threshold)
+        ret['meta']['n_samples'] = len(responses)
+        return self._format(ret, formatter)
+
+    @staticmethod
+    def _copy_output(resp: Dict) -> Dict:
+        ''' Copy an output to parse it, only its meta is changed, the request and response are shared.
+        '''
+        ret = dict(resp)
+        if resp['meta'] is not None:
+            ret['meta'] = dict(resp['meta'])
+            if 'timings' in ret['meta']:
+                ret['meta']['timings'] = dict(ret['meta']['timings'])
+        return ret
+
+    def _format(self, ret: Dict, formatter=None) -> Union[Dict, Annotation]:
+        ''' Format a parsed output, or make its record with `typed_results`.
+        '''
+        if self.typed_results:
+            return Annotation.from_dict(ret, self.task, formatter=formatter)
+        if self.task == Tasks.NER:
+            return self._format_ner(ret, formatter)
+        if self.task in (Tasks.Classification, Tasks.MultiLabelClassification):
+            return self._format_classification(ret, formatter)
+        if self.task == Tasks.DataAugmentation:
+            return self._format_data_augmentation(ret, formatter)
+        return self._format_relation_extraction(ret, formatter)
+
+    def _run(self, prompt: str, parse: Callable) -> Dict:
+        ret = self._finish(prompt, self.model.predict(prompt), parse)
+        level = 0
+        while level < len(self.cascade) and self.should_escalate(ret):
+            model = self.cascade[level]
+            level += 1
+            prompt = self._escalate_prompt(prompt, model)
+            ret = self._finish(prompt, model.predict(prompt), parse)
+        return self._record_level(ret, level)
+
+    async def _arun(self, prompt: str, parse: Callable) -> Dict:
+        ret = self._finish(prompt, await self.model.apredict(prompt), parse)
+        level = 0
+        while level < len(self.cascade) and self.should_escalate(ret):
+            model = self.cascade[level]
+            level += 1
+            prompt = self._escalate_prompt(prompt, model)
+            ret = self._finish(prompt, await model.apredict(prompt), parse)
+        return self._record_level(ret, level)
+
+    async def _arun_chunks(self, prepare: Callable, chunks: List[Tuple[int, str]], hint: Optional[str]) -> List[Dict]:
+        ''' Annotate the chunks of a long text, at most `DEFAULT_CHUNK_WORKERS` of them at once as the sync path.
+        '''
+        semaphore = asyncio.Semaphore(DEFAULT_CHUNK_WORKERS)
+
+        async def run(chunk):
+            async with semaphore:
+                return await self._arun(*prepare(chunk, hint=hint))
+
+        return await asyncio.gather(*[run(chunk) for _, chunk in chunks])
+
+    def should_escalate(self, ret: Dict) -> bool:
+        ''' Whether the output of a level of the cascade is sent to the next level.
+        '''
+        if not self._is_parsed(ret, ret['response']):
+            return True
+        confidence = ret['result'].get('confidence')
+        if self.min_confidence is None or confidence is None:
+            return False
+        if isinstance(confidence, list):
+            return bool(confidence) and min(confidence) < self.min_confidence
+        return confidence < self.min_confidence
+
+    def _escalate_prompt(self, prompt: str, model: BaseModel) -> Prompt:
+        # the prompt is rendered once, its tokens are counted again if the model has another tokenizer
+        n_tokens = getattr(prompt, 'n_tokens', None)
+        if getattr(model, 'tokenizer', None) is not getattr(self.model, 'tokenizer', None):
+            n_tokens = None
+        return Prompt(prompt, n_tokens=n_tokens, max_completion_tokens=getattr(prompt, 'max_completion_tokens', None),
+                      completion_scale=getattr(prompt, 'completion_scale', None))
+
+    def _record_level(self, ret: Dict, level: int) -> Dict:
+        if self.cascade:
+            ret['meta']['cascade_level'] = level
+            with self._cascade_lock:
+                self._cascade_counts[level] += 1
+        return ret
+
+    def cascade_stats(self) -> Dict:
+        ''' Number of outputs answered by each level of the cascade, and escalated to each level.
+        '''
+        with self._cascade_lock:
+            counts = list(self._cascade_counts)
+        return {'items': sum(counts), 'answered': counts,
+                'escalated': [sum(counts[level:]) for level in range(1, len(counts))]}
+
+    def _merge_chunk_outputs(self, text: str, rets: List[Dict]) -> Dict:
+        ret = self.model.get_output_template()
+        ret['request'] = {'prompts': [r['request']['prompt'] for r in rets]}
+        ret['response'] = '\n'.join(r['response'] for r in rets)
+        meta = {'n_chunks': len(rets)}
+        for r in rets:
+            for key, value in r['meta'].items():
+                if key == 'taken_time':
+                    # chunks are annotated concurrently
+                    meta[key] = max(meta.get(key, 0), value)
+                elif isinstance(value, bool):
+                    meta[key] = meta.get(key, True) and value
+                elif key == 'timings':
+                    timings = meta.setdefault(key, {})
+                    for stage, seconds in value.items():
+                        timings[stage] = timings.get(stage, 0.) + seconds
+                elif isinstance(value, (int, float)):
+                    meta[key] = meta.get(key, 0) + value
+                else:
+                    meta.setdefault(key, value)
+        ret['meta'] = meta
+        ret['result'] = {'text': text}
+        return ret
+
+    def _merge_ner_chunks(self,
+                          text: str,
+                          chunks: List[Tuple[int, str]],
+                          rets: List[Dict],
+                          formatter: Optional[NERFormatter] = None) -> Dict:
+        ret = self._merge_chunk_outputs(text, rets)
+        spans, confidences = set(), {}
+        for (offset, _), r in zip(chunks, rets):
+            for i, (start, end, entity, entity_type) in enumerate(r['result'].get('entities', [])):
+                span = (start + offset, end + offset, entity, entity_type)
+                spans.add(span)
+                if 'confidence' in r['result']:
+                    confidences[span] = max(confidences.get(span, 0.), r['result']['confidence'][i])
+        # drop the duplicates of the overlap regions, the longest span wins on overlapping entities
+        entities, prev_end = [], 0
+        for entity in sorted(spans, key=lambda x: (x[0], -x[1])):
+            if entity[0] >= prev_end:
+                entities.append(entity)
+                prev_end = entity[1]
+        if not entities:
+            return self._format(ret)
+        ret['result']['entities'] = entities
+        if confidences:
+            ret['result']['confidence'] = [confidences[entity] for entity in entities]
+        return self._format(ret, formatter)
+
+    def _merge_relation_extraction_chunks(self,
+                                          text: str,
+                                          rets: List[Dict],
+                                          formatter: Optional[Formatter] = None) -> Dict:
+        ret = self._merge_chunk_outputs(text, rets)
+        ret['result']['triples'] = list(dict.fromkeys(triple for r in rets for triple in r['result']['triples']))
+        confidences = {}
+        for r in rets:
+            for triple, confidence in zip(r['result']['triples'], r['result'].get('confidence', [])):
+                confidences[triple] = max(confidences.get(triple, 0.), confidence)
+        if confidences:
+            ret['result']['confidence'] = [confidences[triple] for triple in ret['result']['triples']]
+        return self._format(ret, formatter)
+
+    def _prepare_ner(self, text: str, hint: Optional[str] = None, formatter: Optional[NERFormatter] = None):
+        self._check_formatter(formatter, NERFormatter, 'NER')
+        prompt = self.render_prompt(text, hint=hint)
+        return prompt, partial(self._parse_ner, text, formatter=formatter)
+
+    def _parse_ner(self, text: str, resp: Dict, formatter: Optional[NERFormatter] = None) -> Dict:
+        ret = self._copy_output(resp)
         ret['result'] = {}
         ret['result']['text'] = text
         entity_map = {}
-        pair_regex = GPTAnnotator.make_ner_extraction_regex(self.label_mapping.keys())
-        for match in pair_regex.finditer(ret['response']):
-            entity, entity_type = match.group('entity'), match.group('entity_type')
+        for entity, entity_type in self.iter_items(ret['response'], 2):
             entity = self.re_strip(entity)
             entity_type = self.re_strip(entity_type)
             if entity_type not in self.label_mapping:
@@ -126,50 +443,165 @@ class GPTAnnotator(BaseAnnotator):
                 continue
             entity_map[entity] = self.label_mapping[entity_type]
         if not entity_map:
-            return ret
+            return self._format(ret)
         # find positions
-        safe_entities = [re.escape(ent) for ent in entity_map]
         entities = []
-        for matched in re.finditer(r'(%s)' % ('|'.join(safe_entities)), text):
-            entity = matched.group()
-            start, end = matched.span()
+        for start, end in AhoCorasick(entity_map).find_all(text):
+            entity = text[start: end]
             entities.append((start, end, entity, entity_map[entity]))
         ret['result']['entities'] = entities
+        return self._format(ret, formatter)
+
+    @staticmethod
+    def _get_timings(ret: Dict) -> Optional[Dict]:
+        return ret['meta'].get('timings') if ret['meta'] else None
+
+    @staticmethod
+    def _format_ner(ret: Dict, formatter: Optional[NERFormatter] = None) -> Dict:
         if formatter is not None:
-            if formatter == NERFormatter.BIO:
-                ret['result']['formatted_result'] = GPTAnnotator.format_ner_to_bio(
-                    ret['result']['text'], ret['result']['entities'])
-            elif formatter == NERFormatter.Segment:
-                ret['result']['formatted_result'] = GPTAnnotator.format_ner_to_segment(
-                    ret['result']['text'], ret['result']['entities'])
+            with timed(GPTAnnotator._get_timings(ret), Stages.Format):
+                if formatter == NERFormatter.BIO:
+                    ret['result']['formatted_result'] = GPTAnnotator.format_ner_to_bio(
+                        ret['result']['text'], ret['result']['entities'])
+                elif formatter == NERFormatter.Segment:
+                    ret['result']['formatted_result'] = GPTAnnotator.format_ner_to_segment(
+                        ret['result']['text'], ret['result']['entities'])
+        return ret
+
+    def ner(self, text: str, hint: Optional[str] = None, formatter: Optional[NERFormatter] = None):
+        chunks = self.split_text(text)
+        if len(chunks) > 1:
+            self._check_formatter(formatter, NERFormatter, 'NER')
+            rets = list(imap_ordered(lambda chunk: self._run(*self._prepare_ner(chunk[1], hint=hint)),
+                                     chunks, min(len(chunks), DEFAULT_CHUNK_WORKERS)))
+            return self._merge_ner_chunks(text, chunks, rets, formatter=formatter)
+        return self._run(*self._prepare_ner(text, hint=hint, formatter=formatter))
+
+    async def aner(self, text: str, hint: Optional[str] = None, formatter: Optional[NERFormatter] = None):
+        chunks = self.split_text(text)
+        if len(chunks) > 1:
+            self._check_formatter(formatter, NERFormatter, 'NER')
+            rets = await self._arun_chunks(self._prepare_ner, chunks, hint)
+            return self._merge_ner_chunks(text, chunks, rets, formatter=formatter)
+        return await self._arun(*self._prepare_ner(text, hint=hint, formatter=formatter))
+
+    def _prepare_classification(self,
+                                text: str,
+                                hint: Optional[str] = None,
+                                formatter: Optional[Formatter] = None,
+                                is_multilabel: bool = False):
+        self._check_formatter(formatter, Formatter, 'classification')
+        prompt = self.render_prompt(text, hint=hint)
+        return prompt, partial(self._parse_classification, text, formatter=formatter, is_multilabel=is_multilabel)
+
+    def _parse_classification(self,
+                              text: str,
+                              resp: Dict,
+                              formatter: Optional[Formatter] = None,
+                              is_multilabel: bool = False) -> Dict:
+        ret = self._copy_output(resp)
+        ret['result'] = {}
+        ret['result']['text'] = text
+        label_regex = self.get_regex('classification', self.make_classification_extraction_regex)
+        labels = label_regex.findall(ret['response'])
+        if not labels:
+            return self._format(ret)
+        ret['result']['label'] = labels if is_multilabel else labels[0]
+        return self._format(ret, formatter)
+
+    @staticmethod
+    def _format_classification(ret: Dict, formatter: Optional[Formatter] = None) -> Dict:
+        if formatter is not None and 'label' in ret['result']:
+            with timed(GPTAnnotator._get_timings(ret), Stages.Format):
+                if formatter == Formatter.JSONL:
+                    ret['result']['formatted_result'] = json.dumps(
+                        {'text': ret['result']['text'], 'label': ret['result']['label']}, ensure_ascii=False)
         return ret
 
     def classification(self,
                        text: str,
                        hint: Optional[str] = None,
                        formatter: Optional[Formatter] = None,
-                       is_multilabel: bool = False):
-        if formatter is not None and formatter not in Formatter.values():
-            raise ValueError(
-                f'Invalid formatter `{formatter}`, '
-                'please specify formatter from Formatter for the classification task.')
-        prompt = self.template.render(
-            labels=list(self.label_mapping.keys()),
-            text=text,
-            hint=hint)
-        resp = self.model.predict(prompt)
-        ret = deepcopy(resp)
+                       is_multilabel: bool = False,
+                       stream: bool = False):
+        ''' Classify text. With `stream`, the response is streamed and a single-label classification
+        stops as soon as a label is found.
+        '''
+        prompt, parse = self._prepare_classification(text, hint=hint, formatter=formatter, is_multilabel=is_multilabel)
+        if not stream:
+            return self._run(prompt, parse)
+        start_time = time.perf_counter()
+        parser = StreamParser(self)
+        deltas = self.model.predict_stream(prompt)
+        try:
+            for delta in deltas:
+                parser.feed(delta)
+                if parser.done:
+                    break
+        finally:
+            deltas.close()
+        return self._finish(prompt, self._make_stream_output(prompt, parser, start_time), parse)
+
+    async def aclassification(self,
+                              text: str,
+                              hint: Optional[str] = None,
+                              formatter: Optional[Formatter] = None,
+                              is_multilabel: bool = False,
+                              stream: bool = False):
+        prompt, parse = self._prepare_classification(text, hint=hint, formatter=formatter, is_multilabel=is_multilabel)
+        if not stream:
+            return await self._arun(prompt, parse)
+        start_time = time.perf_counter()
+        parser = StreamParser(self)
+        deltas = self.model.apredict_stream(prompt)
+        try:
+            async for delta in deltas:
+                parser.feed(delta)
+                if parser.done:
+                    break
+        finally:
+            await deltas.aclose()
+        return self._finish(prompt, self._make_stream_output(prompt, parser, start_time), parse)
+
+    def _make_stream_output(self, prompt: str, parser: StreamParser, start_time: float) -> Dict:
+        data = self.model.get_output_template()
+        data['request'] = {'prompt': prompt}
+        data['response'] = parser.buffer
+        taken_time = time.perf_counter() - start_time
+        data['meta'] = {'stream': True, 'early_stopped': parser.done, 'taken_time': round(taken_time, 5),
+                        'timings': {Stages.Network: taken_time}}
+        return data
+
+    def _prepare_data_augmentation(self,
+                                   text: str,
+                                   hint: Optional[str] = None,
+                                   formatter: Optional[Formatter] = None,
+                                   size: int = 1):
+        self._check_formatter(formatter, Formatter, 'data augmentation')
+        prompt = self.render_prompt(text, hint=hint, size=size)
+        return prompt, partial(self._parse_data_augmentation, text, formatter=formatter)
+
+    def _parse_data_augmentation(self, text: str, resp: Dict, formatter: Optional[Formatter] = None) -> Dict:
+        ret = self._copy_output(resp)
         ret['result'] = {}
         ret['result']['text'] = text
-        label_regex = self.make_classification_extraction_regex(list(self.label_mapping.keys()))
-        labels = label_regex.findall(ret['response'])
-        if not labels:
-            return ret
-        ret['result']['label'] = labels if is_multilabel else labels[0]
+        sentences = []
+        if self.output_format == OutputFormat.JSON:
+            sentences = [sentence.strip() for sentence in iter_json_strings(ret['response'])]
+        if not sentences:
+            regex = self.make_data_augmentation_regex()
+            for matched in regex.finditer(ret['response'].rstrip('\n') + '\n'):
+                sentences.append(matched.group('sentence').strip())
+        ret['result']['sentences'] = sentences
+        return self._format(ret, formatter)
+
+    @staticmethod
+    def _format_data_augmentation(ret: Dict, formatter: Optional[Formatter] = None) -> Dict:
         if formatter is not None:
-            if formatter == Formatter.JSONL:
-                ret['result']['formatted_result'] = json.dumps(
-                    {'text': ret['result']['text'], 'label': ret['result']['label']}, ensure_ascii=False)
+            with timed(GPTAnnotator._get_timings(ret), Stages.Format):
+                if formatter == Formatter.JSONL:
+                    ret['result']['formatted_result'] = json.dumps(
+                        {'text': ret['result']['text'], 'sentences': ret['result']['sentences']}, ensure_ascii=False)
         return ret
 
     def data_augmentation(self,
@@ -177,69 +609,632 @@ class GPTAnnotator(BaseAnnotator):
                           hint: Optional[str] = None,
                           formatter: Optional[Formatter] = None,
                           size: int = 1):
-        if formatter is not None and formatter not in Formatter.values():
-            raise ValueError(
-                f'Invalid formatter `{formatter}`, '
-                'please specify formatter from Formatter for the data augmentation task.')
-        prompt = self.template.render(
-            text=text,
-            hint=hint,
-            size=size)
-        resp = self.model.predict(prompt)
-        ret = deepcopy(resp)
+        return self._run(*self._prepare_data_augmentation(text, hint=hint, formatter=formatter, size=size))
+
+    async def adata_augmentation(self,
+                                 text: str,
+                                 hint: Optional[str] = None,
+                                 formatter: Optional[Formatter] = None,
+                                 size: int = 1):
+        return await self._arun(*self._prepare_data_augmentation(text, hint=hint, formatter=formatter, size=size))
+
+    def _prepare_relation_extraction(self,
+                                     text: str,
+                                     hint: Optional[str] = None,
+                                     formatter: Optional[Formatter] = None):
+        self._check_formatter(formatter, Formatter, 'relation extraction')
+        prompt = self.render_prompt(text, hint=hint)
+        return prompt, partial(self._parse_relation_extraction, text, formatter=formatter)
+
+    def _parse_relation_extraction(self, text: str, resp: Dict, formatter: Optional[Formatter] = None) -> Dict:
+        ret = self._copy_output(resp)
         ret['result'] = {}
         ret['result']['text'] = text
-        regex = self.make_data_augmentation_regex()
-        sentences = []
-        for matched in regex.finditer(ret['response'].rstrip('\n') + '\n'):
-            sentences.append(matched.group('sentence').strip())
-        ret['result']['sentences'] = sentences
+        triples = []
+        for item in self.iter_items(ret['response'], 3):
+            triple = tuple(self.re_strip(x) for x in item)
+            if triple[1] in self.label_mapping:
+                triples.append(triple)
+        ret['result']['triples'] = triples
+        return self._format(ret, formatter)
+
+    @staticmethod
+    def _format_relation_extraction(ret: Dict, formatter: Optional[Formatter] = None) -> Dict:
         if formatter is not None:
-            if formatter == Formatter.JSONL:
-                ret['result']['formatted_result'] = json.dumps(
-                    {'text': ret['result']['text'], 'sentences': ret['result']['sentences']}, ensure_ascii=False)
+            with timed(GPTAnnotator._get_timings(ret), Stages.Format):
+                if formatter == Formatter.JSONL:
+                    ret['result']['formatted_result'] = json.dumps(ret['result'], ensure_ascii=False)
         return ret
 
     def relation_extraction(self,
                             text: str,
                             hint: Optional[str] = None,
                             formatter: Optional[Formatter] = None):
-        if formatter is not None and formatter not in Formatter.values():
-            raise ValueError(
-                f'Invalid formatter `{formatter}`, '
-                'please specify formatter from Formatter for the classification task.')
-        prompt = self.template.render(
-            labels=list(self.label_mapping.keys()),
-            text=text,
-            hint=hint)
-        resp = self.model.predict(prompt)
-        ret = deepcopy(resp)
-        ret['result'] = {}
-        ret['result']['text'] = text
-        regex = self.make_relation_extraction_regex(list(self.label_mapping.keys()))
-        triples = []
-        for matched in regex.finditer(ret['response']):
-            triples.append((self.re_strip(matched.group('subject')),
-                            self.re_strip(matched.group('predicate')),
-                            self.re_strip(matched.group('object'))))
-        ret['result']['triples'] = triples
-        if formatter is not None:
-            if formatter == Formatter.JSONL:
-                ret['result']['formatted_result'] = json.dumps(ret['result'], ensure_ascii=False)
-        return ret
+        chunks = self.split_text(text)
+        if len(chunks) > 1:
+            self._check_formatter(formatter, Formatter, 'relation extraction')
+            rets = list(imap_ordered(lambda chunk: self._run(*self._prepare_relation_extraction(chunk[1], hint=hint)),
+                                     chunks, min(len(chunks), DEFAULT_CHUNK_WORKERS)))
+            return self._merge_relation_extraction_chunks(text, rets, formatter=formatter)
+        return self._run(*self._prepare_relation_extraction(text, hint=hint, formatter=formatter))
+
+    async def arelation_extraction(self,
+                                   text: str,
+                                   hint: Optional[str] = None,
+                                   formatter: Optional[Formatter] = None):
+        chunks = self.split_text(text)
+        if len(chunks) > 1:
+            self._check_formatter(formatter, Formatter, 'relation extraction')
+            rets = await self._arun_chunks(self._prepare_relation_extraction, chunks, hint)
+            return self._merge_relation_extraction_chunks(text, rets, formatter=formatter)
+        return await self._arun(*self._prepare_relation_extraction(text, hint=hint, formatter=formatter))
+
+    def _prepare(self, text: str, hint: Optional[str] = None, formatter=None, **kwargs):
+        ''' Render the prompt of the current task and bind the response parser to it.
+        '''
+        text = text.replace('\n', '')
+        if self.task == Tasks.NER:
+            return self._prepare_ner(text, hint=hint, formatter=formatter)
+        elif self.task == Tasks.Classification:
+            return self._prepare_classification(text, hint=hint, formatter=formatter, is_multilabel=False)
+        elif self.task == Tasks.MultiLabelClassification:
+            return self._prepare_classification(text, hint=hint, formatter=formatter, is_multilabel=True)
+        elif self.task == Tasks.DataAugmentation:
+            return self._prepare_data_augmentation(text, hint=hint, formatter=formatter, size=kwargs.get('size', 1))
+        elif self.task == Tasks.RelationExtraction:
+            return self._prepare_relation_extraction(text, hint=hint, formatter=formatter)
+        raise ValueError(f'Unsupported task `{self.task}`, please specify task from Tasks.')
 
     def tag(self, text: str, hint: Optional[str] = None, formatter=None, **kwargs):
         text = text.replace('\n', '')
         if self.task == Tasks.NER:
             return self.ner(text, hint=hint, formatter=formatter)
         elif self.task == Tasks.Classification:
-            return self.classification(text, hint=hint, formatter=formatter, is_multilabel=False)
+            return self.classification(text, hint=hint, formatter=formatter, is_multilabel=False,
+                                       stream=kwargs.get('stream', False))
         elif self.task == Tasks.MultiLabelClassification:
-            return self.classification(text, hint=hint, formatter=formatter, is_multilabel=True)
+            return self.classification(text, hint=hint, formatter=formatter, is_multilabel=True,
+                                       stream=kwargs.get('stream', False))
         elif self.task == Tasks.DataAugmentation:
             return self.data_augmentation(text, hint=hint, formatter=formatter, size=kwargs.get('size', 1))
         elif self.task == Tasks.RelationExtraction:
             return self.relation_extraction(text, hint=hint, formatter=formatter)
+        raise ValueError(f'Unsupported task `{self.task}`, please specify task from Tasks.')
+
+    async def atag(self, text: str, hint: Optional[str] = None, formatter=None, **kwargs):
+        text = text.replace('\n', '')
+        if self.task == Tasks.NER:
+            return await self.aner(text, hint=hint, formatter=formatter)
+        elif self.task == Tasks.Classification:
+            return await self.aclassification(text, hint=hint, formatter=formatter, is_multilabel=False,
+                                              stream=kwargs.get('stream', False))
+        elif self.task == Tasks.MultiLabelClassification:
+            return await self.aclassification(text, hint=hint, formatter=formatter, is_multilabel=True,
+                                              stream=kwargs.get('stream', False))
+        elif self.task == Tasks.DataAugmentation:
+            return await self.adata_augmentation(text, hint=hint, formatter=formatter, size=kwargs.get('size', 1))
+        elif self.task == Tasks.RelationExtraction:
+            return await self.arelation_extraction(text, hint=hint, formatter=formatter)
+        raise ValueError(f'Unsupported task `{self.task}`, please specify task from Tasks.')
+
+    def _convert_stream_items(self, text: str, items: List, spans: List[Tuple[int, int]]) -> Iterator:
+        ''' Convert the parsed items to results. The occurrences of an entity which overlap the sorted `spans`
+        of the entities yielded before are skipped, as the matcher of `tag` does not return overlapping entities.
+        '''
+        for item in items:
+            if self.task != Tasks.NER:
+                yield item
+                continue
+            entity, entity_type = item
+            if not entity or entity_type not in self.label_mapping:
+                continue
+            start = text.find(entity)
+            while start != -1:
+                end = start + len(entity)
+                i = bisect.bisect(spans, (start, end))
+                if (i == 0 or spans[i - 1][1] <= start) and (i == len(spans) or spans[i][0] >= end):
+                    spans.insert(i, (start, end))
+                    yield (start, end, entity, self.label_mapping[entity_type])
+                start = text.find(entity, end)
+
+    def stream(self, text: str, hint: Optional[str] = None, **kwargs) -> Iterator:
+        ''' Stream the response and yield results as soon as they are complete:
+        (start, end, entity, entity_type) for NER, (subject, predicate, object) for relation extraction,
+        labels for classification and sentences for data augmentation.
+        A single-label classification stops the stream once its label is found. An entity overlapping one
+        streamed before is skipped, so the longer of two nested entities is only kept if it is streamed first.
+        '''
+        text = text.replace('\n', '')
+        prompt, _ = self._prepare(text, hint=hint, **kwargs)
+        parser, spans = StreamParser(self), []
+        deltas = self.model.predict_stream(prompt)
+        try:
+            for delta in deltas:
+                yield from self._convert_stream_items(text, parser.feed(delta), spans)
+                if parser.done:
+                    return
+            yield from self._convert_stream_items(text, parser.close(), spans)
+        finally:
+            deltas.close()
+
+    async def astream(self, text: str, hint: Optional[str] = None, **kwargs) -> AsyncIterator:
+        ''' Asynchronous version of `stream`.
+        '''
+        text = text.replace('\n', '')
+        prompt, _ = self._prepare(text, hint=hint, **kwargs)
+        parser, spans = StreamParser(self), []
+        deltas = self.model.apredict_stream(prompt)
+        try:
+            async for delta in deltas:
+                for item in self._convert_stream_items(text, parser.feed(delta), spans):
+                    yield item
+                if parser.done:
+                    return
+            for item in self._convert_stream_items(text, parser.close(), spans):
+                yield item
+        finally:
+            await deltas.aclose()
+
+    async def atag_many(self,
+                        texts: Union[AsyncIterable[str], Iterable[str]],
+                        hint: Optional[str] = None,
+                        formatter=None,
+                        concurrency: int = DEFAULT_CONCURRENCY,
+                        **kwargs) -> AsyncIterator[Dict]:
+        ''' Tag texts from an (async) iterable, keeping at most `concurrency` requests in flight.
+        Results are yielded in input order.
+        '''
+        if concurrency < 1:
+            raise ValueError(f'`concurrency` should be greater than 0, got {concurrency}')
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run(text):
+            async with semaphore:
+                return await self.atag(text, hint=hint, formatter=formatter, **kwargs)
+
+        async def iterate():
+            if hasattr(texts, '__aiter__'):
+                async for text in texts:
+                    yield text
+            else:
+                for text in texts:
+                    yield text
+
+        # bound the number of pending tasks so that memory does not grow with the input size
+        pending = deque()
+        try:
+            async for text in iterate():
+                pending.append(asyncio.ensure_future(run(text)))
+                if len(pending) >= 2 * concurrency:
+                    yield await pending.popleft()
+            while pending:
+                yield await pending.popleft()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _make_error_output(self, text: str, error: Exception) -> Dict:
+        ret = self.model.get_output_template()
+        ret['result'] = {'text': text}
+        ret['error'] = f'{type(error).__name__}: {error}'
+        return self._format(ret)
+
+    def _safe_tag(self, text: str, hint: Optional[str] = None, formatter=None, raise_on_error: bool = False, **kwargs):
+        try:
+            return self.tag(text, hint=hint, formatter=formatter, **kwargs)
+        except Exception as e:
+            if raise_on_error:
+                raise
+            return self._make_error_output(text, e)
+
+    def _anchor_entities(self, ret: Dict, text: str, meta: Dict, formatter=None) -> Optional[Dict]:
+        ''' Locate the entities of a representative in the text of its duplicate, which may differ in case,
+        width and punctuation, by matching their normalized texts and mapping the spans back to the text.
+        Return None if an entity is not found in the duplicate.
+        '''
+        result = ret['result']
+        labels, confidences = {}, {}
+        for i, (_, _, entity, entity_type) in enumerate(result.get('entities') or ()):
+            key = align_normalized(entity)[0]
+            if not key:
+                return None
+            labels[key] = entity_type
+            if 'confidence' in result:
+                confidences[key] = max(confidences.get(key, 0.), result['confidence'][i])
+        normalized, offsets = align_normalized(text)
+        spans = [(start, end, normalized[start: end]) for start, end in AhoCorasick(labels).find_all(normalized)]
+        if len({key for _, _, key in spans}) < len(labels):
+            return None
+        out = dict(ret, meta=meta, result={'text': text})
+        if not spans:
+            return self._format(out)
+        entities = []
+        for start, end, key in spans:
+            start, end = offsets[start], offsets[end - 1] + 1
+            entities.append((start, end, text[start: end], labels[key]))
+        out['result']['entities'] = entities
+        if confidences:
+            out['result']['confidence'] = [confidences[key] for _, _, key in spans]
+        return self._format(out, formatter)
+
+    def _fan_out(self,
+                 ret: Dict,
+                 text: str,
+                 index: int,
+                 tag: Callable[[str], Dict],
+                 hint: Optional[str] = None,
+                 formatter=None,
+                 **kwargs) -> Dict:
+        ''' Build the output of a duplicate from the output of its representative at `index`. NER entities are
+        located in the text of the duplicate, and the other responses are parsed again against it.
+        A duplicate whose entities cannot be located is annotated with `tag` instead.
+        '''
+        original, text = text, text.replace('\n', '')
+        if 'error' in ret:
+            out = self.model.get_output_template()
+            out['result'] = {'text': text}
+            out['error'] = ret['error']
+            return self._format(out)
+        meta = dict(ret['meta'] or {}, duplicate_of=index)
+        if self.task == Tasks.NER:
+            out = self._anchor_entities(ret, text, meta, formatter=formatter)
+            return tag(original) if out is None else out
+        parse = self._prepare(text, hint=hint, formatter=formatter, **kwargs)[1]
+        return self._parse(dict(ret, meta=meta), parse)
+
+    def _imap_dedup(self,
+                    texts: Iterable[str],
+                    imap: Callable[[Iterable[str]], Iterator[Dict]],
+                    index: Union[NearDuplicateIndex, bool],
+                    tag: Callable[[str], Dict],
+                    hint: Optional[str] = None,
+                    formatter=None,
+                    **kwargs) -> Iterator[Dict]:
+        ''' Only annotate the first text of each group of near-duplicates with `imap`,
+        and yield the outputs of all the texts in input order.
+        '''
+        if not isinstance(index, NearDuplicateIndex):
+            index = NearDuplicateIndex()
+        # (position, text, position of the representative) of the texts read so far, in input order
+        pending = deque()
+        # the outputs of the representatives kept by the index, least recently matched first
+        outputs = OrderedDict()
+
+        def iter_unique():
+            for i, text in enumerate(texts):
+                representative = index.add(text)
+                pending.append((i, text, representative))
+                if representative == i:
+                    yield text
+
+        def flush_duplicates():
+            # a duplicate comes after its representative, whose output is already known here unless it was evicted
+            while pending and pending[0][2] != pending[0][0]:
+                i, text, representative = pending.popleft()
+                if representative not in outputs:
+                    yield tag(text)
+                    continue
+                outputs.move_to_end(representative)
+                yield self._fan_out(outputs[representative], text, representative, tag,
+                                    hint=hint, formatter=formatter, **kwargs)
+
+        for ret in imap(iter_unique()):
+            yield from flush_duplicates()
+            i, _, _ = pending.popleft()
+            outputs[i] = ret
+            if index.max_texts is not None and len(outputs) > index.max_texts:
+                outputs.popitem(last=False)
+            yield ret
+        yield from flush_duplicates()
+
+    def imap(self,
+             texts: Iterable[str],
+             hint: Optional[str] = None,
+             formatter=None,
+             num_workers: int = DEFAULT_CONCURRENCY,
+             raise_on_error: bool = False,
+             dedup: Union[NearDuplicateIndex, bool] = False,
+             **kwargs) -> Iterator[Dict]:
+        ''' Lazily tag texts on a thread pool and yield the results in input order.
+        At most `2 * num_workers` texts are read ahead, so any iterable (e.g. a file) can be consumed.
+        A failed item yields an output with an `error` field unless `raise_on_error` is set.
+        With `dedup`, near-duplicate texts are annotated once, see `dedup.NearDuplicateIndex`.
+        The outputs of the duplicates have the position of their representative in `meta['duplicate_of']`.
+        '''
+        func = partial(self._safe_tag, hint=hint, formatter=formatter, raise_on_error=raise_on_error, **kwargs)
+        if dedup:
+            return self._imap_dedup(texts, lambda unique: imap_ordered(func, unique, num_workers), dedup, func,
+                                    hint=hint, formatter=formatter, **kwargs)
+        return imap_ordered(func, texts, num_workers)
+
+    def tag_batch(self,
+                  texts: Iterable[str],
+                  hint: Optional[str] = None,
+                  formatter=None,
+                  num_workers: int = DEFAULT_CONCURRENCY,
+                  raise_on_error: bool = False,
+                  dedup: Union[NearDuplicateIndex, bool] = False,
+                  **kwargs) -> List[Dict]:
+        ''' Tag texts on a thread pool, see `imap`.
+        '''
+        return list(self.imap(texts, hint=hint, formatter=formatter, num_workers=num_workers,
+                              raise_on_error=raise_on_error, dedup=dedup, **kwargs))
+
+    def _render_template(self, text: str, hint: Optional[str] = None, **kwargs) -> str:
+        if self.task == Tasks.DataAugmentation:
+            return self.template.render(text=text, hint=hint, size=kwargs.get('size', 1))
+        return self.template.render(labels=list(self.label_mapping.keys()), text=text, hint=hint)
+
+    def get_static_parts(self, hint: Optional[str] = None, **kwargs) -> Optional[Tuple[str, str]]:
+        ''' Return the parts of the prompt before and after the text, cached per labels, hint and size.
+        It is None if the template does not use the text exactly once as is.
+        '''
+        key = (tuple(self.label_mapping or ()), hint, kwargs.get('size', 1))
+        parts = self._static_parts.get(key)
+        if parts is None:
+            parts = tuple(self._render_template(TEXT_SLOT, hint=hint, **kwargs).split(TEXT_SLOT))
+            if len(parts) != 2:
+                parts = ()
+            if len(self._static_parts) >= MAX_STATIC_TOKENS_CACHE_SIZE:
+                self._static_parts.clear()
+            self._static_parts[key] = parts
+        return parts or None
+
+    def _render(self, text: str, hint: Optional[str] = None, **kwargs) -> str:
+        parts = self.get_static_parts(hint=hint, **kwargs)
+        if parts is None:
+            return self._render_template(text, hint=hint, **kwargs)
+        return f'{parts[0]}{text}{parts[1]}'
+
+    def count_static_tokens(self, hint: Optional[str] = None, **kwargs) -> int:
+        ''' Count the tokens of the prompt without the text, it is cached per labels, hint and size.
+        '''
+        key = (tuple(self.label_mapping or ()), hint, kwargs.get('size', 1))
+        n_tokens = self._static_tokens.get(key)
+        if n_tokens is None:
+            parts = self.get_static_parts(hint=hint, **kwargs)
+            if parts is None:
+                parts = self._render_template(TEXT_SLOT, hint=hint, **kwargs).split(TEXT_SLOT)
+            n_tokens = len(self.model.tokenizer.encode(''.join(parts)))
+            if len(self._static_tokens) >= MAX_STATIC_TOKENS_CACHE_SIZE:
+                self._static_tokens.clear()
+            self._static_tokens[key] = n_tokens
+        return n_tokens
+
+    def render_prompt(self, text: str, hint: Optional[str] = None, **kwargs) -> Prompt:
+        ''' Render the prompt of text. Its number of tokens is the cached count of the static part
+        plus the count of the text, so only the text is tokenized per call.
+        '''
+        timings = {}
+        base_hint, n_example_tokens = hint, None
+        if self.examples is not None:
+            with timed(timings, Stages.Retrieve):
+                hint, n_example_tokens = self.add_examples(text, hint)
+        with timed(timings, Stages.Render):
+            if n_example_tokens is None:
+                prompt = self._render(text, hint=hint, **kwargs)
+            else:
+                # the examples differ per text, the static parts of their hint are not worth caching
+                prompt = self._render_template(text, hint=hint, **kwargs)
+        if getattr(self.model, 'tokenizer', None) is None:
+            return Prompt(prompt, timings=timings)
+        with timed(timings, Stages.Tokenize):
+            if n_example_tokens is None:
+                n_tokens = self.count_static_tokens(hint=hint, **kwargs)
+            else:
+                # the examples are counted when they are selected
+                n_tokens = self.count_static_tokens(hint=base_hint or '', **kwargs) + n_example_tokens
+            n_text_tokens = self.model.count_tokens(text)
+            n_tokens += n_text_tokens
+        if self.completion_budget is None:
+            return Prompt(prompt, n_tokens=n_tokens, timings=timings)
+        scale = self.get_completion_scale(n_text_tokens, **kwargs)
+        return Prompt(prompt, n_tokens=n_tokens, timings=timings, completion_scale=scale,
+                      max_completion_tokens=self.completion_budget.get(scale, self.get_completion_prior()))
+
+    def get_completion_scale(self, n_text_tokens: int, **kwargs) -> int:
+        ''' Unit of the completion budget of a text, see `budget.CompletionBudget`.
+        '''
+        if self.task in (Tasks.Classification, Tasks.MultiLabelClassification):
+            return 1
+        if self.task == Tasks.DataAugmentation:
+            return kwargs.get('size', 1) * n_text_tokens
+        return n_text_tokens
+
+    def get_completion_prior(self) -> float:
+        ''' Completion tokens per unit of scale of the task before any completion is observed,
+        it bounds the outputs of the format of the prompt.
+        '''
+        labels = tuple(self.label_mapping or ())
+        if self._completion_prior is None or self._completion_prior[0] != labels:
+            label_tokens = [self.model.count_tokens(label) for label in labels] or [0]
+            if self.task == Tasks.Classification:
+                prior = max(label_tokens) + 2
+            elif self.task == Tasks.MultiLabelClassification:
+                # every label and its separator
+                prior = sum(label_tokens) + 2 * len(label_tokens)
+            elif self.task == Tasks.DataAugmentation:
+                # a rewrite, its ordinal and line break
+                prior = 2
+            else:
+                # every token of the text quoted with the longest label, in a tuple or a JSON record
+                prior = max(label_tokens) + (12 if self.output_format == OutputFormat.JSON else 4)
+            self._completion_prior = (labels, prior)
+        return self._completion_prior[1]
+
+    def add_examples(self, text: str, hint: Optional[str] = None) -> Tuple[Optional[str], Optional[int]]:
+        ''' Append the examples most similar to text to the hint.
+        Return the hint and the number of tokens of the examples, which is None if no example is found.
+        '''
+        from ..fewshot import select_examples
+
+        # without a tokenizer, the number of characters bounds the number of tokens
+        count_tokens = self.model.count_tokens if getattr(self.model, 'tokenizer', None) is not None else len
+        demos, n_tokens = select_examples(self.examples, text, self.n_examples, self.language,
+                                          count_tokens, max_tokens=self.max_example_tokens)
+        if not demos:
+            return hint, None
+        return (f'{hint}\n{demos}' if hint else demos), n_tokens
+
+    def count_prompt_tokens(self,
+                            texts: List[str],
+                            hint: Optional[str] = None,
+                            num_threads: int = 8,
+                            **kwargs) -> List[int]:
+        ''' Count the prompt tokens of many texts at once, e.g. to check a corpus before annotating it.
+        '''
+        n_static_tokens = self.count_static_tokens(hint=hint, **kwargs)
+        texts = [text.replace('\n', '') for text in texts]
+        return [n_static_tokens + n for n in self.model.count_tokens_batch(texts, num_threads=num_threads)]
+
+    def render_packed_prompt(self, texts: List[str], hint: Optional[str] = None, **kwargs) -> str:
+        if self.task == Tasks.DataAugmentation:
+            return self.packed_template.render(texts=texts, hint=hint, size=kwargs.get('size', 1))
+        return self.packed_template.render(labels=list(self.label_mapping.keys()), texts=texts, hint=hint)
+
+    def _budget_packed_prompt(self, prompt: str, texts: List[str], **kwargs) -> str:
+        ''' Ask for the sum of the completion budgets of the texts of a packed prompt and their numbers.
+        Packed responses are not observed, their budget follows the single-text requests.
+        '''
+        if self.completion_budget is None or getattr(self.model, 'tokenizer', None) is None:
+            return prompt
+        scale = sum(self.get_completion_scale(self.model.count_tokens(text), **kwargs) for text in texts)
+        budget = self.completion_budget.get(scale, self.get_completion_prior()) + PACKED_ITEM_TOKENS * len(texts)
+        return Prompt(prompt, max_completion_tokens=budget)
+
+    @staticmethod
+    def split_packed_response(response: str, size: int) -> List[Optional[str]]:
+        ''' Split the response of a packed prompt into the outputs of the numbered inputs.
+        The output of an input is None if its number is missing from the response.
+        '''
+        segments = [None] * size
+        matches = list(PACKED_ITEM_REGEX.finditer(response))
+        for i, matched in enumerate(matches):
+            index = int(matched.group('index')) - 1
+            if 0 <= index < size and segments[index] is None:
+                end = matches[i + 1].start() if i + 1 < len(matches) else len(response)
+                segments[index] = response[matched.end(): end]
+        return segments
+
+    def iter_packs(self,
+                   texts: Iterable[str],
+                   hint: Optional[str] = None,
+                   max_prompt_tokens: int = DEFAULT_PACK_MAX_TOKENS,
+                   max_pack_size: int = DEFAULT_PACK_SIZE,
+                   **kwargs) -> Iterator[List[str]]:
+        ''' Group texts into packs whose packed prompt fits in `max_prompt_tokens` tokens.
+        A text that does not fit in the budget on its own forms a single-item pack.
+        '''
+        tokenizer = self.model.tokenizer
+        n_header_tokens = len(tokenizer.encode(self.render_packed_prompt([], hint=hint, **kwargs)))
+        pack, n_tokens = [], n_header_tokens
+        for text in texts:
+            text = text.replace('\n', '')
+            n_text_tokens = len(tokenizer.encode(f'[{len(pack) + 1}] {text}\n'))
+            if pack and (n_tokens + n_text_tokens > max_prompt_tokens or len(pack) >= max_pack_size):
+                yield pack
+                pack, n_tokens = [], n_header_tokens
+            pack.append(text)
+            n_tokens += n_text_tokens
+        if pack:
+            yield pack
+
+    def _is_parsed(self, ret: Dict, segment: str) -> bool:
+        result = ret['result']
+        if self.task in (Tasks.NER, Tasks.RelationExtraction) and self.re_strip(segment).lower() in ('none', '[]'):
+            return True
+        if self.task == Tasks.NER:
+            return 'entities' in result
+        elif self.task in (Tasks.Classification, Tasks.MultiLabelClassification):
+            return 'label' in result
+        elif self.task == Tasks.DataAugmentation:
+            return bool(result['sentences'])
+        return bool(result['triples'])
+
+    def _tag_pack(self,
+                  texts: List[str],
+                  hint: Optional[str] = None,
+                  formatter=None,
+                  raise_on_error: bool = False,
+                  **kwargs) -> List[Dict]:
+        if len(texts) == 1:
+            return [self._safe_tag(texts[0], hint=hint, formatter=formatter, raise_on_error=raise_on_error, **kwargs)]
+        parsers = [self._prepare(text, hint=hint, formatter=formatter, **kwargs)[1] for text in texts]
+        try:
+            prompt = self._budget_packed_prompt(self.render_packed_prompt(texts, hint=hint, **kwargs), texts, **kwargs)
+            resp = self.model.predict(prompt)
+            segments = self.split_packed_response(resp['response'], len(texts))
+        except Exception:
+            if raise_on_error:
+                raise
+            resp, segments = None, [None] * len(texts)
+        samples = []
+        if resp is not None:
+            # the packed request is reported once, not per item
+            self.instrumentation.observe(self.task, resp['meta'] or {})
+            # the sampled completions are split per item too, then voted per item
+            samples = [self.split_packed_response(response, len(texts)) for response in resp.get('responses') or []]
+        rets = []
+        for i, (text, parse, segment) in enumerate(zip(texts, parsers, segments)):
+            if segment is not None:
+                data = dict(resp, response=segment, meta=dict(resp['meta'], pack_size=len(texts), pack_index=i))
+                data.pop('responses', None)
+                responses = [sample[i] for sample in samples if sample[i] is not None]
+                if len(responses) > 1:
+                    data['responses'] = responses
+                ret = self._parse(data, parse)
+                if self._is_parsed(ret, segment):
+                    rets.append(ret)
+                    continue
+            # fall back to a single-item request
+            rets.append(self._safe_tag(text, hint=hint, formatter=formatter, raise_on_error=raise_on_error, **kwargs))
+        return rets
+
+    def imap_packed(self,
+                    texts: Iterable[str],
+                    hint: Optional[str] = None,
+                    formatter=None,
+                    max_prompt_tokens: int = DEFAULT_PACK_MAX_TOKENS,
+                    max_pack_size: int = DEFAULT_PACK_SIZE,
+                    num_workers: int = DEFAULT_CONCURRENCY,
+                    raise_on_error: bool = False,
+                    dedup: Union[NearDuplicateIndex, bool] = False,
+                    **kwargs) -> Iterator[Dict]:
+        ''' Like `imap`, but annotate several numbered texts per request.
+        Texts are packed until the prompt reaches `max_prompt_tokens` tokens or `max_pack_size` texts,
+        then the response is split back per text. A text whose output is missing or cannot be parsed
+        is re-annotated with a single-item request.
+        '''
+        def imap(texts):
+            packs = self.iter_packs(texts, hint=hint, max_prompt_tokens=max_prompt_tokens,
+                                    max_pack_size=max_pack_size, **kwargs)
+            func = partial(self._tag_pack, hint=hint, formatter=formatter, raise_on_error=raise_on_error, **kwargs)
+            for rets in imap_ordered(func, packs, num_workers):
+                yield from rets
+
+        if dedup:
+            tag = partial(self._safe_tag, hint=hint, formatter=formatter, raise_on_error=raise_on_error, **kwargs)
+            return self._imap_dedup(texts, imap, dedup, tag, hint=hint, formatter=formatter, **kwargs)
+        return imap(texts)
+
+    def tag_packed(self,
+                   texts: Iterable[str],
+                   hint: Optional[str] = None,
+                   formatter=None,
+                   max_prompt_tokens: int = DEFAULT_PACK_MAX_TOKENS,
+                   max_pack_size: int = DEFAULT_PACK_SIZE,
+                   num_workers: int = DEFAULT_CONCURRENCY,
+                   raise_on_error: bool = False,
+                   dedup: Union[NearDuplicateIndex, bool] = False,
+                   **kwargs) -> List[Dict]:
+        ''' Annotate several texts per request, see `imap_packed`.
+        '''
+        return list(self.imap_packed(texts, hint=hint, formatter=formatter, max_prompt_tokens=max_prompt_tokens,
+                                     max_pack_size=max_pack_size, num_workers=num_workers,
+                                     raise_on_error=raise_on_error, dedup=dedup, **kwargs))
 
     def __call__(self, text: str, hint: Optional[str] = None, formatter=None, **kwargs):
         return self.tag(text, hint=hint, formatter=formatter, **kwargs)
+
+    async def __acall__(self, text: str, hint: Optional[str] = None, formatter=None, **kwargs):
+        return await self.atag(text, hint=hint, formatter=formatter, **kwargs)
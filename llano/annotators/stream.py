@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+from typing import Any, List
+
+from ..config import Tasks, OutputFormat
+from ..parsing import iter_json_tuples, iter_tuples
+
+
+class StreamParser:
+    ''' Incremental parser of a streamed response.
+
+    `feed` takes the next piece of the response and returns the items completed by it:
+    (entity, entity_type) pairs for NER, (subject, predicate, object) triples for relation extraction,
+    labels for classification and sentences for data augmentation.
+    `done` is set once no further output can change the result, i.e. a single-label classification
+    has found its label, so the stream can be stopped early.
+    '''
+    def __init__(self, annotator: Any) -> None:
+        self.annotator = annotator
+        self.task = annotator.task
+        self.buffer = ''
+        self.pos = 0
+        self.done = False
+        self.seen = set()
+        if self.task in (Tasks.NER, Tasks.RelationExtraction):
+            self.size = 2 if self.task == Tasks.NER else 3
+            self.labels = list(annotator.label_mapping)
+        elif self.task in (Tasks.Classification, Tasks.MultiLabelClassification):
+            self.regex = annotator.get_regex('classification', annotator.make_classification_extraction_regex)
+            self.labels = list(annotator.label_mapping)
+            self.max_label_length = max(len(label) for label in self.labels)
+        else:
+            self.regex = annotator.make_data_augmentation_regex()
+
+    def _is_final(self, end: int) -> bool:
+        ''' Whether a label match ending at `end` is final, i.e. no label is still being written
+        at a position which could change or extend the match.
+        '''
+        for pos in range(max(0, len(self.buffer) - self.max_label_length), min(end, len(self.buffer)) + 1):
+            rest = self.buffer[pos:]
+            if any(len(label) > len(rest) and label.startswith(rest) for label in self.labels):
+                return False
+        return True
+
+    def _parse_tuples(self, closed: bool) -> List:
+        if self.annotator.output_format == OutputFormat.JSON:
+            # the records of a JSON output are read once it is complete
+            raw_items = iter_json_tuples(self.buffer, self.size) if closed else ()
+        else:
+            raw_items = []
+            for end, raw_item in iter_tuples(self.buffer, self.labels, self.size, self.pos):
+                self.pos = end
+                raw_items.append(raw_item)
+        items = []
+        for raw_item in raw_items:
+            item = tuple(self.annotator.re_strip(x) for x in raw_item)
+            if self.size == 3 and item[1] not in self.labels:
+                continue
+            if item not in self.seen:
+                self.seen.add(item)
+                items.append(item)
+        return items
+
+    def _parse_labels(self, closed: bool) -> List:
+        items = []
+        for matched in self.regex.finditer(self.buffer, self.pos):
+            if not closed and not self._is_final(matched.end()):
+                break
+            self.pos = matched.end()
+            items.append(matched.group(1))
+            if self.task == Tasks.Classification:
+                self.done = True
+                break
+        return items
+
+    def _parse_sentences(self, closed: bool) -> List:
+        end = len(self.buffer) if closed else self.buffer.rfind('\n') + 1
+        if end <= self.pos:
+            return []
+        lines = self.buffer[self.pos: end].rstrip('\n') + '\n'
+        self.pos = end
+        return [matched.group('sentence').strip() for matched in self.regex.finditer(lines)]
+
+    def _parse(self, closed: bool = False) -> List:
+        if self.done:
+            return []
+        if self.task in (Tasks.NER, Tasks.RelationExtraction):
+            return self._parse_tuples(closed)
+        if self.task in (Tasks.Classification, Tasks.MultiLabelClassification):
+            return self._parse_labels(closed)
+        return self._parse_sentences(closed)
+
+    def feed(self, delta: str) -> List:
+        self.buffer += delta
+        return self._parse()
+
+    def close(self) -> List:
+        ''' Flush the items held back until the end of the response.
+        '''
+        return self._parse(closed=True)
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+''' Adaptive completion budgets, i.e. the `max_tokens` of the requests.
+
+The API reserves `max_tokens` of every request against the tokens per minute limit, so asking for the whole
+context of the model for a label of a few tokens wastes the quota. The completion tokens of a request grow
+with its scale: 1 for classification, the tokens of the text for NER and relation extraction, whose outputs
+quote it, and `size` times them for data augmentation. A budget is a number of tokens per unit of scale,
+estimated from the labels until enough completions are observed, then from their usage.
+'''
+
+import math
+import threading
+from collections import defaultdict
+from typing import Dict, Optional
+
+from .config import (
+    DEFAULT_BUDGET_QUANTILE, DEFAULT_BUDGET_HEADROOM, DEFAULT_BUDGET_MARGIN, DEFAULT_BUDGET_MIN_SAMPLES,
+    DEFAULT_BUDGET_WINDOW
+)
+
+# buckets of the histogram grow by 2^(1/4), their upper bounds are the estimates
+BUCKETS_PER_OCTAVE = 4
+
+
+class CompletionBudget:
+    ''' Histogram of the completion tokens per unit of scale of the requests of an annotator.
+
+    The budget of a request is `headroom` times the `quantile` of the histogram times its scale,
+    plus `margin` tokens, or the prior of the task until `min_samples` completions are observed.
+    The counts are halved every `window` observations, so that the budget follows the recent outputs.
+    The model retries a truncated completion once with the whole budget of its context.
+    '''
+    def __init__(self,
+                 quantile: float = DEFAULT_BUDGET_QUANTILE,
+                 headroom: float = DEFAULT_BUDGET_HEADROOM,
+                 margin: int = DEFAULT_BUDGET_MARGIN,
+                 min_samples: int = DEFAULT_BUDGET_MIN_SAMPLES,
+                 window: int = DEFAULT_BUDGET_WINDOW) -> None:
+        self.quantile = quantile
+        self.headroom = headroom
+        self.margin = margin
+        self.min_samples = min_samples
+        self.window = window
+        self._counts = defaultdict(float)
+        self._total = 0.
+        self._n_observed = 0
+        self._ratio = None
+        self._lock = threading.Lock()
+
+    def observe(self, scale: float, completion_tokens: int) -> None:
+        ''' Add the completion tokens of a request of `scale`.
+        '''
+        ratio = completion_tokens / max(scale, 1)
+        bucket = math.ceil(BUCKETS_PER_OCTAVE * math.log2(ratio)) if ratio > 0 else None
+        with self._lock:
+            self._counts[bucket] += 1
+            self._total += 1
+            self._n_observed += 1
+            if self._n_observed % self.window == 0:
+                for key in self._counts:
+                    self._counts[key] /= 2
+                self._total /= 2
+            self._ratio = None
+
+    def get_ratio(self) -> Optional[float]:
+        ''' Return the `quantile` of the completion tokens per unit of scale, None before `min_samples`.
+        '''
+        with self._lock:
+            if self._n_observed < self.min_samples:
+                return None
+            if self._ratio is None:
+                target, seen = self.quantile * self._total, 0.
+                buckets = sorted(self._counts, key=lambda x: -math.inf if x is None else x)
+                for bucket in buckets:
+                    seen += self._counts[bucket]
+                    if seen >= target:
+                        break
+                self._ratio = 0. if bucket is None else 2 ** (bucket / BUCKETS_PER_OCTAVE)
+            return self._ratio
+
+    def get(self, scale: float, prior: float) -> int:
+        ''' Return the budget of a request of `scale`, `prior` being the tokens per unit of scale of the task.
+        '''
+        ratio = self.get_ratio()
+        ratio = prior if ratio is None else ratio * self.headroom
+        return math.ceil(ratio * scale) + self.margin
+
+    def stats(self) -> Dict:
+        return {'samples': self._n_observed, 'ratio': self.get_ratio()}
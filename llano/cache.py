@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterator, Optional, Tuple
+
+from .config import MAX_LRU_CACHE_SIZE, MAX_CACHE_BYTES
+
+
+class MemoryCache:
+    ''' Thread-safe LRU cache bounded by both the number of entries and the total bytes of the values.
+    '''
+    def __init__(self, max_size: int = MAX_LRU_CACHE_SIZE, max_bytes: int = MAX_CACHE_BYTES) -> None:
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: str) -> Optional[Tuple[float, str]]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            self._data.move_to_end(key)
+            return item[:2]
+
+    def set(self, key: str, created_at: float, value: str) -> None:
+        size = len(value.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.n_bytes -= old[2]
+            self._data[key] = (created_at, value, size)
+            self.n_bytes += size
+            while len(self._data) > self.max_size or self.n_bytes > self.max_bytes:
+                _, evicted = self._data.popitem(last=False)
+                self.n_bytes -= evicted[2]
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.n_bytes -= old[2]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.n_bytes = 0
+
+
+class SQLiteCache:
+    ''' Persistent cache backed by SQLite, it can be shared by several threads and processes.
+    '''
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS responses '
+                         '(key TEXT PRIMARY KEY, created_at REAL NOT NULL, value TEXT NOT NULL)')
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite connections can be shared neither across threads nor across forked processes
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def __len__(self) -> int:
+        return self._connect().execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+    def get(self, key: str) -> Optional[Tuple[float, str]]:
+        return self._connect().execute(
+            'SELECT created_at, value FROM responses WHERE key = ?', (key, )).fetchone()
+
+    def set(self, key: str, created_at: float, value: str) -> None:
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO responses (key, created_at, value) VALUES (?, ?, ?)',
+                         (key, created_at, value))
+
+    def values(self) -> Iterator[str]:
+        yield from (row[0] for row in self._connect().execute('SELECT value FROM responses'))
+
+    def delete(self, key: str) -> None:
+        with self._connect() as conn:
+            conn.execute('DELETE FROM responses WHERE key = ?', (key, ))
+
+    def clear(self) -> None:
+        with self._connect() as conn:
+            conn.execute('DELETE FROM responses')
+
+    def close(self) -> None:
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class ResponseCache:
+    ''' Two-tier response cache: a byte-bounded in-memory LRU in front of an optional SQLite store.
+
+    Args:
+        path: path of the SQLite database, responses are only kept in memory if it is not specified.
+        max_size: max number of entries of the in-memory tier.
+        max_bytes: max bytes of the in-memory tier.
+        ttl: time to live of an entry in seconds, entries never expire if it is not specified.
+    '''
+    def __init__(self,
+                 path: Optional[str] = None,
+                 max_size: int = MAX_LRU_CACHE_SIZE,
+                 max_bytes: int = MAX_CACHE_BYTES,
+                 ttl: Optional[float] = None) -> None:
+        self.memory = MemoryCache(max_size=max_size, max_bytes=max_bytes)
+        self.disk = SQLiteCache(path) if path is not None else None
+        self.ttl = ttl
+        self.hits = 0
+        self.memory_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(model: str, params: Dict, prompt: str) -> str:
+        payload = json.dumps({'model': model, 'params': params, 'prompt': prompt}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _is_expired(self, created_at: float) -> bool:
+        return self.ttl is not None and time.time() - created_at > self.ttl
+
+    def _record(self, hit: bool, memory: bool = False) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+                self.memory_hits += int(memory)
+            else:
+                self.misses += 1
+
+    def get(self, key: str) -> Optional[Dict]:
+        item = self.memory.get(key)
+        if item is not None and not self._is_expired(item[0]):
+            self._record(True, memory=True)
+            return json.loads(item[1])
+        if item is not None:
+            self.memory.delete(key)
+        if self.disk is not None:
+            item = self.disk.get(key)
+            if item is not None and not self._is_expired(item[0]):
+                self.memory.set(key, *item)
+                self._record(True)
+                return json.loads(item[1])
+            if item is not None:
+                self.disk.delete(key)
+        self._record(False)
+        return None
+
+    def set(self, key: str, value: Dict) -> None:
+        created_at = time.time()
+        value = json.dumps(value, ensure_ascii=False)
+        self.memory.set(key, created_at, value)
+        if self.disk is not None:
+            self.disk.set(key, created_at, value)
+
+    def clear(self) -> None:
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.hits - self.memory_hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 5) if total else 0.,
+            'memory_entries': len(self.memory),
+            'memory_bytes': self.memory.n_bytes,
+        }
+
+    def close(self) -> None:
+        if self.disk is not None:
+            self.disk.close()
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+
+''' Command line interface to annotate a corpus.
+
+Example:
+    llano --task ner --language en --label-mapping '{"people": "PEO", "location": "LOC"}' \
+        --input corpus.jsonl --output corpus.conll --formatter BIO --num-workers 32
+'''
+
+import os
+import csv
+import sys
+import json
+import time
+import logging
+import argparse
+from itertools import islice
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional
+
+from .cache import ResponseCache
+from .config import (
+    Tasks, Languages, Formatter, NERFormatter, ExportFormatter, OpenAIModels, OutputFormat, DEFAULT_CONCURRENCY,
+    DEFAULT_DEDUP_THRESHOLD
+)
+from .dedup import NearDuplicateIndex
+from .export import CorpusExporter
+
+if TYPE_CHECKING:
+    from .annotators import GPTAnnotator
+
+
+logger = logging.getLogger('llano')
+
+InputFormats = ('jsonl', 'csv', 'txt')
+
+
+def read_texts(path: str, input_format: str, text_field: str = 'text') -> Iterator[str]:
+    ''' Stream texts from a JSONL, CSV or plain text file without loading the whole file.
+    '''
+    with open(path, encoding='utf-8', newline='' if input_format == 'csv' else None) as reader:
+        if input_format == 'csv':
+            for row in csv.DictReader(reader):
+                yield row[text_field]
+        elif input_format == 'jsonl':
+            for line in reader:
+                if line.strip():
+                    yield json.loads(line)[text_field]
+        else:
+            for line in reader:
+                line = line.rstrip('\n')
+                if line:
+                    yield line
+
+
+def load_checkpoint(path: str) -> Dict:
+    if not os.path.exists(path):
+        return {'n_records': 0, 'output_offset': 0, 'error_offset': 0}
+    with open(path, encoding='utf-8') as reader:
+        return json.load(reader)
+
+
+def save_checkpoint(path: str, checkpoint: Dict) -> None:
+    # write then rename, so an interruption never leaves a partial checkpoint
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as writer:
+        json.dump(checkpoint, writer)
+    os.replace(tmp_path, path)
+
+
+def parse_label_mapping(value: Optional[str]) -> Optional[Dict]:
+    if value is None:
+        return None
+    if os.path.exists(value):
+        with open(value, encoding='utf-8') as reader:
+            return json.load(reader)
+    return json.loads(value)
+
+
+def add_task_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--task', required=True, choices=Tasks.values())
+    parser.add_argument('--language', default=Languages.EN, choices=Languages.values())
+    parser.add_argument('--label-mapping', help='label mapping, a JSON string or the path of a JSON file.')
+    parser.add_argument('--hint', help='explanation and examples of the task.')
+    parser.add_argument('--size', type=int, default=1, help='number of augmented sentences of data augmentation.')
+    parser.add_argument('--output-format', default=OutputFormat.Tuple, choices=OutputFormat.values(),
+                        help='format of the model outputs asked by the prompts.')
+
+
+def add_input_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--input', required=True, help='path of the input corpus.')
+    parser.add_argument('--input-format', choices=InputFormats,
+                        help='format of the input corpus, inferred from the file extension by default.')
+    parser.add_argument('--text-field', default='text', help='text field of JSONL inputs or text column of CSV inputs.')
+
+
+def add_output_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--output', required=True, help='path of the output file.')
+    parser.add_argument('--formatter', default=Formatter.JSONL,
+                        choices=Formatter.values() + NERFormatter.values() + ExportFormatter.values(),
+                        help='output format, BIO and segment write CoNLL style files for NER. '
+                             'parquet requires pyarrow and cannot be resumed.')
+
+
+def add_model_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--model', default=OpenAIModels.ChatGPT, choices=sorted(set(OpenAIModels.values())))
+    parser.add_argument('--cascade', action='append', choices=sorted(set(OpenAIModels.values())),
+                        help='stronger model which annotates the texts --model fails to, can be repeated.')
+    parser.add_argument('--min-confidence', type=float,
+                        help='escalate the outputs whose agreement of the sampled completions is below it.')
+    parser.add_argument('--api-key', action='append',
+                        help='api key, can be repeated. Defaults to the comma separated OPENAI_API_KEY env.')
+    parser.add_argument('--temperature', type=float, default=0.8)
+    parser.add_argument('--samples', type=int, default=1,
+                        help='completions sampled per request, their results are voted for self-consistency.')
+    parser.add_argument('--rpm', type=int, help='requests per minute limit of each api key.')
+    parser.add_argument('--tpm', type=int, help='tokens per minute limit of each api key.')
+    parser.add_argument('--cache', help='path of a persistent response cache.')
+    parser.add_argument('--completion-budget', action='store_true',
+                        help='ask for the completion tokens the outputs need instead of the whole context.')
+    parser.add_argument('--deadline', type=float, help='seconds a request may take, including its retries.')
+    parser.add_argument('--hedge-quantile', type=float,
+                        help='send a request again once it is slower than this quantile of the recent latencies.')
+    parser.add_argument('--num-workers', type=int, default=DEFAULT_CONCURRENCY)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='llano', description='Let LLMs serve as data annotators.')
+    add_task_arguments(parser)
+    add_input_arguments(parser)
+    add_output_arguments(parser)
+    add_model_arguments(parser)
+    parser.add_argument('--pack', action='store_true', help='annotate several texts per request.')
+    parser.add_argument('--dedup', action='store_true', help='annotate near-duplicate texts once.')
+    parser.add_argument('--dedup-threshold', type=float, default=DEFAULT_DEDUP_THRESHOLD,
+                        help='Jaccard similarity of near-duplicates, 1 only merges identical normalized texts.')
+    parser.add_argument('--checkpoint-every', type=int, default=100, help='save a checkpoint every n records.')
+    parser.add_argument('--no-resume', action='store_true', help='start over instead of resuming from the checkpoint.')
+    return parser
+
+
+def build_annotator(args: argparse.Namespace) -> 'GPTAnnotator':
+    ''' Build the annotator of the task and model arguments.
+    '''
+    # imported here so that `llano --help` does not load openai and jinja2
+    from .annotators import GPTAnnotator
+    from .hedging import Hedger
+    from .models import GPTModel
+
+    api_keys = args.api_key or [k for k in os.getenv('OPENAI_API_KEY', '').split(',') if k]
+    if not api_keys:
+        raise ValueError('No api key, please specify --api-key or the OPENAI_API_KEY env.')
+    cache = ResponseCache(args.cache) if args.cache else True
+    models = [GPTModel(api_keys,
+                       model=name,
+                       temperature=args.temperature,
+                       cache=cache,
+                       rpm=args.rpm,
+                       tpm=args.tpm,
+                       n=args.samples,
+                       deadline=args.deadline,
+                       hedging=Hedger(args.hedge_quantile) if args.hedge_quantile else False)
+              for name in [args.model] + (args.cascade or [])]
+    return GPTAnnotator(models[0], task=args.task, language=args.language,
+                        label_mapping=parse_label_mapping(args.label_mapping),
+                        cascade=models[1:], min_confidence=args.min_confidence,
+                        output_format=getattr(args, 'output_format', None) or OutputFormat.Tuple,
+                        completion_budget=getattr(args, 'completion_budget', False))
+
+
+def check_formatter(task: str, formatter: str) -> None:
+    if formatter in NERFormatter.values() and task != Tasks.NER:
+        raise ValueError(f'The formatter `{formatter}` is only supported by the NER task.')
+
+
+def run(args: argparse.Namespace) -> Dict:
+    check_formatter(args.task, args.formatter)
+    if get_input_format(args) not in InputFormats:
+        raise ValueError(f'Unknown input format of `{args.input}`, please specify --input-format.')
+    return annotate(build_annotator(args), args)
+
+
+def get_input_format(args: argparse.Namespace) -> str:
+    return args.input_format or os.path.splitext(args.input)[1].lstrip('.').lower()
+
+
+def annotate(annotator: 'GPTAnnotator', args: argparse.Namespace) -> Dict:
+    ''' Annotate the input corpus and write the results incrementally.
+    A checkpoint records the number of processed records and the sizes of the output and the errors at that point,
+    so an interrupted job resumes from the last checkpoint.
+    '''
+    checkpoint_path = f'{args.output}.ckpt'
+    error_path = f'{args.output}.errors.jsonl'
+    # a parquet file is only readable once it is closed, an interrupted one cannot be continued
+    resumable = args.formatter != ExportFormatter.Parquet
+    if args.no_resume or not resumable:
+        checkpoint = {'n_records': 0, 'output_offset': 0, 'error_offset': 0}
+    else:
+        checkpoint = load_checkpoint(checkpoint_path)
+    if checkpoint['n_records']:
+        logger.info('resume from record %d', checkpoint['n_records'])
+
+    texts = read_texts(args.input, get_input_format(args), text_field=args.text_field)
+    texts = islice(texts, checkpoint['n_records'], None)
+    kwargs = {'size': args.size} if annotator.task == Tasks.DataAugmentation else {}
+    # duplicates are detected among the records of this run, those before the checkpoint are not indexed
+    index = NearDuplicateIndex(threshold=args.dedup_threshold) if args.dedup else None
+    if index is not None:
+        kwargs['dedup'] = index
+    if args.pack:
+        rets = annotator.imap_packed(texts, hint=args.hint, num_workers=args.num_workers, **kwargs)
+    else:
+        rets = annotator.imap(texts, hint=args.hint, num_workers=args.num_workers, **kwargs)
+
+    mode = 'r+b' if checkpoint['output_offset'] and os.path.exists(args.output) else 'wb'
+    n_errors, start_time, start_records = 0, time.time(), checkpoint['n_records']
+    error_mode = 'r+b' if checkpoint['n_records'] and os.path.exists(error_path) else 'wb'
+    with open(args.output, mode) as writer, open(error_path, error_mode) as error_writer:
+        # drop the output and the errors written after the last checkpoint
+        writer.seek(checkpoint['output_offset'])
+        writer.truncate()
+        if 'error_offset' in checkpoint:
+            error_writer.seek(checkpoint['error_offset'] if error_mode == 'r+b' else 0)
+            error_writer.truncate()
+        else:
+            # the checkpoints of older versions have no error offset
+            error_writer.seek(0, os.SEEK_END)
+        # the results are formatted by the exporter, so the annotator does not keep a formatted copy of them
+        exporter = CorpusExporter(writer, args.formatter, task=annotator.task)
+        for ret in rets:
+            if 'error' in ret:
+                n_errors += 1
+                error_writer.write((json.dumps({'text': ret['result']['text'], 'error': ret['error']},
+                                               ensure_ascii=False) + '\n').encode('utf-8'))
+            else:
+                exporter.write(ret)
+            checkpoint['n_records'] += 1
+            if checkpoint['n_records'] % args.checkpoint_every == 0:
+                if resumable:
+                    checkpoint['output_offset'] = exporter.tell()
+                    checkpoint['error_offset'] = error_writer.tell()
+                    save_checkpoint(checkpoint_path, checkpoint)
+                n_done = checkpoint['n_records'] - start_records
+                logger.info('annotated %d records, %.2f records/s, %d errors',
+                            checkpoint['n_records'], n_done / max(time.time() - start_time, 1e-6), n_errors)
+        exporter.close()
+        if resumable:
+            checkpoint['output_offset'] = writer.tell()
+            checkpoint['error_offset'] = error_writer.tell()
+            save_checkpoint(checkpoint_path, checkpoint)
+    stats = {'n_records': checkpoint['n_records'], 'n_errors': n_errors}
+    if index is not None:
+        stats['n_duplicates'] = index.n_duplicates
+    if annotator.cascade:
+        stats['escalated'] = annotator.cascade_stats()['escalated']
+    return stats
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    args = build_parser().parse_args(argv)
+    try:
+        stats = run(args)
+    except ValueError as e:
+        logger.error(e)
+        sys.exit(1)
+    logger.info('done, %d records, %d errors', stats['n_records'], stats['n_errors'])
+    if 'n_duplicates' in stats:
+        logger.info('%d duplicates were annotated from their representatives', stats['n_duplicates'])
+    if 'escalated' in stats:
+        logger.info('outputs escalated to each level of the cascade: %s', stats['escalated'])
+
+
+if __name__ == '__main__':
+    main()
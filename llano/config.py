@@ -7,6 +7,43 @@ from abc import ABCMeta
 PACKAGE_DIR = os.path.dirname(os.path.realpath(__file__))
 TEMPLATE_DIR = os.path.join(PACKAGE_DIR, "templates")
 MAX_LRU_CACHE_SIZE = 100000
+MAX_CACHE_BYTES = 256 * 1024 * 1024
+DEFAULT_CONCURRENCY = 32
+DEFAULT_PACK_MAX_TOKENS = 1024
+DEFAULT_PACK_SIZE = 16
+DEFAULT_CHUNK_OVERLAP_TOKENS = 64
+# threads per long document, which is often annotated on a thread of the pool of `imap` already
+DEFAULT_CHUNK_WORKERS = 4
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BACKOFF_BASE = 1.
+DEFAULT_BACKOFF_MAX = 60.
+DEFAULT_POOL_SIZE = 100
+DEFAULT_KEEPALIVE_TIMEOUT = 60.
+DEFAULT_DEDUP_THRESHOLD = 0.9
+DEFAULT_DEDUP_MAX_TEXTS = 100000
+DEFAULT_MINHASH_PERMUTATIONS = 64
+DEFAULT_SHINGLE_SIZE = 5
+DEFAULT_N_EXAMPLES = 4
+DEFAULT_MAX_EXAMPLE_TOKENS = 512
+DEFAULT_EXAMPLE_NGRAM = 3
+DEFAULT_EXAMPLE_FEATURES = 2 ** 20
+DEFAULT_MAX_POSTINGS = 100000
+DEFAULT_VOTE_THRESHOLD = 0.5
+DEFAULT_EXPORT_BUFFER_SIZE = 1 << 20
+DEFAULT_EXPORT_ROW_GROUP_SIZE = 10000
+DEFAULT_JOB_BATCH_SIZE = 64
+DEFAULT_LEASE_SECONDS = 300.
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_BUDGET_QUANTILE = 0.99
+DEFAULT_BUDGET_HEADROOM = 1.5
+DEFAULT_BUDGET_MARGIN = 16
+DEFAULT_BUDGET_MIN_SAMPLES = 20
+DEFAULT_BUDGET_WINDOW = 10000
+DEFAULT_HEDGE_QUANTILE = 0.95
+DEFAULT_HEDGE_MIN_SAMPLES = 20
+DEFAULT_HEDGE_WINDOW = 1000
+TOKENIZER_CACHE_DIR_ENV = 'LLANO_TOKENIZER_CACHE_DIR'
+TEMPLATE_CACHE_DIR_ENV = 'LLANO_TEMPLATE_CACHE_DIR'
 
 
 class AttributeClass(ABCMeta):
@@ -31,6 +68,27 @@ class Tasks(AttributeClass):
     RelationExtraction = 'relation_extraction'
 
 
+class Stages(AttributeClass):
+    ''' Instrumented stages of a request
+    '''
+    Retrieve = 'retrieve'
+    Render = 'render'
+    Tokenize = 'tokenize'
+    QueueWait = 'queue_wait'
+    Network = 'network'
+    Parse = 'parse'
+    Format = 'format'
+
+
+class JobStatus(AttributeClass):
+    ''' Status of a text of a job
+    '''
+    Pending = 'pending'
+    Leased = 'leased'
+    Done = 'done'
+    Failed = 'failed'
+
+
 class Languages(AttributeClass):
     ''' Supported Languages
     '''
@@ -47,6 +105,19 @@ class NERFormatter(AttributeClass):
     Segment = 'segment'
 
 
+class OutputFormat(AttributeClass):
+    ''' Formats of the model outputs asked by the prompts
+    '''
+    Tuple = 'tuple'
+    JSON = 'json'
+
+
+class ExportFormatter(AttributeClass):
+    ''' Formats written by the exporter only
+    '''
+    Parquet = 'parquet'
+
+
 class OpenAIModels(AttributeClass):
     '''
     OpenAI API: https://platform.openai.com/docs/models/gpt-3-5
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+import re
+import zlib
+import random
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from .config import DEFAULT_DEDUP_THRESHOLD, DEFAULT_DEDUP_MAX_TEXTS, DEFAULT_MINHASH_PERMUTATIONS, DEFAULT_SHINGLE_SIZE
+
+
+PUNCTUATION_REGEX = re.compile(r'[^\w\s]+')
+WHITESPACE_REGEX = re.compile(r'\s+')
+MERSENNE_PRIME = (1 << 61) - 1
+
+
+def normalize_text(text: str) -> str:
+    ''' Normalize text for duplicate detection: NFKC, case folding, no punctuation and collapsed whitespaces.
+    '''
+    text = unicodedata.normalize('NFKC', text).casefold()
+    text = PUNCTUATION_REGEX.sub(' ', text)
+    return WHITESPACE_REGEX.sub(' ', text).strip()
+
+
+def align_normalized(text: str) -> Tuple[str, List[int]]:
+    ''' Normalize text like `normalize_text`, character by character, and return the normalized text
+    with the offset in `text` of the character each of its characters comes from.
+    '''
+    chars, offsets = [], []
+    for i, char in enumerate(text):
+        for c in unicodedata.normalize('NFKC', char).casefold():
+            if PUNCTUATION_REGEX.match(c) or WHITESPACE_REGEX.match(c):
+                if not chars or chars[-1] == ' ':
+                    continue
+                c = ' '
+            chars.append(c)
+            offsets.append(i)
+    if chars and chars[-1] == ' ':
+        chars.pop()
+        offsets.pop()
+    return ''.join(chars), offsets
+
+
+def choose_bands(num_perm: int, threshold: float) -> Tuple[int, int]:
+    ''' Choose the (bands, rows) of the LSH whose S-curve threshold, (1 / bands) ** (1 / rows),
+    is the closest one below `threshold`, so that few near-duplicates are missed.
+    Candidates are verified with the exact Jaccard similarity afterwards.
+    '''
+    options = [(b, num_perm // b) for b in range(1, num_perm + 1) if num_perm % b == 0]
+    below = [(b, r) for b, r in options if (1 / b) ** (1 / r) <= threshold]
+    return max(below, key=lambda x: (1 / x[0]) ** (1 / x[1])) if below else options[-1]
+
+
+class NearDuplicateIndex:
+    ''' Streaming near-duplicate detection with MinHash and LSH.
+
+    `add` returns the position of the representative of a text: the first added text whose normalized form
+    is identical, or whose character shingles have a Jaccard similarity of at least `threshold`.
+    A text without such a text is its own representative.
+
+    Args:
+        threshold: Jaccard similarity of near-duplicates, 1 only groups texts which are identical after
+            normalization.
+        num_perm: number of MinHash permutations.
+        shingle_size: number of characters of a shingle.
+        max_texts: max representatives kept in the index, the least recently matched one is evicted beyond it,
+            so that the memory of a stream is bounded. `None` keeps all of them.
+    '''
+    def __init__(self,
+                 threshold: float = DEFAULT_DEDUP_THRESHOLD,
+                 num_perm: int = DEFAULT_MINHASH_PERMUTATIONS,
+                 shingle_size: int = DEFAULT_SHINGLE_SIZE,
+                 seed: int = 42,
+                 max_texts: Optional[int] = DEFAULT_DEDUP_MAX_TEXTS) -> None:
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self.bands, self.rows = choose_bands(num_perm, threshold)
+        rand = random.Random(seed)
+        self.permutations = [(rand.randrange(1, MERSENNE_PRIME), rand.randrange(0, MERSENNE_PRIME))
+                             for _ in range(num_perm)]
+        self.n_texts = 0
+        self.n_duplicates = 0
+        self._exact: Dict[str, int] = {}
+        self._buckets: List[Dict[Tuple, List[int]]] = [{} for _ in range(self.bands)]
+        self._shingles: Dict[int, FrozenSet[int]] = {}
+        self.max_texts = max_texts
+        # the normalized texts and LSH keys of each representative, least recently matched first
+        self._entries: Dict[int, Tuple[List[str], List[Tuple]]] = OrderedDict()
+
+    def shingle(self, text: str) -> FrozenSet[int]:
+        n = self.shingle_size
+        if len(text) <= n:
+            return frozenset([zlib.crc32(text.encode('utf-8'))])
+        return frozenset(zlib.crc32(text[i: i + n].encode('utf-8')) for i in range(len(text) - n + 1))
+
+    def minhash(self, shingles: FrozenSet[int]) -> List[int]:
+        return [min((a * x + b) % MERSENNE_PRIME for x in shingles) for a, b in self.permutations]
+
+    @staticmethod
+    def jaccard(a: FrozenSet[int], b: FrozenSet[int]) -> float:
+        return len(a & b) / len(a | b)
+
+    def add(self, text: str) -> int:
+        index = self.n_texts
+        self.n_texts += 1
+        normalized = normalize_text(text)
+        representative, keys = self._exact.get(normalized), []
+        if representative is None and self.threshold < 1:
+            shingles = self.shingle(normalized)
+            signature = self.minhash(shingles)
+            keys = [tuple(signature[i * self.rows: (i + 1) * self.rows]) for i in range(self.bands)]
+            candidates = {c for bucket, key in zip(self._buckets, keys) for c in bucket.get(key, ())}
+            best = 0.
+            for candidate in sorted(candidates):
+                similarity = self.jaccard(shingles, self._shingles[candidate])
+                if similarity >= self.threshold and similarity > best:
+                    representative, best = candidate, similarity
+            if representative is None:
+                self._shingles[index] = shingles
+                for bucket, key in zip(self._buckets, keys):
+                    bucket.setdefault(key, []).append(index)
+        if representative is None:
+            self._exact[normalized] = index
+            self._entries[index] = ([normalized], keys)
+            if self.max_texts is not None and len(self._entries) > self.max_texts:
+                self._evict(next(iter(self._entries)))
+            return index
+        if normalized not in self._exact:
+            self._exact[normalized] = representative
+            self._entries[representative][0].append(normalized)
+        self._entries.move_to_end(representative)
+        self.n_duplicates += 1
+        return representative
+
+    def _evict(self, representative: int) -> None:
+        normalized_texts, keys = self._entries.pop(representative)
+        for normalized in normalized_texts:
+            del self._exact[normalized]
+        self._shingles.pop(representative, None)
+        for bucket, key in zip(self._buckets, keys):
+            bucket[key].remove(representative)
+            if not bucket[key]:
+                del bucket[key]
+
+    def stats(self) -> Dict:
+        return {'texts': self.n_texts, 'duplicates': self.n_duplicates,
+                'duplicate_rate': round(self.n_duplicates / self.n_texts, 5) if self.n_texts else 0.}
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+
+''' Streaming export of annotation results.
+
+`CorpusExporter` formats each result from its parsed fields as it arrives and writes it through a buffer,
+so the annotators do not need to keep a `formatted_result` in every response, and a corpus is never
+held in memory. BIO and segment outputs are CoNLL style files, sentences separated by a blank line.
+
+Example:
+    with open('corpus.conll', 'wb') as writer, CorpusExporter(writer, 'BIO') as exporter:
+        exporter.write_all(annotator.imap(texts))
+'''
+
+import json
+from typing import IO, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .config import (
+    Tasks, Formatter, NERFormatter, ExportFormatter, DEFAULT_EXPORT_BUFFER_SIZE, DEFAULT_EXPORT_ROW_GROUP_SIZE
+)
+
+
+def get_ner_segments(text: str, entities: List[Tuple]) -> List[Tuple[str, str]]:
+    ''' Split text into (segment, label) pairs, the label of the segments between entities is `O`.
+    '''
+    prev_start = 0
+    segments = []
+    for start, end, entity, entity_type in entities:
+        if start > prev_start:
+            segments.append((text[prev_start: start], 'O'))
+        segments.append((entity, entity_type))
+        prev_start = end
+    if prev_start < len(text):
+        segments.append((text[prev_start:], 'O'))
+    return segments
+
+
+def iter_bio(text: str, entities: List[Tuple]) -> Iterator[str]:
+    ''' Yield the pieces of the BIO lines of text, a `char\\ttag` line per character.
+    Each segment is joined at once instead of formatting a string per character.
+    '''
+    for i, (segment, label) in enumerate(get_ner_segments(text, entities)):
+        if i:
+            yield '\n'
+        if label == 'O':
+            yield '\tO\n'.join(segment)
+            yield '\tO'
+        else:
+            yield segment[0]
+            yield f'\tB-{label}'
+            if len(segment) > 1:
+                inside = f'\tI-{label}'
+                yield '\n'
+                yield f'{inside}\n'.join(segment[1:])
+                yield inside
+
+
+def iter_segment(text: str, entities: List[Tuple]) -> Iterator[str]:
+    ''' Yield the pieces of the segment lines of text, a `segment\\tlabel` line per segment.
+    '''
+    for i, (segment, label) in enumerate(get_ner_segments(text, entities)):
+        if i:
+            yield '\n'
+        yield segment
+        yield '\t'
+        yield label
+
+
+def iter_bio_tags(text: str, entities: List[Tuple]) -> Iterator[str]:
+    for segment, label in get_ner_segments(text, entities):
+        if label == 'O':
+            yield from ('O' for _ in segment)
+        elif segment:
+            yield f'B-{label}'
+            yield from (f'I-{label}' for _ in segment[1:])
+
+
+def get_parquet_schema(task: str):
+    import pyarrow as pa
+
+    text = ('text', pa.string())
+    if task == Tasks.NER:
+        entity = pa.struct([('start', pa.int64()), ('end', pa.int64()),
+                            ('entity', pa.string()), ('label', pa.string())])
+        return pa.schema([text, ('entities', pa.list_(entity)), ('tags', pa.list_(pa.string()))])
+    if task == Tasks.Classification:
+        return pa.schema([text, ('label', pa.string())])
+    if task == Tasks.MultiLabelClassification:
+        return pa.schema([text, ('label', pa.list_(pa.string()))])
+    if task == Tasks.DataAugmentation:
+        return pa.schema([text, ('sentences', pa.list_(pa.string()))])
+    if task == Tasks.RelationExtraction:
+        triple = pa.struct([('subject', pa.string()), ('predicate', pa.string()), ('object', pa.string())])
+        return pa.schema([text, ('triples', pa.list_(triple))])
+    raise ValueError(f'Unknown task `{task}`.')
+
+
+def to_parquet_row(task: str, result: Dict) -> Dict:
+    row = {'text': result['text']}
+    if task == Tasks.NER:
+        entities = result.get('entities', [])
+        row['entities'] = [{'start': start, 'end': end, 'entity': entity, 'label': label}
+                           for start, end, entity, label in entities]
+        row['tags'] = list(iter_bio_tags(result['text'], entities))
+    elif task in (Tasks.Classification, Tasks.MultiLabelClassification):
+        row['label'] = result.get('label')
+    elif task == Tasks.DataAugmentation:
+        row['sentences'] = result.get('sentences', [])
+    elif task == Tasks.RelationExtraction:
+        row['triples'] = [{'subject': s, 'predicate': p, 'object': o} for s, p, o in result.get('triples', [])]
+    return row
+
+
+def to_jsonl_record(task: Optional[str], result: Dict) -> Dict:
+    ''' Return the record of a result as the JSONL formatter of the annotators: the text and the label of a
+    classification, the text and the sentences of a data augmentation, the whole result otherwise.
+    The task is guessed from the result if it is not given.
+    '''
+    if task in (Tasks.Classification, Tasks.MultiLabelClassification) or (task is None and 'label' in result):
+        return {'text': result['text'], 'label': result['label']} if 'label' in result else {'text': result['text']}
+    if task == Tasks.DataAugmentation or (task is None and 'sentences' in result):
+        return {'text': result['text'], 'sentences': result['sentences']}
+    # the annotators write the whole result of relation extraction
+    return {k: v for k, v in result.items() if k != 'formatted_result'}
+
+
+class CorpusExporter:
+    ''' Write annotation results to a binary stream incrementally.
+
+    BIO, segment and JSONL outputs are identical to writing the `formatted_result` of the annotators,
+    see `to_jsonl_record` for JSONL. They are encoded in UTF-8 and written every `buffer_size` characters.
+    Parquet outputs have a row per result with the columns of the task, see `get_parquet_schema`,
+    and a row group every `buffer_size` rows, `DEFAULT_EXPORT_ROW_GROUP_SIZE` by default.
+    It requires pyarrow and the `task`.
+
+    Args:
+        writer: binary stream, e.g. a file opened with `wb`. It is not closed by the exporter.
+        formatter: BIO, segment, jsonl or parquet.
+    '''
+    def __init__(self,
+                 writer: IO[bytes],
+                 formatter: str,
+                 task: Optional[str] = None,
+                 buffer_size: Optional[int] = None) -> None:
+        formatters = NERFormatter.values() + Formatter.values() + ExportFormatter.values()
+        if formatter not in formatters:
+            raise ValueError(f'Invalid formatter `{formatter}`, please specify formatter from {formatters}.')
+        self.writer = writer
+        self.formatter = formatter
+        self.task = task
+        if buffer_size is None:
+            is_parquet = formatter == ExportFormatter.Parquet
+            buffer_size = DEFAULT_EXPORT_ROW_GROUP_SIZE if is_parquet else DEFAULT_EXPORT_BUFFER_SIZE
+        self.buffer_size = buffer_size
+        self.n_records = 0
+        self._pieces: List = []
+        self._size = 0
+        self._parquet_writer = None
+        if formatter == ExportFormatter.Parquet:
+            if task is None:
+                raise ValueError('The task is required by the parquet formatter.')
+            try:
+                import pyarrow.parquet as pq
+            except ImportError:
+                raise ImportError('Parquet export requires pyarrow, please install it by `pip install llano[export]`.')
+            self._schema = get_parquet_schema(task)
+            self._parquet_writer = pq.ParquetWriter(writer, self._schema)
+
+    def _write_text(self, result: Dict) -> None:
+        pieces = self._pieces
+        size = len(pieces)
+        if self.formatter == NERFormatter.BIO:
+            pieces.extend(iter_bio(result['text'], result.get('entities', [])))
+            pieces.append('\n\n')
+        elif self.formatter == NERFormatter.Segment:
+            pieces.extend(iter_segment(result['text'], result.get('entities', [])))
+            pieces.append('\n\n')
+        else:
+            pieces.append(json.dumps(to_jsonl_record(self.task, result), ensure_ascii=False))
+            pieces.append('\n')
+        self._size += sum(len(piece) for piece in pieces[size:])
+
+    def write(self, ret: Dict) -> None:
+        ''' Write an annotation result, i.e. the output of `GPTAnnotator.tag`.
+        '''
+        if self._parquet_writer is not None:
+            self._pieces.append(to_parquet_row(self.task, ret['result']))
+            self._size += 1
+        else:
+            self._write_text(ret['result'])
+        self.n_records += 1
+        if self._size >= self.buffer_size:
+            self.flush()
+
+    def write_all(self, rets: Iterable[Dict]) -> int:
+        for ret in rets:
+            self.write(ret)
+        return self.n_records
+
+    def flush(self) -> None:
+        if self._pieces:
+            if self._parquet_writer is not None:
+                import pyarrow as pa
+
+                self._parquet_writer.write_table(pa.Table.from_pylist(self._pieces, schema=self._schema))
+            else:
+                self.writer.write(''.join(self._pieces).encode('utf-8'))
+            self._pieces = []
+            self._size = 0
+        self.writer.flush()
+
+    def tell(self) -> int:
+        ''' Flush, and return the position of the stream.
+        '''
+        self.flush()
+        return self.writer.tell()
+
+    def close(self) -> None:
+        self.flush()
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+            self._parquet_writer = None
+
+    def __enter__(self) -> 'CorpusExporter':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+
+''' Retrieval of few-shot demonstrations from a pool of labeled examples.
+
+The examples are indexed by TF-IDF weighted, hashed character n-grams in an inverted index,
+which is saved as NumPy arrays and memory-mapped when loaded, so the pool does not need to fit in memory
+and a query only reads the postings of its own n-grams.
+
+Example:
+    index = ExampleIndex.build([('Elon Musk founded SpaceX.', '(Elon Musk, people), (SpaceX, company)'), ...])
+    index.save('examples')
+    annotator = GPTAnnotator(model, task='ner', language='en', label_mapping=...,
+                             examples=ExampleIndex.load('examples'), n_examples=8, max_example_tokens=512)
+'''
+
+import os
+import json
+import math
+import mmap
+import zlib
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    raise ImportError('Few-shot retrieval requires numpy, please install it by `pip install llano[fewshot]`.')
+
+from .config import Languages, DEFAULT_EXAMPLE_NGRAM, DEFAULT_EXAMPLE_FEATURES, DEFAULT_MAX_POSTINGS
+from .dedup import normalize_text
+
+
+EXAMPLE_TEMPLATES: Dict[str, str] = {
+    Languages.EN: 'Input: {text}\nOutput: {output}',
+    Languages.ZH_CN: '输入：{text}\n输出：{output}',
+}
+
+
+def featurize(text: str, ngram: int = DEFAULT_EXAMPLE_NGRAM, n_features: int = DEFAULT_EXAMPLE_FEATURES) -> Counter:
+    ''' Count the hashed character n-grams of the normalized text.
+    '''
+    text = normalize_text(text)
+    if len(text) <= ngram:
+        grams = [text]
+    else:
+        grams = (text[i: i + ngram] for i in range(len(text) - ngram + 1))
+    return Counter(zlib.crc32(gram.encode('utf-8')) % n_features for gram in grams)
+
+
+class ExampleIndex:
+    ''' Inverted index of labeled examples, i.e. (text, output) pairs where output is the expected response.
+
+    Use `build` to index examples, `save` to write the index to a directory and `load` to memory-map it.
+    '''
+    def __init__(self,
+                 indptr: 'np.ndarray',
+                 doc_ids: 'np.ndarray',
+                 weights: 'np.ndarray',
+                 idf: 'np.ndarray',
+                 examples: List[Tuple[str, str]],
+                 ngram: int = DEFAULT_EXAMPLE_NGRAM,
+                 max_postings: int = DEFAULT_MAX_POSTINGS) -> None:
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.weights = weights
+        self.idf = idf
+        self.examples = examples
+        self.ngram = ngram
+        self.max_postings = max_postings
+
+    @property
+    def n_features(self) -> int:
+        return len(self.idf)
+
+    def __len__(self) -> int:
+        return len(self.examples)
+
+    @classmethod
+    def build(cls,
+              examples: Iterable[Tuple[str, str]],
+              ngram: int = DEFAULT_EXAMPLE_NGRAM,
+              n_features: int = DEFAULT_EXAMPLE_FEATURES,
+              max_postings: int = DEFAULT_MAX_POSTINGS) -> 'ExampleIndex':
+        examples = [(text, output) for text, output in examples]
+        features, rows = [], []
+        df = np.zeros(n_features, dtype=np.int64)
+        for i, (text, _) in enumerate(examples):
+            counts = featurize(text, ngram=ngram, n_features=n_features)
+            keys = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+            features.append((keys, np.fromiter(counts.values(), dtype=np.float32, count=len(counts))))
+            rows.append(np.full(len(counts), i, dtype=np.int32))
+            df[keys] += 1
+        idf = (np.log((len(examples) + 1) / (df + 1)) + 1).astype(np.float32)
+        if features:
+            cols = np.concatenate([keys for keys, _ in features])
+            values = np.concatenate([tf * idf[keys] for keys, tf in features])
+            rows = np.concatenate(rows)
+        else:
+            cols, values, rows = np.zeros(0, np.int64), np.zeros(0, np.float32), np.zeros(0, np.int32)
+        # l2 normalize each example, so that the dot product is the cosine similarity
+        norms = np.sqrt(np.bincount(rows, weights=values.astype(np.float64) ** 2, minlength=len(examples)))
+        values = (values / np.maximum(norms[rows], 1e-12)).astype(np.float32)
+        # postings sorted by feature
+        order = np.argsort(cols, kind='stable')
+        indptr = np.zeros(n_features + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cols, minlength=n_features), out=indptr[1:])
+        return cls(indptr, rows[order], values[order], idf, examples, ngram=ngram, max_postings=max_postings)
+
+    def save(self, path: str) -> None:
+        os.makedirs(path, exist_ok=True)
+        for name in ('indptr', 'doc_ids', 'weights', 'idf'):
+            np.save(os.path.join(path, f'{name}.npy'), getattr(self, name))
+        offsets = [0]
+        with open(os.path.join(path, 'examples.jsonl'), 'wb') as writer:
+            for text, output in self.examples:
+                line = (json.dumps([text, output], ensure_ascii=False) + '\n').encode('utf-8')
+                writer.write(line)
+                offsets.append(offsets[-1] + len(line))
+        np.save(os.path.join(path, 'offsets.npy'), np.array(offsets, dtype=np.int64))
+        with open(os.path.join(path, 'meta.json'), 'w', encoding='utf-8') as writer:
+            json.dump({'ngram': self.ngram, 'max_postings': self.max_postings, 'size': len(self)}, writer)
+
+    @classmethod
+    def load(cls, path: str) -> 'ExampleIndex':
+        ''' Memory-map an index written by `save`.
+        '''
+        with open(os.path.join(path, 'meta.json'), encoding='utf-8') as reader:
+            meta = json.load(reader)
+        arrays = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r')
+                  for name in ('indptr', 'doc_ids', 'weights', 'idf', 'offsets')}
+        examples = MappedExamples(os.path.join(path, 'examples.jsonl'), arrays.pop('offsets'))
+        return cls(examples=examples, ngram=meta['ngram'], max_postings=meta['max_postings'], **arrays)
+
+    def search(self, text: str, k: int) -> List[Tuple[int, float]]:
+        ''' Return the (position, cosine similarity) of the k most similar examples.
+        N-grams with more than `max_postings` examples are skipped, they are too common to discriminate.
+        '''
+        counts = featurize(text, ngram=self.ngram, n_features=self.n_features)
+        doc_ids, scores = [], []
+        for feature, tf in counts.items():
+            start, end = self.indptr[feature], self.indptr[feature + 1]
+            if start == end or end - start > self.max_postings:
+                continue
+            doc_ids.append(self.doc_ids[start: end])
+            scores.append(self.weights[start: end] * (tf * self.idf[feature]))
+        if not doc_ids:
+            return []
+        docs, inverse = np.unique(np.concatenate(doc_ids), return_inverse=True)
+        totals = np.bincount(inverse, weights=np.concatenate(scores))
+        if len(totals) > k:
+            top = np.argpartition(-totals, k - 1)[:k]
+        else:
+            top = np.arange(len(totals))
+        top = top[np.argsort(-totals[top], kind='stable')]
+        # the query norm does not change the ranking, normalize for a comparable score
+        query_norm = math.sqrt(sum((tf * float(self.idf[f])) ** 2 for f, tf in counts.items())) or 1.
+        return [(int(docs[i]), float(totals[i]) / query_norm) for i in top]
+
+    def retrieve(self, text: str, k: int) -> List[Tuple[str, str]]:
+        return [self.examples[i] for i, _ in self.search(text, k)]
+
+
+class MappedExamples:
+    ''' Examples read on demand from a memory-mapped JSONL file.
+    '''
+    def __init__(self, path: str, offsets: 'np.ndarray') -> None:
+        self.offsets = offsets
+        with open(path, 'rb') as reader:
+            self._mmap = mmap.mmap(reader.fileno(), 0, access=mmap.ACCESS_READ) if offsets[-1] else b''
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> Tuple[str, str]:
+        text, output = json.loads(self._mmap[self.offsets[i]: self.offsets[i + 1]])
+        return text, output
+
+
+def format_examples(examples: List[Tuple[str, str]], language: str) -> List[str]:
+    template = EXAMPLE_TEMPLATES.get(language, EXAMPLE_TEMPLATES[Languages.EN])
+    return [template.format(text=text, output=output) for text, output in examples]
+
+
+def select_examples(index: ExampleIndex,
+                    text: str,
+                    k: int,
+                    language: str,
+                    count_tokens: Callable[[str], int],
+                    max_tokens: Optional[int] = None) -> Tuple[str, int]:
+    ''' Retrieve the k most similar examples and keep the most similar ones within `max_tokens`.
+    Return the demonstrations, one per line, and their number of tokens.
+    '''
+    demos, n_tokens = [], 0
+    for demo in format_examples(index.retrieve(text, k), language):
+        # and a line break
+        n = count_tokens(demo) + 1
+        if max_tokens is not None and n_tokens + n > max_tokens:
+            break
+        demos.append(demo)
+        n_tokens += n
+    return '\n'.join(demos), n_tokens
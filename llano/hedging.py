@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+''' Hedged requests: a request still running after the `quantile` of the recent latencies is sent again,
+on another api key if there are several, and the first response wins.
+'''
+
+import math
+import threading
+from collections import deque
+from typing import Dict, Optional
+
+from .config import DEFAULT_HEDGE_QUANTILE, DEFAULT_HEDGE_MIN_SAMPLES, DEFAULT_HEDGE_WINDOW
+
+# the quantile is sorted again every few observations
+REFRESH_INTERVAL = 16
+
+
+class Hedger:
+    ''' Hedge delay of the requests of a model, and statistics of the hedges.
+
+    Args:
+        quantile: a request is hedged once it is slower than this quantile of the latencies of the last
+            `window` requests. Requests are not hedged until `min_samples` latencies are observed.
+    '''
+    def __init__(self,
+                 quantile: float = DEFAULT_HEDGE_QUANTILE,
+                 min_samples: int = DEFAULT_HEDGE_MIN_SAMPLES,
+                 window: int = DEFAULT_HEDGE_WINDOW) -> None:
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self._latencies = deque(maxlen=window)
+        self._n_observed = 0
+        self._delay = None
+        self.n_requests = 0
+        self.n_hedged = 0
+        self.n_wins = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        ''' Add the latency of a successful request.
+        '''
+        with self._lock:
+            self._latencies.append(seconds)
+            self._n_observed += 1
+            if self._delay is None or self._n_observed % REFRESH_INTERVAL == 0:
+                self._delay = None
+                if len(self._latencies) >= self.min_samples:
+                    latencies = sorted(self._latencies)
+                    self._delay = latencies[min(len(latencies) - 1, math.ceil(self.quantile * len(latencies)) - 1)]
+
+    def get_delay(self) -> Optional[float]:
+        ''' Seconds after which a request is hedged, None until `min_samples` latencies are observed.
+        '''
+        return self._delay
+
+    def record(self, hedged: bool, won: bool = False) -> None:
+        ''' Count a request, whether it was hedged and whether the hedge answered first.
+        '''
+        with self._lock:
+            self.n_requests += 1
+            self.n_hedged += hedged
+            self.n_wins += won
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'requests': self.n_requests,
+                'hedged': self.n_hedged,
+                'hedge_wins': self.n_wins,
+                'hedge_rate': self.n_hedged / self.n_requests if self.n_requests else 0.,
+                'delay': self._delay,
+            }
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+from contextlib import contextmanager
+from collections import defaultdict
+from typing import Callable, Dict, Iterator, Optional
+
+
+UsageKeys = ('prompt_tokens', 'completion_tokens')
+
+
+@contextmanager
+def timed(timings: Optional[Dict], stage: str) -> Iterator[None]:
+    ''' Add the monotonic time taken by the block to `timings[stage]`, it is a no-op if `timings` is None.
+    '''
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.) + time.perf_counter() - start
+
+
+def escape_label(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Instrumentation:
+    ''' Running aggregates of the requests of the annotators.
+
+    Each annotated request reports its `meta`, which holds the seconds spent in every stage of `Stages`,
+    whether the response was served from the cache, the masked api key and the token usage.
+    They are aggregated per task (and per api key for token usage), published to the subscribers,
+    and can be exported in the Prometheus text format.
+    '''
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._subscribers = []
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.stage_seconds = defaultdict(float)
+            self.stage_counts = defaultdict(int)
+            self.requests = defaultdict(int)
+            self.tokens = defaultdict(int)
+
+    def subscribe(self, callback: Callable[[str, Dict], None]) -> Callable[[], None]:
+        ''' Call `callback(task, meta)` on every request, return a function which unsubscribes it.
+        '''
+        with self._lock:
+            self._subscribers.append(callback)
+        return lambda: self.unsubscribe(callback)
+
+    def unsubscribe(self, callback: Callable[[str, Dict], None]) -> None:
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def observe(self, task: str, meta: Dict) -> None:
+        cache_hit = bool(meta.get('cache_hit'))
+        with self._lock:
+            for stage, seconds in (meta.get('timings') or {}).items():
+                self.stage_seconds[task, stage] += seconds
+                self.stage_counts[task, stage] += 1
+            self.requests[task, 'hit' if cache_hit else 'miss'] += 1
+            # cached responses spend no tokens
+            if not cache_hit:
+                api_key = meta.get('api_key', '')
+                for key in UsageKeys:
+                    if key in meta:
+                        self.tokens[task, api_key, key.split('_')[0]] += meta[key]
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            callback(task, meta)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            stages = defaultdict(dict)
+            for (task, stage), seconds in self.stage_seconds.items():
+                stages[task][stage] = {'seconds': round(seconds, 6), 'count': self.stage_counts[task, stage]}
+            requests = defaultdict(dict)
+            for (task, cache), count in self.requests.items():
+                requests[task][cache] = count
+            tokens = defaultdict(lambda: defaultdict(dict))
+            for (task, api_key, kind), count in self.tokens.items():
+                tokens[task][api_key][kind] = count
+            return {'stages': dict(stages), 'requests': dict(requests),
+                    'tokens': {task: dict(v) for task, v in tokens.items()}}
+
+    def to_prometheus(self, prefix: str = 'llano') -> str:
+        ''' Export the aggregates in the Prometheus text exposition format.
+        '''
+        with self._lock:
+            lines = [f'# HELP {prefix}_stage_seconds_total Seconds spent in each stage of the requests.',
+                     f'# TYPE {prefix}_stage_seconds_total counter']
+            for (task, stage), seconds in sorted(self.stage_seconds.items()):
+                lines.append(f'{prefix}_stage_seconds_total{{task="{escape_label(task)}",stage="{stage}"}} {seconds}')
+            lines += [f'# HELP {prefix}_stage_count_total Number of requests which went through each stage.',
+                      f'# TYPE {prefix}_stage_count_total counter']
+            for (task, stage), count in sorted(self.stage_counts.items()):
+                lines.append(f'{prefix}_stage_count_total{{task="{escape_label(task)}",stage="{stage}"}} {count}')
+            lines += [f'# HELP {prefix}_requests_total Number of requests by response cache result.',
+                      f'# TYPE {prefix}_requests_total counter']
+            for (task, cache), count in sorted(self.requests.items()):
+                lines.append(f'{prefix}_requests_total{{task="{escape_label(task)}",cache="{cache}"}} {count}')
+            lines += [f'# HELP {prefix}_tokens_total Tokens used, as reported by the API.',
+                      f'# TYPE {prefix}_tokens_total counter']
+            for (task, api_key, kind), count in sorted(self.tokens.items()):
+                lines.append(f'{prefix}_tokens_total{{task="{escape_label(task)}",api_key="{escape_label(api_key)}",'
+                             f'type="{kind}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+# shared by the annotators which are not given their own instance
+default_instrumentation = Instrumentation()
@@ -0,0 +1,384 @@
+# -*- coding: utf-8 -*-
+
+''' Durable work queue of annotation jobs, shared by any number of worker processes.
+
+A job is a SQLite database holding the task configuration, the texts to annotate, the leases of the workers
+and the results. Workers claim batches of texts under a lease, annotate them and commit their results;
+a result is only committed while its lease is held and once per text, so texts whose worker died are claimed
+again after the lease expires without being committed twice. Workers on several machines can share a job
+on a file system with working POSIX locks, which is not the case of most NFS mounts.
+
+Example:
+    llano-jobs create job.db --task ner --language en --label-mapping labels.json --input corpus.jsonl
+    llano-jobs work job.db --num-workers 32    # on every worker process or machine
+    llano-jobs status job.db
+    llano-jobs export job.db --output corpus.conll --formatter BIO
+'''
+
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import logging
+import argparse
+import threading
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .config import Tasks, JobStatus, DEFAULT_JOB_BATCH_SIZE, DEFAULT_LEASE_SECONDS, DEFAULT_MAX_ATTEMPTS
+
+if TYPE_CHECKING:
+    from .annotators import GPTAnnotator
+
+
+logger = logging.getLogger('llano')
+
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS config (key TEXT PRIMARY KEY, value TEXT NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS items (id INTEGER PRIMARY KEY, text TEXT NOT NULL, '
+    "status TEXT NOT NULL DEFAULT 'pending', attempts INTEGER NOT NULL DEFAULT 0, "
+    'worker TEXT, lease_expires REAL, error TEXT)',
+    'CREATE INDEX IF NOT EXISTS items_status ON items (status, lease_expires)',
+    'CREATE TABLE IF NOT EXISTS results (id INTEGER PRIMARY KEY, worker TEXT NOT NULL, '
+    'output TEXT NOT NULL, created_at REAL NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS results_created_at ON results (created_at)',
+)
+
+
+def make_worker_id() -> str:
+    return f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}'
+
+
+class WorkQueue:
+    ''' SQLite work queue of a job, see the module docstring.
+
+    Args:
+        path: path of the database, it is created if it does not exist.
+        lease_seconds: a claimed text is given to another worker if it is not committed within it.
+        max_attempts: a text which fails this many times is marked as failed.
+    '''
+    def __init__(self,
+                 path: str,
+                 lease_seconds: float = DEFAULT_LEASE_SECONDS,
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> None:
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        with self._transaction() as conn:
+            for statement in SCHEMA:
+                conn.execute(statement)
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite connections can be shared neither across threads nor across forked processes
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            # transactions are explicit
+            conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        ''' Write transaction, it takes the write lock upfront so that concurrent claims are serialized.
+        '''
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def set_config(self, config: Dict) -> None:
+        with self._transaction() as conn:
+            conn.executemany('INSERT OR REPLACE INTO config (key, value) VALUES (?, ?)',
+                             [(k, json.dumps(v, ensure_ascii=False)) for k, v in config.items()])
+
+    def get_config(self) -> Dict:
+        return {k: json.loads(v) for k, v in self._connect().execute('SELECT key, value FROM config')}
+
+    def add(self, texts: Iterable[str], batch_size: int = 10000) -> int:
+        ''' Append texts to the queue, in batches of `batch_size` per transaction. Return the number of texts.
+        '''
+        n_texts, batch = 0, []
+        for text in texts:
+            batch.append((text, ))
+            if len(batch) == batch_size:
+                n_texts += self._insert(batch)
+                batch = []
+        if batch:
+            n_texts += self._insert(batch)
+        return n_texts
+
+    def _insert(self, batch: List[Tuple[str]]) -> int:
+        with self._transaction() as conn:
+            conn.executemany('INSERT INTO items (text) VALUES (?)', batch)
+        return len(batch)
+
+    def claim(self, worker: str, batch_size: int = DEFAULT_JOB_BATCH_SIZE) -> List[Tuple[int, str]]:
+        ''' Lease up to `batch_size` pending texts, or texts whose lease has expired, to the worker.
+        Return their (id, text).
+        '''
+        now = time.time()
+        with self._transaction() as conn:
+            # texts whose workers keep dying while annotating them
+            conn.execute('UPDATE items SET status = ?, error = ? '
+                         'WHERE status = ? AND lease_expires < ? AND attempts >= ?',
+                         (JobStatus.Failed, 'lease expired', JobStatus.Leased, now, self.max_attempts))
+            rows = conn.execute(
+                'SELECT id, text FROM items WHERE status = ? OR (status = ? AND lease_expires < ?) '
+                'ORDER BY id LIMIT ?', (JobStatus.Pending, JobStatus.Leased, now, batch_size)).fetchall()
+            conn.executemany(
+                'UPDATE items SET status = ?, worker = ?, lease_expires = ?, attempts = attempts + 1 WHERE id = ?',
+                [(JobStatus.Leased, worker, now + self.lease_seconds, i) for i, _ in rows])
+        return rows
+
+    def renew(self, worker: str, ids: List[int]) -> int:
+        ''' Extend the leases of the worker on `ids`. Return the number of leases which are still held.
+        '''
+        with self._transaction() as conn:
+            cursor = conn.executemany(
+                'UPDATE items SET lease_expires = ? WHERE id = ? AND status = ? AND worker = ?',
+                [(time.time() + self.lease_seconds, i, JobStatus.Leased, worker) for i in ids])
+            return cursor.rowcount
+
+    def complete(self, worker: str, outputs: List[Tuple[int, Dict]]) -> int:
+        ''' Commit the outputs of texts leased by the worker, in one transaction.
+        The outputs of texts whose lease was lost, or which are done already, are dropped.
+        Return the number of committed outputs.
+        '''
+        now = time.time()
+        n_committed = 0
+        # serialized before taking the write lock
+        outputs = [(i, json.dumps(output, ensure_ascii=False)) for i, output in outputs]
+        with self._transaction() as conn:
+            for i, output in outputs:
+                cursor = conn.execute(
+                    'UPDATE items SET status = ?, lease_expires = NULL, error = NULL '
+                    'WHERE id = ? AND status = ? AND worker = ?', (JobStatus.Done, i, JobStatus.Leased, worker))
+                if cursor.rowcount:
+                    conn.execute('INSERT INTO results (id, worker, output, created_at) VALUES (?, ?, ?, ?)',
+                                 (i, worker, output, now))
+                    n_committed += 1
+        return n_committed
+
+    def fail(self, worker: str, failures: List[Tuple[int, str]]) -> None:
+        ''' Release the texts which failed, they are retried until they have been attempted `max_attempts` times.
+        '''
+        with self._transaction() as conn:
+            conn.executemany(
+                'UPDATE items SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, '
+                'lease_expires = NULL, error = ? WHERE id = ? AND status = ? AND worker = ?',
+                [(self.max_attempts, JobStatus.Failed, JobStatus.Pending, error, i, JobStatus.Leased, worker)
+                 for i, error in failures])
+
+    def retry_failed(self) -> int:
+        ''' Put the failed texts back into the queue with a fresh attempt budget.
+        '''
+        with self._transaction() as conn:
+            return conn.execute('UPDATE items SET status = ?, attempts = 0 WHERE status = ?',
+                                (JobStatus.Pending, JobStatus.Failed)).rowcount
+
+    def progress(self, window: float = 60.) -> Dict:
+        ''' Counts of texts per status, the throughput of the last `window` seconds and the estimated time left.
+        '''
+        conn = self._connect()
+        now = time.time()
+        counts = {status: 0 for status in JobStatus.values()}
+        for status, count in conn.execute('SELECT status, COUNT(*) FROM items GROUP BY status'):
+            counts[status] = count
+        n_expired = conn.execute('SELECT COUNT(*) FROM items WHERE status = ? AND lease_expires < ?',
+                                 (JobStatus.Leased, now)).fetchone()[0]
+        n_recent = conn.execute('SELECT COUNT(*) FROM results WHERE created_at >= ?', (now - window, )).fetchone()[0]
+        workers = dict(conn.execute('SELECT worker, COUNT(*) FROM results WHERE created_at >= ? GROUP BY worker',
+                                    (now - window, )).fetchall())
+        total = sum(counts.values())
+        throughput = n_recent / window
+        remaining = counts[JobStatus.Pending] + counts[JobStatus.Leased]
+        return dict(counts,
+                    total=total,
+                    expired_leases=n_expired,
+                    items_per_s=round(throughput, 3),
+                    active_workers=len(workers),
+                    eta_s=round(remaining / throughput, 1) if throughput else None)
+
+    def is_finished(self) -> bool:
+        return self._connect().execute('SELECT COUNT(*) FROM items WHERE status IN (?, ?)',
+                                       (JobStatus.Pending, JobStatus.Leased)).fetchone()[0] == 0
+
+    def results(self, batch_size: int = 1000) -> Iterator[Tuple[int, Dict]]:
+        ''' Yield the (id, output) of the committed texts in input order, reading `batch_size` rows at a time.
+        '''
+        last_id = 0
+        while True:
+            rows = self._connect().execute('SELECT id, output FROM results WHERE id > ? ORDER BY id LIMIT ?',
+                                           (last_id, batch_size)).fetchall()
+            if not rows:
+                return
+            for i, output in rows:
+                yield i, json.loads(output)
+            last_id = rows[-1][0]
+
+    def failures(self) -> Iterator[Tuple[int, str, str]]:
+        yield from self._connect().execute('SELECT id, text, error FROM items WHERE status = ? ORDER BY id',
+                                           (JobStatus.Failed, ))
+
+    def close(self) -> None:
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class LeaseKeeper(threading.Thread):
+    ''' Renew the leases of the batch being annotated, so that slow batches are not claimed again.
+    '''
+    def __init__(self, queue: WorkQueue, worker: str, ids: List[int]) -> None:
+        super().__init__(daemon=True)
+        self.queue = queue
+        self.worker = worker
+        self.ids = ids
+        self._stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self._stopped.wait(self.queue.lease_seconds / 3):
+            try:
+                self.queue.renew(self.worker, self.ids)
+            except sqlite3.Error as e:
+                logger.warning('failed to renew the leases: %s', e)
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self.join()
+
+
+def run_worker(queue: WorkQueue,
+               annotator: 'GPTAnnotator',
+               worker: Optional[str] = None,
+               batch_size: int = DEFAULT_JOB_BATCH_SIZE,
+               num_workers: int = 1,
+               wait: bool = False,
+               poll_interval: float = 5.,
+               **kwargs) -> Dict:
+    ''' Claim batches of texts, annotate them with `annotator.imap` and commit the outputs, until the queue is
+    empty, or until all texts are done with `wait`, as leases of other workers may expire.
+    Outputs are committed without their request, i.e. the prompt.
+    '''
+    worker = worker or make_worker_id()
+    n_done, n_failed, start_time = 0, 0, time.time()
+    while True:
+        batch = queue.claim(worker, batch_size)
+        if not batch:
+            if not wait or queue.is_finished():
+                break
+            time.sleep(poll_interval)
+            continue
+        keeper = LeaseKeeper(queue, worker, [i for i, _ in batch])
+        keeper.start()
+        try:
+            outputs, failures = [], []
+            rets = annotator.imap([text for _, text in batch], num_workers=num_workers, **kwargs)
+            for (i, _), ret in zip(batch, rets):
+                if 'error' in ret:
+                    failures.append((i, ret['error']))
+                else:
+                    outputs.append((i, {k: v for k, v in ret.items() if k != 'request'}))
+        finally:
+            keeper.stop()
+        n_done += queue.complete(worker, outputs)
+        if failures:
+            queue.fail(worker, failures)
+            n_failed += len(failures)
+        logger.info('worker %s committed %d texts, %.2f texts/s, %d failures',
+                    worker, n_done, n_done / max(time.time() - start_time, 1e-6), n_failed)
+    return {'worker': worker, 'n_done': n_done, 'n_failed': n_failed}
+
+
+def build_parser() -> argparse.ArgumentParser:
+    from .cli import add_task_arguments, add_input_arguments, add_output_arguments, add_model_arguments
+
+    parser = argparse.ArgumentParser(prog='llano-jobs', description='Annotate a corpus with many worker processes.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    create = commands.add_parser('create', help='create a job and load its corpus.')
+    create.add_argument('queue', help='path of the job database.')
+    add_task_arguments(create)
+    add_input_arguments(create)
+    work = commands.add_parser('work', help='annotate the texts of a job.')
+    work.add_argument('queue')
+    add_model_arguments(work)
+    work.add_argument('--batch-size', type=int, default=DEFAULT_JOB_BATCH_SIZE, help='texts claimed at a time.')
+    work.add_argument('--lease', type=float, default=DEFAULT_LEASE_SECONDS, help='lease of a batch in seconds.')
+    work.add_argument('--max-attempts', type=int, default=DEFAULT_MAX_ATTEMPTS)
+    work.add_argument('--wait', action='store_true', help='wait for the leases of other workers to expire.')
+    status = commands.add_parser('status', help='show the progress of a job.')
+    status.add_argument('queue')
+    status.add_argument('--retry-failed', action='store_true', help='put the failed texts back into the queue.')
+    export = commands.add_parser('export', help='write the results of a job.')
+    export.add_argument('queue')
+    add_output_arguments(export)
+    return parser
+
+
+TaskArguments = ('task', 'language', 'label_mapping', 'hint', 'size', 'output_format')
+
+
+def run(args: argparse.Namespace) -> Dict:
+    from .cli import build_annotator, check_formatter, get_input_format, parse_label_mapping, read_texts, InputFormats
+    from .export import CorpusExporter
+
+    if args.command == 'create':
+        input_format = get_input_format(args)
+        if input_format not in InputFormats:
+            raise ValueError(f'Unknown input format of `{args.input}`, please specify --input-format.')
+        queue = WorkQueue(args.queue)
+        if queue.get_config():
+            raise ValueError(f'The job `{args.queue}` exists already.')
+        # the label mapping is stored, workers may not have its file
+        config = {k: getattr(args, k) for k in TaskArguments}
+        config['label_mapping'] = parse_label_mapping(args.label_mapping)
+        queue.set_config(config)
+        return {'n_texts': queue.add(read_texts(args.input, input_format, text_field=args.text_field))}
+    if args.command == 'work':
+        queue = WorkQueue(args.queue, lease_seconds=args.lease, max_attempts=args.max_attempts)
+        config = queue.get_config()
+        if not config:
+            raise ValueError(f'The job `{args.queue}` does not exist.')
+        config['label_mapping'] = json.dumps(config['label_mapping'])
+        annotator = build_annotator(argparse.Namespace(**vars(args), **config))
+        kwargs = {'size': config['size']} if config['task'] == Tasks.DataAugmentation else {}
+        return run_worker(queue, annotator, batch_size=args.batch_size, num_workers=args.num_workers,
+                          wait=args.wait, hint=config['hint'], **kwargs)
+    queue = WorkQueue(args.queue)
+    if args.command == 'status':
+        if args.retry_failed:
+            logger.info('%d failed texts are retried', queue.retry_failed())
+        return queue.progress()
+    task = queue.get_config()['task']
+    check_formatter(task, args.formatter)
+    with open(args.output, 'wb') as writer, CorpusExporter(writer, args.formatter, task=task) as exporter:
+        exporter.write_all(output for _, output in queue.results())
+    return {'n_records': exporter.n_records}
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    args = build_parser().parse_args(argv)
+    try:
+        stats = run(args)
+    except ValueError as e:
+        logger.error(e)
+        sys.exit(1)
+    print(json.dumps(stats, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
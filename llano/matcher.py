@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+from collections import deque
+from typing import Iterable, Iterator, List, Tuple
+
+
+class AhoCorasick:
+    ''' Aho-Corasick automaton to find the occurrences of many patterns in a single pass over the text.
+    '''
+    def __init__(self, patterns: Iterable[str]) -> None:
+        self.goto = [{}]
+        self.fail = [0]
+        # lengths of the patterns ending at each node
+        self.output = [()]
+        for pattern in patterns:
+            if pattern:
+                self._add(pattern)
+        self._build()
+
+    def _add(self, pattern: str) -> None:
+        node = 0
+        for char in pattern:
+            child = self.goto[node].get(char)
+            if child is None:
+                child = len(self.goto)
+                self.goto[node][char] = child
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append(())
+            node = child
+        if len(pattern) not in self.output[node]:
+            self.output[node] += (len(pattern), )
+
+    def _build(self) -> None:
+        # the failure links of the depth-1 nodes point to the root
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                state = self.fail[node]
+                while state and char not in self.goto[state]:
+                    state = self.fail[state]
+                self.fail[child] = self.goto[state].get(char, 0)
+                self.output[child] += self.output[self.fail[child]]
+
+    def iter(self, text: str) -> Iterator[Tuple[int, int]]:
+        ''' Yield the (start, end) spans of all, possibly overlapping, occurrences.
+        '''
+        goto, fail, output = self.goto, self.fail, self.output
+        node = 0
+        for i, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for length in output[node]:
+                yield i + 1 - length, i + 1
+
+    def find_all(self, text: str) -> List[Tuple[int, int]]:
+        ''' Return the non-overlapping occurrences, scanning from left to right and preferring the longest
+        pattern among those starting at the same position.
+        '''
+        spans, prev_end = [], 0
+        for start, end in sorted(self.iter(text), key=lambda x: (x[0], -x[1])):
+            if start >= prev_end:
+                spans.append((start, end))
+                prev_end = end
+        return spans
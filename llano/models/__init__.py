@@ -1,3 +1,16 @@
 # -*- coding: utf-8 -*-
 
-from .gpt import GPTModel  # NOQA
+import importlib
+from typing import TYPE_CHECKING
+
+from .replay import RecordingModel, ReplayModel  # NOQA
+
+if TYPE_CHECKING:
+    from .gpt import GPTModel  # NOQA
+
+
+def __getattr__(name: str):
+    # openai is only imported when GPTModel is used
+    if name == 'GPTModel':
+        return importlib.import_module('.gpt', __name__).GPTModel
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
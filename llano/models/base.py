@@ -1,7 +1,8 @@
 # -*- coding: utf-8 -*-
 
+import asyncio
 from abc import ABCMeta, abstractmethod
-from typing import Dict
+from typing import AsyncIterator, Dict, Iterator
 
 
 class BaseModel(metaclass=ABCMeta):
@@ -12,6 +13,21 @@ class BaseModel(metaclass=ABCMeta):
     def predict(self):
         raise NotImplementedError
 
+    async def apredict(self, text: str) -> Dict:
+        ''' Run the blocking `predict` in the default executor.
+        Subclasses with a native asynchronous client should override it.
+        '''
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.predict, text)
+
+    def predict_stream(self, text: str) -> Iterator[str]:
+        ''' Stream the response piece by piece, models without streaming support yield it as a single piece.
+        '''
+        yield self.predict(text)['response']
+
+    async def apredict_stream(self, text: str) -> AsyncIterator[str]:
+        yield (await self.apredict(text))['response']
+
     def get_output_template(self) -> Dict:
         return {
             'request': None,
@@ -1,15 +1,33 @@
 # -*- coding: utf-8 -*-
 
-import random
-from typing import Dict, Union, List, Optional
-from functools import partial, lru_cache
+import time
+import asyncio
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import nullcontext
+from typing import Any, AsyncContextManager, ContextManager, Dict, Union, List, Optional, Tuple, Iterator, AsyncIterator
+from functools import partial
 
-import tiktoken
 import openai
 
 from .base import BaseModel
-from ..config import OpenAIModels, MAX_LRU_CACHE_SIZE, OpenAIModelMaxTokensMapping, OpenAIChatCompletionAPIs
-from ..utils import with_taken_time
+from ..cache import ResponseCache
+from ..config import OpenAIModels, OpenAIModelMaxTokensMapping, OpenAIChatCompletionAPIs, DEFAULT_MAX_RETRIES
+from ..config import Stages
+from ..hedging import Hedger
+from ..instrumentation import timed
+from ..scheduler import KeyScheduler, mask_api_key
+from ..session import SessionPool, anullcontext, install_routing_session
+from ..tokenizer import get_tokenizer, count_tokens_batch
+
+
+RETRYABLE_ERRORS = (
+    openai.error.APIError,
+    openai.error.Timeout,
+    openai.error.APIConnectionError,
+    openai.error.ServiceUnavailableError,
+    openai.error.TryAgain,
+)
 
 
 class GPTModel(BaseModel):
@@ -21,57 +39,588 @@ class GPTModel(BaseModel):
                  top_p: float = 1,
                  frequency_penalty: float = 0,
                  presence_penalty: float = 0,
-                 stop: Union[str, None] = None,) -> None:
+                 stop: Union[str, None] = None,
+                 cache: Union[ResponseCache, bool] = True,
+                 rpm: Optional[int] = None,
+                 tpm: Optional[int] = None,
+                 max_retries: int = DEFAULT_MAX_RETRIES,
+                 api_base: Optional[str] = None,
+                 tokenizer_cache_dir: Optional[str] = None,
+                 session_pool: Union[SessionPool, bool] = True,
+                 request_timeout: Optional[Union[float, Tuple[float, float]]] = None,
+                 n: int = 1,
+                 deadline: Optional[float] = None,
+                 hedging: Union[Hedger, bool] = False) -> None:
+        ''' GPT model.
+
+        Args:
+            cache: response cache. `True` keeps responses in an in-memory LRU cache,
+                `False` disables caching, or pass a `ResponseCache` to persist responses on disk.
+            rpm: requests per minute limit of each api key.
+            tpm: tokens per minute limit of each api key.
+            max_retries: max retries of a request on rate limit, timeout, connection and server errors.
+            api_base: base url of the API, e.g. a proxy or a local server, defaults to `openai.api_base`.
+            tokenizer_cache_dir: directory of the tokenizer files, see `tokenizer.get_tokenizer`.
+                The tokenizer is loaded on first use.
+            session_pool: keep-alive connection pools per api key and base url. `True` creates a pool with
+                the default size, `False` leaves networking to openai, or pass a `SessionPool` to configure it.
+                Call `close`, or use the model as a context manager, to release the connections.
+            request_timeout: timeout of a request in seconds, or a (connect, read) tuple.
+            n: number of completions sampled per request, for self-consistency. The prompt is sent and charged
+                once, the first completion is the `response` and all of them are the `responses` of the output.
+            deadline: seconds a request may take, including its retries and queue waits, after which
+                `TimeoutError` is raised. The timeout of each attempt is cut to the remaining time.
+            hedging: hedged requests. An attempt slower than a quantile of the recent latencies is sent again,
+                on another api key if there are several, and the first response wins. `True` hedges
+                after the default quantile, or pass a `Hedger` to configure it. Hedges count towards the
+                rate limits of the keys, see `hedge_stats` for how often they are sent and win. A sync attempt
+                which loses after it is sent keeps its key's in-flight slot and its thread until its response
+                arrives. Streams are not hedged.
+        '''
         super().__init__()
         self.api_keys = [api_key] if isinstance(api_key, str) else api_key
-        self.tokenizer = tiktoken.encoding_for_model(model)
+        self.scheduler = KeyScheduler(self.api_keys, rpm=rpm, tpm=tpm)
+        self.max_retries = max_retries
+        self.tokenizer_cache_dir = tokenizer_cache_dir
+        self._tokenizer = None
         self.model = model
         # init openai
         self.max_tokens = max_tokens or OpenAIModelMaxTokensMapping[model]
+        if cache is True:
+            cache = ResponseCache()
+        self.cache = cache if isinstance(cache, ResponseCache) else None
+        self.params = dict(
+            temperature=temperature,
+            top_p=top_p,
+            frequency_penalty=frequency_penalty,
+            presence_penalty=presence_penalty,
+            stop=stop
+        )
+        # only set when sampling, so that the cache keys of single completions do not change
+        if n != 1:
+            self.params['n'] = n
+        self.n = n
+        self.api_base = api_base
+        if session_pool is True:
+            session_pool = SessionPool()
+        self.session_pool = session_pool if isinstance(session_pool, SessionPool) else None
+        if self.session_pool is not None:
+            install_routing_session()
+        params = dict(model=self.model, **self.params)
+        if api_base is not None:
+            params['api_base'] = api_base
+        if request_timeout is not None:
+            params['request_timeout'] = request_timeout
+        self.request_timeout = request_timeout
+        self.deadline = deadline
+        if hedging is True:
+            hedging = Hedger()
+        self.hedger = hedging if isinstance(hedging, Hedger) else None
+        # the pool of the attempts of hedged requests, with a thread per attempt in flight
+        self._executor = None
+        self._executor_size = 0
+        self._attempts = set()
+        self._executor_lock = threading.Lock()
         if self.model in OpenAIChatCompletionAPIs:
-            self._predict = partial(
-                openai.ChatCompletion.create,
-                model=self.model,
-                temperature=temperature,
-                max_tokens=self.max_tokens,
-                top_p=top_p,
-                frequency_penalty=frequency_penalty,
-                presence_penalty=presence_penalty,
-                stop=stop
-            )
+            self._predict = partial(openai.ChatCompletion.create, max_tokens=self.max_tokens, **params)
+            self._apredict = partial(openai.ChatCompletion.acreate, max_tokens=self.max_tokens, **params)
         else:
-            self._predict = partial(
-                openai.Completion.create,
-                model=self.model,
-                temperature=temperature,
-                max_tokens=max_tokens,
-                top_p=top_p,
-                frequency_penalty=frequency_penalty,
-                presence_penalty=presence_penalty,
-                stop=stop
-            )
-
-    @lru_cache(maxsize=MAX_LRU_CACHE_SIZE)
-    @with_taken_time
-    def predict(self, text: str) -> Dict:
-        # set api key
-        openai.api_key = random.choice(self.api_keys)
-        n_tokens = len(self.tokenizer.encode(text)) + 7  # 7 is the offset
+            self._predict = partial(openai.Completion.create, max_tokens=max_tokens, **params)
+            self._apredict = partial(openai.Completion.acreate, max_tokens=max_tokens, **params)
+
+    @property
+    def tokenizer(self) -> Any:
+        if self._tokenizer is None:
+            self._tokenizer = get_tokenizer(self.model, cache_dir=self.tokenizer_cache_dir)
+        return self._tokenizer
+
+    def make_request(self, text: str) -> Tuple[Dict, Dict, int]:
+        ''' Check the token budget of `text` and build the output template, the API arguments
+        and the number of tokens the request is charged for against the TPM limit.
+        '''
+        n_tokens = getattr(text, 'n_tokens', None)
+        if n_tokens is None:
+            n_tokens = self.count_tokens(text)
+        n_tokens += 7  # 7 is the offset
         if n_tokens > self.max_tokens:
             raise ValueError(
                 f'OOT (Out Of Tokens)! the current input text has `{n_tokens}` tokens, '
-                'which is greater than the max_tokens {self.max_tokens}')
+                f'which is greater than the max_tokens {self.max_tokens}')
         data = self.get_output_template()
         data['request'] = {'prompt': text}
+        kwargs = {'max_tokens': self.max_tokens - n_tokens}
+        # the completion budget of the annotator, see `budget.CompletionBudget`
+        max_completion_tokens = getattr(text, 'max_completion_tokens', None)
+        if max_completion_tokens is not None:
+            kwargs['max_tokens'] = max(1, min(kwargs['max_tokens'], max_completion_tokens))
+        if self.model in OpenAIChatCompletionAPIs:
+            kwargs['messages'] = [{"role": "user", "content": text}]
+        else:
+            kwargs['prompt'] = text
+        # the rate limiter of the API charges for `max_tokens` of every completion upfront
+        return data, kwargs, n_tokens + kwargs['max_tokens'] * self.n
+
+    def expand_request(self, kwargs: Dict, n_tokens: int) -> Optional[Tuple[Dict, int]]:
+        ''' Return the API arguments and charged tokens of a request with the whole remaining context
+        as its completion budget, None if it has it already.
+        '''
+        n_prompt_tokens = n_tokens - kwargs['max_tokens'] * self.n
+        max_tokens = self.max_tokens - n_prompt_tokens
+        if kwargs['max_tokens'] >= max_tokens:
+            return None
+        return dict(kwargs, max_tokens=max_tokens), n_prompt_tokens + max_tokens * self.n
+
+    @staticmethod
+    def is_truncated(resp: Dict) -> bool:
+        return any(choice.get('finish_reason') == 'length' for choice in resp['choices'])
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.tokenizer.encode(text))
+
+    def count_tokens_batch(self, texts: List[str], num_threads: int = 8) -> List[int]:
+        return count_tokens_batch(self.tokenizer, texts, num_threads=num_threads)
+
+    def parse_response(self, data: Dict, resp: Dict) -> Dict:
         meta = {}
         if self.model in OpenAIChatCompletionAPIs:
-            resp = self._predict(messages=[{"role": "user", "content": text}],
-                                 max_tokens=self.max_tokens - n_tokens)
-            data["response"] = resp["choices"][0]["message"]["content"]
+            responses = [choice["message"]["content"] for choice in resp["choices"]]
             meta["role"] = resp["choices"][0]["message"]["role"]
         else:
-            resp = self._predict(prompt=text, max_tokens=self.max_tokens - n_tokens)
-            data["response"] = resp["choices"][0]["text"]
+            responses = [choice["text"] for choice in resp["choices"]]
+        data["response"] = responses[0]
+        if len(responses) > 1:
+            data["responses"] = responses
+        meta["finish_reason"] = resp["choices"][0].get("finish_reason")
         meta.update(resp["usage"])
         data['meta'] = meta
         return data
+
+    def cache_key(self, text: str) -> str:
+        return ResponseCache.make_key(self.model, dict(self.params, max_tokens=self.max_tokens), text)
+
+    def _use_session(self, api_key: str) -> ContextManager:
+        if self.session_pool is None:
+            return nullcontext()
+        return self.session_pool.use(api_key, self.api_base)
+
+    def _ause_session(self, api_key: str) -> AsyncContextManager:
+        if self.session_pool is None:
+            return anullcontext()
+        return self.session_pool.ause(api_key, self.api_base)
+
+    def hedge_stats(self) -> Optional[Dict]:
+        ''' Return the number of requests, how many of them were hedged and how many hedges won.
+        '''
+        return self.hedger.stats() if self.hedger is not None else None
+
+    def close(self) -> None:
+        ''' Close the connection pools and the threads of the hedged requests.
+        '''
+        with self._executor_lock:
+            attempts, executor = list(self._attempts), self._executor
+            self._executor, self._executor_size = None, 0
+        # the attempts still queued, as `shutdown(cancel_futures=True)` which needs Python 3.9
+        for future in attempts:
+            future.cancel()
+        if executor is not None:
+            executor.shutdown(wait=False)
+        if self.session_pool is not None:
+            self.session_pool.close()
+
+    async def aclose(self) -> None:
+        ''' Close the connection pools, from the event loop of the async requests.
+        '''
+        if self.session_pool is not None:
+            await self.session_pool.aclose()
+
+    def __enter__(self) -> 'GPTModel':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    async def __aenter__(self) -> 'GPTModel':
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self.aclose()
+
+    def _check_deadline(self, deadline: Optional[float], cause: Optional[BaseException] = None) -> None:
+        if deadline is not None and time.monotonic() >= deadline:
+            raise TimeoutError(f'The request did not finish within its deadline of {self.deadline}s.') from cause
+
+    def _with_timeout(self, kwargs: Dict, deadline: Optional[float]) -> Dict:
+        ''' Cut the timeout of an attempt to the time remaining before the deadline.
+        '''
+        if deadline is None:
+            return kwargs
+        remaining = max(deadline - time.monotonic(), 1e-3)
+        timeout = self.request_timeout
+        if isinstance(timeout, tuple):
+            timeout = (min(timeout[0], remaining), min(timeout[1], remaining))
+        else:
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        return dict(kwargs, request_timeout=timeout)
+
+    def _submit(self, *args) -> Future:
+        ''' Run an attempt of a hedged request on the pool. The pool grows with the attempts in flight,
+        those of the requests and the losers still running, so that an attempt never waits for a thread.
+        '''
+        with self._executor_lock:
+            if len(self._attempts) >= self._executor_size:
+                if self._executor is not None:
+                    # its running attempts finish, then its threads exit
+                    self._executor.shutdown(wait=False)
+                self._executor_size = max(len(self._attempts) + 1, 2 * self._executor_size)
+                self._executor = ThreadPoolExecutor(self._executor_size, thread_name_prefix='llano-hedge')
+            future = self._executor.submit(self._attempt, *args)
+            self._attempts.add(future)
+        future.add_done_callback(self._finish_attempt)
+        return future
+
+    def _finish_attempt(self, future: Future) -> None:
+        with self._executor_lock:
+            self._attempts.discard(future)
+
+    def _attempt(self, kwargs: Dict, n_tokens: int, timings: Optional[Dict], deadline: Optional[float] = None,
+                 exclude: Tuple[str, ...] = (), keys: Optional[List[Tuple[str, float]]] = None) -> Tuple[Dict, str]:
+        ''' Send the request once, return the response and the api key.
+        The acquired key and the time it is acquired at are appended to `keys`.
+        '''
+        # pass the api key per request rather than via the global `openai.api_key`, which is not thread-safe
+        with timed(timings, Stages.QueueWait):
+            api_key = self.scheduler.acquire(n_tokens, exclude=exclude, deadline=deadline)
+        if keys is not None:
+            keys.append((api_key, time.perf_counter()))
+        try:
+            with timed(timings, Stages.Network), self._use_session(api_key):
+                resp = self._predict(api_key=api_key, **self._with_timeout(kwargs, deadline))
+        except openai.error.RateLimitError:
+            # the scheduler cools the key down and routes the retry to another key
+            self.scheduler.release(api_key, throttled=True)
+            raise
+        except BaseException:
+            self.scheduler.release(api_key)
+            raise
+        self.scheduler.release(api_key)
+        return resp, api_key
+
+    async def _aattempt(self, kwargs: Dict, n_tokens: int, timings: Optional[Dict], deadline: Optional[float] = None,
+                        exclude: Tuple[str, ...] = (),
+                        keys: Optional[List[Tuple[str, float]]] = None) -> Tuple[Dict, str]:
+        with timed(timings, Stages.QueueWait):
+            api_key = await self.scheduler.aacquire(n_tokens, exclude=exclude, deadline=deadline)
+        if keys is not None:
+            keys.append((api_key, time.perf_counter()))
+        try:
+            with timed(timings, Stages.Network):
+                async with self._ause_session(api_key):
+                    resp = await self._apredict(api_key=api_key, **self._with_timeout(kwargs, deadline))
+        except openai.error.RateLimitError:
+            self.scheduler.release(api_key, throttled=True)
+            raise
+        except BaseException:
+            # including the cancellation of a hedge which lost
+            self.scheduler.release(api_key)
+            raise
+        self.scheduler.release(api_key)
+        return resp, api_key
+
+    def _get_hedge_wait(self, delay: Optional[float], deadline: Optional[float]) -> Optional[float]:
+        ''' Seconds to wait for the attempts, until the hedge is due if `delay` is given, or until the deadline.
+        '''
+        waits = [delay] if delay is not None else []
+        if deadline is not None:
+            waits.append(deadline - time.monotonic())
+        return max(0., min(waits)) if waits else None
+
+    def _get_hedge_delay(self, delay: float, keys: List[Tuple[str, float]]) -> float:
+        ''' Seconds until the hedge of an attempt is due. The delay runs from when the attempt acquired its key,
+        the waits for the rate limits or for a thread are not hedged.
+        '''
+        return delay - (time.perf_counter() - keys[0][1]) if keys else delay
+
+    def _finish_hedge(self, meta: Optional[Dict], timings: Dict, hedged: bool, won: bool) -> None:
+        self.hedger.observe(timings.get(Stages.Network, 0.))
+        if meta is not None:
+            meta['hedged'], meta['hedge_won'] = hedged, won
+            # the timings of the winning attempt
+            for stage, seconds in timings.items():
+                meta['timings'][stage] = meta['timings'].get(stage, 0.) + seconds
+
+    def _hedged_attempt(self, kwargs: Dict, n_tokens: int, meta: Optional[Dict],
+                        deadline: Optional[float] = None) -> Tuple[Dict, str]:
+        ''' Send the request, and a hedge on another api key once it has been sent for the hedge delay.
+        The first response wins and the other attempt is cancelled if it is still waiting for a key.
+        A loser which is already sent cannot be interrupted: it holds the in-flight slot of its key, whose
+        rate limits are charged for it, and a thread until its response arrives, which is then dropped.
+        '''
+        delay, hedge, won = self.hedger.get_delay(), None, False
+        if delay is None:
+            timings = {}
+            try:
+                resp, api_key = self._attempt(kwargs, n_tokens, timings, deadline)
+            finally:
+                self.hedger.record(False)
+            self._finish_hedge(meta, timings, False, False)
+            return resp, api_key
+        keys, attempts = [], {}
+
+        def submit(exclude: Tuple[str, ...]) -> Future:
+            timings = {}
+            future = self._submit(kwargs, n_tokens, timings, deadline, exclude, keys)
+            attempts[future] = timings
+            return future
+
+        pending, error = {submit(())}, None
+        try:
+            while pending:
+                hedge_delay = self._get_hedge_delay(delay, keys) if hedge is None else None
+                done, pending = wait(pending, timeout=self._get_hedge_wait(hedge_delay, deadline),
+                                     return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        won = future is hedge
+                        self._finish_hedge(meta, attempts[future], hedge is not None, won)
+                        return future.result()
+                    error = future.exception()
+                if done:
+                    continue
+                self._check_deadline(deadline)
+                # the hedge goes to another key than the attempt, which is not hedged until it has one
+                if hedge is None and keys and self._get_hedge_delay(delay, keys) <= 0:
+                    hedge = submit(tuple(key for key, _ in keys))
+                    pending.add(hedge)
+        finally:
+            for future in pending:
+                future.cancel()
+            self.hedger.record(hedge is not None, won)
+        raise error
+
+    async def _ahedged_attempt(self, kwargs: Dict, n_tokens: int, meta: Optional[Dict],
+                               deadline: Optional[float] = None) -> Tuple[Dict, str]:
+        delay, hedge, won = self.hedger.get_delay(), None, False
+        if delay is None:
+            timings = {}
+            try:
+                resp, api_key = await self._aattempt(kwargs, n_tokens, timings, deadline)
+            finally:
+                self.hedger.record(False)
+            self._finish_hedge(meta, timings, False, False)
+            return resp, api_key
+        keys, attempts = [], {}
+
+        def submit(exclude: Tuple[str, ...]) -> asyncio.Task:
+            timings = {}
+            task = asyncio.ensure_future(self._aattempt(kwargs, n_tokens, timings, deadline, exclude, keys))
+            attempts[task] = timings
+            return task
+
+        pending, error = {submit(())}, None
+        try:
+            while pending:
+                hedge_delay = self._get_hedge_delay(delay, keys) if hedge is None else None
+                done, pending = await asyncio.wait(pending, timeout=self._get_hedge_wait(hedge_delay, deadline),
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        won = task is hedge
+                        self._finish_hedge(meta, attempts[task], hedge is not None, won)
+                        return task.result()
+                    error = task.exception()
+                if done:
+                    continue
+                self._check_deadline(deadline)
+                if hedge is None and keys and self._get_hedge_delay(delay, keys) <= 0:
+                    hedge = submit(tuple(key for key, _ in keys))
+                    pending.add(hedge)
+        finally:
+            # the loser releases its api key when it is cancelled
+            for task in pending:
+                task.cancel()
+            self.hedger.record(hedge is not None, won)
+        raise error
+
+    def _get_backoff(self, attempt: int, deadline: Optional[float]) -> float:
+        backoff = self.scheduler.backoff(attempt)
+        if deadline is not None:
+            backoff = max(0., min(backoff, deadline - time.monotonic()))
+        return backoff
+
+    def _call(self, kwargs: Dict, n_tokens: int, meta: Optional[Dict] = None, deadline: Optional[float] = None) -> Dict:
+        ''' Send the request with retries until `deadline`, a `time.monotonic()` time. The queue wait and
+        network time, and the api key of the successful attempt, are written to `meta` if it is given.
+        '''
+        timings = meta.setdefault('timings', {}) if meta is not None else None
+        hedged = self.hedger is not None and not kwargs.get('stream')
+        for attempt in range(self.max_retries + 1):
+            self._check_deadline(deadline)
+            try:
+                if hedged:
+                    resp, api_key = self._hedged_attempt(kwargs, n_tokens, meta, deadline)
+                else:
+                    resp, api_key = self._attempt(kwargs, n_tokens, timings, deadline)
+            except openai.error.RateLimitError:
+                if attempt == self.max_retries:
+                    raise
+                continue
+            except RETRYABLE_ERRORS as e:
+                # an attempt cut by the deadline times out
+                self._check_deadline(deadline, cause=e)
+                if attempt == self.max_retries:
+                    raise
+                with timed(timings, Stages.QueueWait):
+                    time.sleep(self._get_backoff(attempt, deadline))
+                continue
+            if meta is not None:
+                meta['api_key'] = mask_api_key(api_key)
+            return resp
+
+    async def _acall(self, kwargs: Dict, n_tokens: int, meta: Optional[Dict] = None,
+                     deadline: Optional[float] = None) -> Dict:
+        timings = meta.setdefault('timings', {}) if meta is not None else None
+        hedged = self.hedger is not None and not kwargs.get('stream')
+        for attempt in range(self.max_retries + 1):
+            self._check_deadline(deadline)
+            try:
+                if hedged:
+                    resp, api_key = await self._ahedged_attempt(kwargs, n_tokens, meta, deadline)
+                else:
+                    resp, api_key = await self._aattempt(kwargs, n_tokens, timings, deadline)
+            except openai.error.RateLimitError:
+                if attempt == self.max_retries:
+                    raise
+                continue
+            except RETRYABLE_ERRORS as e:
+                self._check_deadline(deadline, cause=e)
+                if attempt == self.max_retries:
+                    raise
+                with timed(timings, Stages.QueueWait):
+                    await asyncio.sleep(self._get_backoff(attempt, deadline))
+                continue
+            if meta is not None:
+                meta['api_key'] = mask_api_key(api_key)
+            return resp
+
+    def _finish_request(self, data: Dict, resp: Dict, meta: Dict, kwargs: Dict,
+                        truncated: Optional[Dict] = None) -> Dict:
+        data = self.parse_response(data, resp)
+        if truncated is not None:
+            # the tokens of the truncated completion are spent as well
+            for key, value in truncated['usage'].items():
+                data['meta'][key] = data['meta'].get(key, 0) + value
+            data['meta']['truncated_tokens'] = truncated['usage'].get('completion_tokens', 0)
+        data['meta'].update(meta)
+        data['meta']['max_tokens'] = kwargs['max_tokens']
+        return data
+
+    def _get_deadline(self) -> Optional[float]:
+        return time.monotonic() + self.deadline if self.deadline is not None else None
+
+    def _request(self, text: str) -> Dict:
+        meta, deadline = {'timings': {}}, self._get_deadline()
+        with timed(meta['timings'], Stages.Tokenize):
+            data, kwargs, n_tokens = self.make_request(text)
+        resp, truncated = self._call(kwargs, n_tokens, meta=meta, deadline=deadline), None
+        expanded = self.expand_request(kwargs, n_tokens) if self.is_truncated(resp) else None
+        if expanded is not None:
+            # retried once with the whole budget
+            (kwargs, n_tokens), truncated = expanded, resp
+            resp = self._call(kwargs, n_tokens, meta=meta, deadline=deadline)
+        return self._finish_request(data, resp, meta, kwargs, truncated=truncated)
+
+    async def _arequest(self, text: str) -> Dict:
+        meta, deadline = {'timings': {}}, self._get_deadline()
+        with timed(meta['timings'], Stages.Tokenize):
+            data, kwargs, n_tokens = self.make_request(text)
+        resp, truncated = await self._acall(kwargs, n_tokens, meta=meta, deadline=deadline), None
+        expanded = self.expand_request(kwargs, n_tokens) if self.is_truncated(resp) else None
+        if expanded is not None:
+            (kwargs, n_tokens), truncated = expanded, resp
+            resp = await self._acall(kwargs, n_tokens, meta=meta, deadline=deadline)
+        return self._finish_request(data, resp, meta, kwargs, truncated=truncated)
+
+    def _get_cached(self, text: str) -> Tuple[Optional[str], Optional[Dict]]:
+        if self.cache is None:
+            return None, None
+        key = self.cache_key(text)
+        return key, self.cache.get(key)
+
+    @staticmethod
+    def _finish(data: Dict, start_time: float, cache_hit: bool) -> Dict:
+        # the timings of a cached response are those of the current call, not of the original request
+        if cache_hit:
+            data['meta']['timings'] = {}
+        data['meta']['cache_hit'] = cache_hit
+        data['meta']['taken_time'] = round(time.perf_counter() - start_time, 5)
+        return data
+
+    def predict(self, text: str) -> Dict:
+        start_time = time.perf_counter()
+        key, data = self._get_cached(text)
+        if data is not None:
+            return self._finish(data, start_time, True)
+        data = self._request(text)
+        if key is not None:
+            self.cache.set(key, data)
+        return self._finish(data, start_time, False)
+
+    async def apredict(self, text: str) -> Dict:
+        ''' Asynchronous version of `predict`, it shares the response cache with `predict`.
+        '''
+        start_time = time.perf_counter()
+        key, data = self._get_cached(text)
+        if data is not None:
+            return self._finish(data, start_time, True)
+        data = await self._arequest(text)
+        if key is not None:
+            self.cache.set(key, data)
+        return self._finish(data, start_time, False)
+
+    def _get_delta(self, chunk: Dict) -> str:
+        # the chunks of the other completions are interleaved when sampling several
+        if chunk["choices"][0].get("index", 0) != 0:
+            return ""
+        if self.model in OpenAIChatCompletionAPIs:
+            return chunk["choices"][0]["delta"].get("content", "")
+        return chunk["choices"][0]["text"]
+
+    def predict_stream(self, text: str) -> Iterator[str]:
+        ''' Stream the response of `text` piece by piece. Closing the iterator stops the stream.
+        A cached response is yielded as a single piece. Streamed responses are not cached,
+        since the API does not report their token usage.
+        '''
+        if self.cache is not None:
+            data = self.cache.get(self.cache_key(text))
+            if data is not None:
+                yield data['response']
+                return
+        _, kwargs, n_tokens = self.make_request(text)
+        chunks = self._call(dict(kwargs, stream=True), n_tokens, deadline=self._get_deadline())
+        try:
+            for chunk in chunks:
+                delta = self._get_delta(chunk)
+                if delta:
+                    yield delta
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+
+    async def apredict_stream(self, text: str) -> AsyncIterator[str]:
+        ''' Asynchronous version of `predict_stream`.
+        '''
+        if self.cache is not None:
+            data = self.cache.get(self.cache_key(text))
+            if data is not None:
+                yield data['response']
+                return
+        _, kwargs, n_tokens = self.make_request(text)
+        chunks = await self._acall(dict(kwargs, stream=True), n_tokens, deadline=self._get_deadline())
+        try:
+            async for chunk in chunks:
+                delta = self._get_delta(chunk)
+                if delta:
+                    yield delta
+        finally:
+            if hasattr(chunks, 'aclose'):
+                await chunks.aclose()
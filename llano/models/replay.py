@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+import json
+import threading
+from typing import Any, Dict, Iterable, Optional
+
+from .base import BaseModel
+from ..cache import SQLiteCache
+
+
+class RecordingModel(BaseModel):
+    ''' Wrap a model and append every response to a JSONL file, which can be replayed by `ReplayModel`.
+    '''
+    def __init__(self, model: BaseModel, path: str) -> None:
+        super().__init__()
+        self.wrapped = model
+        self.model = model.model
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name: str) -> Any:
+        # tokenizer, max_tokens, count_tokens... of the wrapped model
+        return getattr(self.wrapped, name)
+
+    def _write(self, data: Dict) -> None:
+        line = json.dumps(data, ensure_ascii=False) + '\n'
+        with self._lock, open(self.path, 'a', encoding='utf-8') as writer:
+            writer.write(line)
+
+    def predict(self, text: str) -> Dict:
+        data = self.wrapped.predict(text)
+        self._write(data)
+        return data
+
+    async def apredict(self, text: str) -> Dict:
+        data = await self.wrapped.apredict(text)
+        self._write(data)
+        return data
+
+
+class ReplayModel(BaseModel):
+    ''' Answer prompts with recorded responses, without any network access.
+    It runs the parsing and formatting path of the annotators at full CPU speed,
+    e.g. to benchmark them or to re-annotate a corpus with new label mappings or formatters.
+
+    Args:
+        records: model outputs, i.e. dicts with the `request`, `meta` and `response` of `predict`.
+        tokenizer: tokenizer used by the annotators to chunk and pack texts, disabled if not specified.
+        max_tokens: max tokens of the replayed model.
+    '''
+    def __init__(self,
+                 records: Iterable[Dict],
+                 tokenizer: Optional[Any] = None,
+                 max_tokens: Optional[int] = None) -> None:
+        super().__init__()
+        self.model = 'replay'
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+        self.responses = {}
+        for record in records:
+            self.responses[record['request']['prompt']] = (record['response'], record.get('meta') or {})
+
+    @classmethod
+    def from_jsonl(cls, path: str, **kwargs) -> 'ReplayModel':
+        ''' Load the records written by `RecordingModel`.
+        '''
+        with open(path, encoding='utf-8') as reader:
+            return cls((json.loads(line) for line in reader if line.strip()), **kwargs)
+
+    @classmethod
+    def from_cache(cls, path: str, **kwargs) -> 'ReplayModel':
+        ''' Load the responses of a persistent `ResponseCache`.
+        '''
+        cache = SQLiteCache(path)
+        try:
+            return cls((json.loads(value) for value in cache.values()), **kwargs)
+        finally:
+            cache.close()
+
+    def __len__(self) -> int:
+        return len(self.responses)
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.tokenizer.encode(text))
+
+    def count_tokens_batch(self, texts: Iterable[str], num_threads: int = 8) -> Iterable[int]:
+        return [self.count_tokens(text) for text in texts]
+
+    def predict(self, text: str) -> Dict:
+        item = self.responses.get(text)
+        if item is None:
+            raise KeyError(f'No recorded response of the prompt: {text[:100]!r}')
+        data = self.get_output_template()
+        data['request'] = {'prompt': text}
+        data['response'], meta = item
+        data['meta'] = dict(meta, replayed=True)
+        return data
+
+    async def apredict(self, text: str) -> Dict:
+        return self.predict(text)
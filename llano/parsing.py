@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+''' Single-pass parsers of the structured outputs of the models.
+
+The tuple parsers read the `(entity, entity_type)` and `(subject, predicate, object)` formats like
+the extraction regexes of `GPTAnnotator`, without backtracking: a tuple is the text between a `(` and
+the next `)` on the same line, and every position of the response is scanned a bounded number of times
+per label, so parsing is linear in the length of the response, truncated or malformed ones included.
+They read the well-formed tuples like the regexes, but not the malformed ones which the regexes read by
+scanning past the tuple: an entity type found only after the closing `)`, e.g. `(Bob, x) people)`,
+or a relation whose fields are separated by line breaks.
+
+`iter_json_records` tokenizes JSON outputs tolerantly: text around the JSON, e.g. a code fence,
+is skipped, and the records completed before a truncation are kept.
+'''
+
+import re
+from json import JSONDecodeError
+from json.decoder import scanstring
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+JSON_TOKEN_REGEX = re.compile(r'["{}\[\]:,]')
+QUOTES_AND_SPACES = '\'" \t\r\n\f\v'
+NER_FIELDS = ('entity', 'entity_type')
+RELATION_FIELDS = ('subject', 'predicate', 'object')
+
+
+def iter_groups(text: str, pos: int = 0) -> Iterator[Tuple[int, str]]:
+    ''' Yield the end and the content of each `(...)` group of text from `pos`, a group does not span lines.
+    '''
+    while True:
+        start = text.find('(', pos)
+        if start == -1:
+            return
+        end = text.find(')', start + 1)
+        if end == -1:
+            return
+        newline = text.find('\n', start + 1, end)
+        if newline != -1:
+            pos = newline + 1
+            continue
+        pos = end + 1
+        yield pos, text[start + 1: end]
+
+
+def _find_first_label(content: str, labels: Sequence[str], pos: int) -> Optional[str]:
+    # the leftmost label, the longest one at the same position
+    best, best_pos = None, -1
+    for label in labels:
+        i = content.find(label, pos)
+        if i != -1 and (best is None or i < best_pos or (i == best_pos and len(label) > len(best))):
+            best, best_pos = label, i
+    return best
+
+
+def parse_ner_group(content: str, labels: Sequence[str]) -> Optional[Tuple[str, str]]:
+    ''' Split a group into an entity and the first label after the last comma followed by a label.
+    '''
+    last = max((content.rfind(label) for label in labels), default=-1)
+    if last == -1:
+        return None
+    comma = content.rfind(',', 0, last)
+    if comma < 1:
+        return None
+    return content[:comma], _find_first_label(content, labels, comma + 1)
+
+
+def _skip(content: str, pos: int) -> int:
+    while pos < len(content) and content[pos] in QUOTES_AND_SPACES:
+        pos += 1
+    return pos
+
+
+def parse_relation_group(content: str, labels: Sequence[str]) -> Optional[Tuple[str, str, str]]:
+    ''' Split a group into a subject, a quoted or bare predicate label and an object,
+    the subject being as long as possible.
+    '''
+    # the longest label is tried first
+    labels = sorted(labels, key=len, reverse=True)
+    comma = len(content)
+    while True:
+        comma = content.rfind(',', 0, comma)
+        if comma < 1:
+            return None
+        start = _skip(content, comma + 1)
+        for label in labels:
+            if not content.startswith(label, start):
+                continue
+            end = _skip(content, start + len(label))
+            if end + 1 < len(content) and content[end] == ',':
+                return content[:comma], label, content[end + 1:]
+
+
+def iter_tuples(text: str, labels: Sequence[str], size: int, pos: int = 0) -> Iterator[Tuple[int, Tuple]]:
+    ''' Yield the end and the raw items of the (entity, entity_type) pairs if `size` is 2,
+    or (subject, predicate, object) triples if it is 3. The items are not stripped.
+    '''
+    parse = parse_ner_group if size == 2 else parse_relation_group
+    for end, content in iter_groups(text, pos):
+        item = parse(content, labels)
+        if item is not None:
+            yield end, item
+
+
+def iter_json_records(text: str) -> Iterator[Union[Dict[str, str], List[str]]]:
+    ''' Yield the innermost JSON objects and arrays of text, i.e. those without a nested container,
+    as dicts and lists of their string values. Other values are skipped.
+    '''
+    # [is_object, values, pending key, has a nested container]
+    stack = []
+    pos = 0
+    while True:
+        matched = JSON_TOKEN_REGEX.search(text, pos)
+        if matched is None:
+            return
+        token, pos = matched.group(), matched.end()
+        if token == '"':
+            try:
+                value, pos = scanstring(text, pos, False)
+            except JSONDecodeError:
+                return
+            if not stack:
+                continue
+            top = stack[-1]
+            if not top[0]:
+                top[1].append(value)
+            elif top[2] is None:
+                top[2] = value
+            else:
+                top[1][top[2]] = value
+                top[2] = None
+        elif token in '{[':
+            if stack:
+                stack[-1][3] = True
+                stack[-1][2] = None
+            stack.append([token == '{', {} if token == '{' else [], None, False])
+        elif token in '}]':
+            if not stack:
+                continue
+            _, values, _, nested = stack.pop()
+            if not nested and values:
+                yield values
+        elif token == ',' and stack and stack[-1][0]:
+            stack[-1][2] = None
+
+
+def _get_fields(record: Union[Dict[str, str], List[str]], fields: Sequence[str]) -> Optional[Tuple]:
+    if isinstance(record, dict):
+        if all(field in record for field in fields):
+            return tuple(record[field] for field in fields)
+        record = list(record.values())
+    if len(record) < len(fields):
+        return None
+    return tuple(record[:len(fields)])
+
+
+def iter_json_tuples(text: str, size: int) -> Iterator[Tuple]:
+    ''' Yield the (entity, entity_type) pairs if `size` is 2, or the (subject, predicate, object) triples
+    if it is 3, of the JSON records of text. Records are objects with these keys, or arrays in this order.
+    '''
+    fields = NER_FIELDS if size == 2 else RELATION_FIELDS
+    for record in iter_json_records(text):
+        item = _get_fields(record, fields)
+        if item is not None:
+            yield item
+
+
+def iter_json_strings(text: str) -> Iterator[str]:
+    ''' Yield the strings of the JSON arrays of text, e.g. the sentences of data augmentation.
+    '''
+    for record in iter_json_records(text):
+        if isinstance(record, list):
+            yield from record
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+
+from typing import Dict, Optional
+
+
+class Prompt(str):
+    ''' A rendered prompt which carries its number of tokens when it is known upfront,
+    so that the model does not need to tokenize the whole prompt again,
+    the timings of the stages which built it, and the completion budget of its request,
+    see `budget.CompletionBudget`.
+    '''
+    def __new__(cls,
+                text: str,
+                n_tokens: Optional[int] = None,
+                timings: Optional[Dict] = None,
+                max_completion_tokens: Optional[int] = None,
+                completion_scale: Optional[float] = None) -> 'Prompt':
+        prompt = super().__new__(cls, text)
+        prompt.n_tokens = n_tokens
+        prompt.timings = timings or {}
+        prompt.max_completion_tokens = max_completion_tokens
+        prompt.completion_scale = completion_scale
+        return prompt
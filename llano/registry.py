@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+from typing import List, Optional, Union
+
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, Template
+
+from .config import TEMPLATE_DIR, TEMPLATE_CACHE_DIR_ENV
+
+
+class TemplateRegistry:
+    ''' Jinja environment of the prompt templates, shared by the annotators of the process.
+
+    Templates are compiled once per registry, and their bytecode is cached on disk so that new processes,
+    e.g. the workers of a job, skip compiling them as well.
+
+    Args:
+        template_dirs: directories searched before the built-in templates, e.g. to override `ner.en.jinja`
+            or to add the templates of a new language.
+        bytecode_cache: directory of the bytecode cache, `True` for the directory of the `LLANO_TEMPLATE_CACHE_DIR`
+            env or a private temporary directory, `False` to disable it.
+    '''
+    def __init__(self,
+                 template_dirs: Optional[List[str]] = None,
+                 bytecode_cache: Union[str, bool] = True) -> None:
+        self.template_dirs = list(template_dirs or [])
+        if bytecode_cache is False:
+            bytecode_cache = None
+        else:
+            # jinja2 picks a private temporary directory if it is None
+            cache_dir = os.getenv(TEMPLATE_CACHE_DIR_ENV) if bytecode_cache is True else bytecode_cache
+            if cache_dir:
+                os.makedirs(cache_dir, exist_ok=True)
+            bytecode_cache = FileSystemBytecodeCache(cache_dir or None)
+        # templates are files shipped with the package, they are not checked for changes on every use
+        self.environment = Environment(loader=self._make_loader(), bytecode_cache=bytecode_cache, auto_reload=False)
+        self._lock = threading.Lock()
+
+    def _make_loader(self) -> FileSystemLoader:
+        return FileSystemLoader(self.template_dirs + [os.path.join(TEMPLATE_DIR, 'texts')])
+
+    def add_directory(self, path: str) -> None:
+        ''' Search the templates of `path` before those of the directories added previously.
+        '''
+        with self._lock:
+            self.template_dirs.insert(0, path)
+            self.environment.loader = self._make_loader()
+            self.environment.cache.clear()
+
+    def get_template(self, name: str) -> Template:
+        ''' Return the compiled template `{name}.jinja`, e.g. `ner.en`.
+        '''
+        return self.environment.get_template(f'{name}.jinja')
+
+
+_default_registry = None
+_lock = threading.Lock()
+
+
+def get_default_registry() -> TemplateRegistry:
+    global _default_registry
+
+    if _default_registry is None:
+        with _lock:
+            if _default_registry is None:
+                _default_registry = TemplateRegistry()
+    return _default_registry
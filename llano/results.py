@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+
+''' Compact annotation outputs, see `GPTAnnotator(typed_results=True)`.
+
+The records have slots and are immutable, so the request and response of a model output are shared
+by reference instead of being copied per result. They are read like the dicts they replace,
+e.g. `ret['result'].get('entities', [])`, and `to_dict` returns the dict output of the annotators.
+The `formatted_result` of a result is only computed when it is read.
+'''
+
+import json
+from collections.abc import Mapping
+from typing import Dict, FrozenSet, Iterator, NamedTuple, Optional, Tuple
+
+from .config import Tasks, Formatter, NERFormatter
+from .export import iter_bio, iter_segment
+
+
+class Entity(NamedTuple):
+    start: int
+    end: int
+    entity: str
+    label: str
+
+
+class Triple(NamedTuple):
+    subject: str
+    predicate: str
+    object: str
+
+
+def _rebuild(cls: type, fields: Dict) -> 'Record':
+    return cls(**fields)
+
+
+class Record(Mapping):
+    ''' Immutable record with slots, which reads as a mapping of its `_keys`.
+    The optional keys are missing from the mapping when their value is None.
+    '''
+    __slots__ = ()
+    _keys: Tuple[str, ...] = ()
+    _optional: FrozenSet[str] = frozenset()
+
+    def __init__(self, **fields) -> None:
+        for name in self.__slots__:
+            object.__setattr__(self, name, fields.get(name))
+
+    def __setattr__(self, name: str, value) -> None:
+        raise AttributeError(f'`{type(self).__name__}` is immutable.')
+
+    def __delattr__(self, name: str) -> None:
+        raise AttributeError(f'`{type(self).__name__}` is immutable.')
+
+    def __reduce__(self):
+        return _rebuild, (type(self), {name: getattr(self, name) for name in self.__slots__})
+
+    def __getitem__(self, key: str):
+        if key in self._keys:
+            value = getattr(self, key)
+            if value is not None or key not in self._optional:
+                return value
+        raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        for key in self._keys:
+            if key not in self._optional or getattr(self, key) is not None:
+                yield key
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        fields = ', '.join(f'{key}={getattr(self, key)!r}' for key in self)
+        return f'{type(self).__name__}({fields})'
+
+    def to_dict(self) -> Dict:
+        ''' Return the record as the dict it replaces, its tuples of items as lists.
+        '''
+        ret = {}
+        for key, value in self.items():
+            if isinstance(value, Record):
+                value = value.to_dict()
+            elif type(value) is tuple:
+                value = list(value)
+            ret[key] = value
+        return ret
+
+
+class Result(Record):
+    __slots__ = ()
+    _optional = frozenset(['entities', 'label', 'sentences', 'triples', 'confidence', 'formatted_result'])
+
+    @property
+    def formatted_result(self) -> Optional[str]:
+        if self.formatter is None:
+            return None
+        if self._formatted is None:
+            object.__setattr__(self, '_formatted', self._format())
+        return self._formatted
+
+    def _format(self) -> Optional[str]:
+        raise NotImplementedError
+
+
+class NERResult(Result):
+    __slots__ = ('text', 'entities', 'confidence', 'formatter', '_formatted')
+    _keys = ('text', 'entities', 'confidence', 'formatted_result')
+
+    def _format(self) -> Optional[str]:
+        if self.entities is None:
+            return None
+        if self.formatter == NERFormatter.BIO:
+            return ''.join(iter_bio(self.text, self.entities))
+        if self.formatter == NERFormatter.Segment:
+            return ''.join(iter_segment(self.text, self.entities))
+        return None
+
+
+class ClassificationResult(Result):
+    __slots__ = ('text', 'label', 'confidence', 'formatter', '_formatted')
+    _keys = ('text', 'label', 'confidence', 'formatted_result')
+
+    def _format(self) -> Optional[str]:
+        if self.label is None or self.formatter != Formatter.JSONL:
+            return None
+        return json.dumps({'text': self.text, 'label': self.label}, ensure_ascii=False)
+
+
+class DataAugmentationResult(Result):
+    __slots__ = ('text', 'sentences', 'formatter', '_formatted')
+    _keys = ('text', 'sentences', 'formatted_result')
+
+    def _format(self) -> Optional[str]:
+        if self.sentences is None or self.formatter != Formatter.JSONL:
+            return None
+        return json.dumps({'text': self.text, 'sentences': self.sentences}, ensure_ascii=False)
+
+
+class RelationExtractionResult(Result):
+    __slots__ = ('text', 'triples', 'confidence', 'formatter', '_formatted')
+    _keys = ('text', 'triples', 'confidence', 'formatted_result')
+
+    def _format(self) -> Optional[str]:
+        if self.triples is None or self.formatter != Formatter.JSONL:
+            return None
+        ret = {'text': self.text, 'triples': self.triples}
+        if self.confidence is not None:
+            ret['confidence'] = self.confidence
+        return json.dumps(ret, ensure_ascii=False)
+
+
+class Annotation(Record):
+    ''' Output of an annotator: the request and response of the model, its meta and the parsed result.
+    The `meta` dict belongs to the output, the request and response may be shared with other outputs.
+    '''
+    __slots__ = ('request', 'meta', 'response', 'responses', 'result', 'error')
+    _keys = __slots__
+    _optional = frozenset(['responses', 'error'])
+
+    @classmethod
+    def from_dict(cls, ret: Dict, task: str, formatter: Optional[str] = None) -> 'Annotation':
+        result = ret.get('result')
+        if result is not None and not isinstance(result, Result):
+            result = make_result(task, result, formatter=formatter)
+        return cls(request=ret.get('request'), meta=ret.get('meta'), response=ret.get('response'),
+                   responses=ret.get('responses'), result=result, error=ret.get('error'))
+
+
+def _to_tuple(items, factory=None) -> Optional[Tuple]:
+    if not isinstance(items, (list, tuple)):
+        return items
+    if factory is None:
+        return tuple(items)
+    return tuple(factory._make(item) for item in items)
+
+
+def make_result(task: str, result: Dict, formatter: Optional[str] = None) -> Result:
+    ''' Build the record of a parsed result of task, e.g. `{'text': ..., 'entities': [...]}`.
+    Its `formatted_result` is formatted with `formatter` when it is read.
+    '''
+    text, confidence = result['text'], _to_tuple(result.get('confidence'))
+    if task == Tasks.NER:
+        return NERResult(text=text, entities=_to_tuple(result.get('entities'), Entity),
+                         confidence=confidence, formatter=formatter)
+    if task in (Tasks.Classification, Tasks.MultiLabelClassification):
+        return ClassificationResult(text=text, label=_to_tuple(result.get('label')),
+                                    confidence=confidence, formatter=formatter)
+    if task == Tasks.DataAugmentation:
+        return DataAugmentationResult(text=text, sentences=_to_tuple(result.get('sentences')), formatter=formatter)
+    if task == Tasks.RelationExtraction:
+        return RelationExtractionResult(text=text, triples=_to_tuple(result.get('triples'), Triple),
+                                        confidence=confidence, formatter=formatter)
+    raise ValueError(f'Unknown task `{task}`.')
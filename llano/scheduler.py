@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+import time
+import random
+import asyncio
+import threading
+from typing import Collection, Dict, List, Optional, Tuple
+
+from .config import DEFAULT_BACKOFF_BASE, DEFAULT_BACKOFF_MAX
+
+
+def mask_api_key(api_key: str) -> str:
+    return f'{api_key[:3]}...{api_key[-4:]}'
+
+
+class TokenBucket:
+    ''' Token bucket which refills `capacity` units per minute.
+    '''
+    def __init__(self, capacity: int) -> None:
+        self.capacity = capacity
+        self.rate = capacity / 60.
+        self.available = float(capacity)
+        self.updated_at = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.available = min(self.capacity, self.available + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, amount: int) -> float:
+        # a request larger than the bucket is let through once the bucket is full
+        amount = min(amount, self.capacity)
+        return max(0., (amount - self.available) / self.rate)
+
+    def consume(self, amount: int) -> None:
+        self.available -= min(amount, self.capacity)
+
+    @property
+    def fill_ratio(self) -> float:
+        return self.available / self.capacity
+
+
+class KeyState:
+    def __init__(self, api_key: str, rpm: Optional[int] = None, tpm: Optional[int] = None) -> None:
+        self.api_key = api_key
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.in_flight = 0
+        self.cooldown_until = 0.
+        self.n_throttled = 0
+        self.n_consecutive_throttled = 0
+        self.n_requests = 0
+        self.n_tokens = 0
+
+    def refill(self, now: float) -> None:
+        for bucket in (self.requests, self.tokens):
+            if bucket is not None:
+                bucket.refill(now)
+
+    def wait_time(self, n_tokens: int, now: float) -> float:
+        wait = max(0., self.cooldown_until - now)
+        if self.requests is not None:
+            wait = max(wait, self.requests.wait_time(1))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.wait_time(n_tokens))
+        return wait
+
+    @property
+    def load(self) -> Tuple[float, int]:
+        ''' Lower is less loaded: the negative remaining capacity ratio, then the number of in-flight requests.
+        '''
+        ratios = [bucket.fill_ratio for bucket in (self.requests, self.tokens) if bucket is not None]
+        return (-min(ratios) if ratios else 0., self.in_flight)
+
+
+class KeyScheduler:
+    ''' Route requests to the least-loaded api key within its RPM/TPM limits.
+
+    Each key has a requests-per-minute and a tokens-per-minute token bucket.
+    `acquire` picks the least-loaded key that has capacity for the request and blocks until one has.
+    A key which is throttled by the server (HTTP 429) is cooled down with jittered exponential backoff.
+
+    Args:
+        api_keys: api keys.
+        rpm: requests per minute of each key, unlimited if not specified.
+        tpm: tokens per minute of each key, unlimited if not specified.
+    '''
+    def __init__(self,
+                 api_keys: List[str],
+                 rpm: Optional[int] = None,
+                 tpm: Optional[int] = None,
+                 backoff_base: float = DEFAULT_BACKOFF_BASE,
+                 backoff_max: float = DEFAULT_BACKOFF_MAX) -> None:
+        if not api_keys:
+            raise ValueError('At least one api key is required.')
+        self.keys = {api_key: KeyState(api_key, rpm=rpm, tpm=tpm) for api_key in api_keys}
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._lock = threading.Lock()
+
+    def backoff(self, attempt: int) -> float:
+        ''' Jittered exponential backoff of the `attempt`-th retry.
+        '''
+        return random.uniform(0.5, 1.) * min(self.backoff_max, self.backoff_base * 2 ** attempt)
+
+    def _try_acquire(self, n_tokens: int, exclude: Collection[str] = ()) -> Tuple[Optional[str], float]:
+        ''' Return the acquired key, or None and the time to wait until a key could be acquired.
+        Keys in `exclude` are only used when no other key is available.
+        '''
+        with self._lock:
+            now = time.monotonic()
+            best, min_wait = None, float('inf')
+            for state in self.keys.values():
+                state.refill(now)
+                wait = state.wait_time(n_tokens, now)
+                if wait > 0:
+                    min_wait = min(min_wait, wait)
+                elif best is None or (state.api_key in exclude, state.load) < (best.api_key in exclude, best.load):
+                    best = state
+            if best is None:
+                return None, min_wait
+            if best.requests is not None:
+                best.requests.consume(1)
+            if best.tokens is not None:
+                best.tokens.consume(n_tokens)
+            best.in_flight += 1
+            best.n_requests += 1
+            best.n_tokens += n_tokens
+            return best.api_key, 0.
+
+    @staticmethod
+    def _check_deadline(wait: float, deadline: Optional[float]) -> None:
+        if deadline is not None and time.monotonic() + wait > deadline:
+            raise TimeoutError('No api key is available before the deadline.')
+
+    def acquire(self, n_tokens: int = 0, exclude: Collection[str] = (), deadline: Optional[float] = None) -> str:
+        ''' Acquire a key, raise TimeoutError if none is available before `deadline`, a `time.monotonic()` time.
+        '''
+        while True:
+            api_key, wait = self._try_acquire(n_tokens, exclude)
+            if api_key is not None:
+                return api_key
+            self._check_deadline(wait, deadline)
+            time.sleep(wait)
+
+    async def aacquire(self, n_tokens: int = 0, exclude: Collection[str] = (), deadline: Optional[float] = None) -> str:
+        while True:
+            api_key, wait = self._try_acquire(n_tokens, exclude)
+            if api_key is not None:
+                return api_key
+            self._check_deadline(wait, deadline)
+            await asyncio.sleep(wait)
+
+    def release(self, api_key: str, throttled: bool = False) -> None:
+        with self._lock:
+            state = self.keys[api_key]
+            state.in_flight -= 1
+            if throttled:
+                state.cooldown_until = time.monotonic() + self.backoff(state.n_consecutive_throttled)
+                state.n_throttled += 1
+                state.n_consecutive_throttled += 1
+            else:
+                state.n_consecutive_throttled = 0
+
+    def stats(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {
+                mask_api_key(api_key): {
+                    'requests': state.n_requests,
+                    'tokens': state.n_tokens,
+                    'throttled': state.n_throttled,
+                    'in_flight': state.in_flight,
+                } for api_key, state in self.keys.items()
+            }
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager, asynccontextmanager
+from typing import AsyncIterator, Dict, Iterator, Optional, Tuple
+
+import aiohttp
+import openai
+import requests
+
+from .config import DEFAULT_POOL_SIZE, DEFAULT_KEEPALIVE_TIMEOUT
+
+
+logger = logging.getLogger('llano')
+
+# the session of the request being sent by the current thread or task
+_current_session: contextvars.ContextVar = contextvars.ContextVar('llano_session', default=None)
+
+
+class RoutingSession(requests.Session):
+    ''' Installed as `openai.requestssession`. openai keeps one session per thread, this one forwards
+    each request to the session selected by `SessionPool.use`, or sends it itself otherwise.
+    '''
+    def request(self, method, url, *args, **kwargs):
+        session = _current_session.get()
+        if session is None:
+            return super().request(method, url, *args, **kwargs)
+        return session.request(method, url, *args, **kwargs)
+
+
+@asynccontextmanager
+async def anullcontext() -> AsyncIterator[None]:
+    # `contextlib.nullcontext` supports `async with` since Python 3.10 only
+    yield
+
+
+def install_routing_session() -> bool:
+    ''' Install the routing session into openai, unless the user has set their own session.
+    '''
+    if isinstance(openai.requestssession, RoutingSession):
+        return True
+    if openai.requestssession is not None:
+        logger.warning('`openai.requestssession` is set, the sync requests of llano do not use its session pool')
+        return False
+    openai.requestssession = RoutingSession()
+    return True
+
+
+class SessionPool:
+    ''' Keep-alive HTTP connection pools of `GPTModel`, one per api key and base url.
+    Sync requests share a `requests.Session` across threads, async requests share an `aiohttp.ClientSession`
+    per event loop, so that connections and TLS sessions are reused instead of being opened per request.
+
+    Args:
+        pool_size: max connections of each pool.
+        keepalive_timeout: idle connections are closed after it, in seconds.
+    '''
+    def __init__(self,
+                 pool_size: int = DEFAULT_POOL_SIZE,
+                 keepalive_timeout: float = DEFAULT_KEEPALIVE_TIMEOUT) -> None:
+        self.pool_size = pool_size
+        self.keepalive_timeout = keepalive_timeout
+        self._sessions: Dict[Tuple[str, str], Tuple[requests.Session, float]] = {}
+        self._asessions: Dict[Tuple[asyncio.AbstractEventLoop, str, str], aiohttp.ClientSession] = {}
+        self._lock = threading.Lock()
+        self.closed = False
+
+    def _make_session(self) -> requests.Session:
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size,
+                                                max_retries=openai.api_requestor.MAX_CONNECTION_RETRIES)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def get(self, api_key: str, api_base: Optional[str] = None) -> requests.Session:
+        if self.closed:
+            raise RuntimeError('The session pool is closed.')
+        key = (api_key, api_base or openai.api_base)
+        now = time.monotonic()
+        with self._lock:
+            session, last_used = self._sessions.get(key, (None, now))
+            if session is None:
+                session = self._make_session()
+            elif now - last_used > self.keepalive_timeout:
+                # urllib3 has no idle timeout, drop the idle connections which the server may have closed
+                session.close()
+            self._sessions[key] = (session, now)
+        return session
+
+    def aget(self, api_key: str, api_base: Optional[str] = None) -> aiohttp.ClientSession:
+        ''' Return the session of the running event loop, aiohttp sessions cannot be shared across loops.
+        '''
+        if self.closed:
+            raise RuntimeError('The session pool is closed.')
+        loop = asyncio.get_running_loop()
+        key = (loop, api_key, api_base or openai.api_base)
+        with self._lock:
+            session = self._asessions.get(key)
+            if session is None or session.closed:
+                # forget the sessions of the loops which are gone
+                for stale in [k for k in self._asessions if k[0].is_closed()]:
+                    del self._asessions[stale]
+                connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=self.keepalive_timeout)
+                session = aiohttp.ClientSession(connector=connector)
+                self._asessions[key] = session
+        return session
+
+    @contextmanager
+    def use(self, api_key: str, api_base: Optional[str] = None) -> Iterator[None]:
+        ''' Send the sync openai requests of the block through the pool of the api key.
+        '''
+        token = _current_session.set(self.get(api_key, api_base))
+        try:
+            yield
+        finally:
+            _current_session.reset(token)
+
+    @asynccontextmanager
+    async def ause(self, api_key: str, api_base: Optional[str] = None) -> AsyncIterator[None]:
+        ''' Send the async openai requests of the block through the pool of the api key.
+        '''
+        token = openai.aiosession.set(self.aget(api_key, api_base))
+        try:
+            yield
+        finally:
+            openai.aiosession.reset(token)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'sessions': len(self._sessions), 'async_sessions': len(self._asessions)}
+
+    def close(self) -> None:
+        ''' Close the sync sessions, and the async sessions whose event loop is not running.
+        Call `aclose` from the event loop to close its sessions.
+        '''
+        with self._lock:
+            self.closed = True
+            sessions = [session for session, _ in self._sessions.values()]
+            self._sessions.clear()
+            asessions = list(self._asessions.items())
+            self._asessions.clear()
+        for session in sessions:
+            session.close()
+        for (loop, *_), session in asessions:
+            if not loop.is_closed() and not loop.is_running():
+                loop.run_until_complete(session.close())
+
+    async def aclose(self) -> None:
+        ''' Close all the sessions, from the event loop of the async requests.
+        '''
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            asessions = [session for key, session in self._asessions.items() if key[0] is loop]
+            self._asessions = {key: session for key, session in self._asessions.items() if key[0] is not loop}
+        for session in asessions:
+            await session.close()
+        self.close()
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from .config import TOKENIZER_CACHE_DIR_ENV
+
+
+_lock = threading.Lock()
+_encodings: Dict[str, Any] = {}
+
+
+@contextmanager
+def tiktoken_cache_dir(cache_dir: Optional[str]) -> Iterator[None]:
+    ''' Point the file cache of tiktoken, which is looked up from the env when loading files, to `cache_dir`.
+    '''
+    if not cache_dir:
+        yield
+        return
+    old_cache_dir = os.environ.get('TIKTOKEN_CACHE_DIR')
+    os.environ['TIKTOKEN_CACHE_DIR'] = cache_dir
+    try:
+        yield
+    finally:
+        if old_cache_dir is None:
+            os.environ.pop('TIKTOKEN_CACHE_DIR', None)
+        else:
+            os.environ['TIKTOKEN_CACHE_DIR'] = old_cache_dir
+
+
+def get_tokenizer(model: str, cache_dir: Optional[str] = None) -> Any:
+    ''' Return the tokenizer of the model, which is loaded on first use and shared in the process.
+
+    The BPE files are read from `cache_dir`, or the directory of the `LLANO_TOKENIZER_CACHE_DIR` env,
+    if specified, so that machines without network access can load them. See `download_tokenizer`.
+    '''
+    import tiktoken
+
+    encoding_name = tiktoken.encoding_name_for_model(model)
+    tokenizer = _encodings.get(encoding_name)
+    if tokenizer is not None:
+        return tokenizer
+    with _lock:
+        tokenizer = _encodings.get(encoding_name)
+        if tokenizer is None:
+            try:
+                with tiktoken_cache_dir(cache_dir or os.getenv(TOKENIZER_CACHE_DIR_ENV)):
+                    tokenizer = tiktoken.get_encoding(encoding_name)
+            except Exception as e:
+                raise RuntimeError(
+                    f'Failed to load the tokenizer `{encoding_name}` of `{model}`. Without network access, '
+                    f'download it beforehand with `llano.tokenizer.download_tokenizer` and pass its cache '
+                    f'directory or set the {TOKENIZER_CACHE_DIR_ENV} env.') from e
+            _encodings[encoding_name] = tokenizer
+    return tokenizer
+
+
+def download_tokenizer(model: str, cache_dir: str) -> None:
+    ''' Download the BPE files of the tokenizer of the model into `cache_dir`, e.g. when building an image.
+    '''
+    import tiktoken
+    import tiktoken.registry
+
+    encoding_name = tiktoken.encoding_name_for_model(model)
+    # registers the constructors of the encodings
+    tiktoken.registry.list_encoding_names()
+    os.makedirs(cache_dir, exist_ok=True)
+    with _lock, tiktoken_cache_dir(cache_dir):
+        tiktoken.registry.ENCODING_CONSTRUCTORS[encoding_name]()
+
+
+def count_tokens_batch(tokenizer: Any, texts: List[str], num_threads: int = 8) -> List[int]:
+    ''' Count the tokens of texts with the multi-threaded batch encoder of tiktoken.
+    '''
+    if hasattr(tokenizer, 'encode_ordinary_batch'):
+        return [len(tokens) for tokens in tokenizer.encode_ordinary_batch(texts, num_threads=num_threads)]
+    return [len(tokenizer.encode(text)) for text in texts]
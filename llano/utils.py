@@ -1,16 +1,80 @@
 # -*- coding: utf-8 -*-
 
-import time
-import functools
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, Iterator, List, Tuple
 
 
-def with_taken_time(func):
-    ''' Append taken time to data
+SENTENCE_END_REGEX = re.compile(r'[。！？；!?]+[”’"\']?\s*|\.(?=\s|$)\s*|\n+')
+
+
+def imap_ordered(func: Callable, iterable: Iterable, num_workers: int) -> Iterator:
+    ''' Apply `func` to the items of `iterable` on a thread pool and yield the results in input order.
+    At most `2 * num_workers` items are read ahead, so the memory does not grow with the input size.
+    '''
+    if num_workers < 1:
+        raise ValueError(f'`num_workers` should be greater than 0, got {num_workers}')
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        try:
+            for item in iterable:
+                pending.append(executor.submit(func, item))
+                if len(pending) >= 2 * num_workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def split_sentences(text: str) -> List[Tuple[int, int]]:
+    ''' Split text into sentences, return the (start, end) spans which cover the whole text.
+    '''
+    spans, start = [], 0
+    for matched in SENTENCE_END_REGEX.finditer(text):
+        if matched.end() > start:
+            spans.append((start, matched.end()))
+            start = matched.end()
+    if start < len(text):
+        spans.append((start, len(text)))
+    return spans
+
+
+def chunk_text(text: str, tokenizer: Any, max_tokens: int, overlap_tokens: int = 0) -> List[Tuple[int, str]]:
+    ''' Split text into chunks of at most `max_tokens` tokens on sentence boundaries.
+    Consecutive chunks share trailing sentences of up to `overlap_tokens` tokens.
+    Sentences longer than `max_tokens` are split into windows of characters.
+
+    Return:
+        a list of (offset, chunk) where offset is the character offset of the chunk in the text.
     '''
-    @functools.wraps(func)
-    def wrapper(*args, **kwargs):
-        start_time = time.time()
-        data = func(*args, **kwargs)
-        data['meta']['taken_time'] = round(time.time() - start_time, 5)
-        return data
-    return wrapper
+    if len(tokenizer.encode(text)) <= max_tokens:
+        return [(0, text)]
+    units = []
+    for start, end in split_sentences(text):
+        n_tokens = len(tokenizer.encode(text[start: end]))
+        if n_tokens <= max_tokens:
+            units.append((start, end, n_tokens))
+            continue
+        size = max(1, (end - start) * max_tokens // n_tokens)
+        for window_start in range(start, end, size):
+            window_end = min(window_start + size, end)
+            units.append((window_start, window_end, len(tokenizer.encode(text[window_start: window_end]))))
+    chunks, i = [], 0
+    while i < len(units):
+        j, n_tokens = i, 0
+        while j < len(units) and (j == i or n_tokens + units[j][2] <= max_tokens):
+            n_tokens += units[j][2]
+            j += 1
+        chunks.append((units[i][0], text[units[i][0]: units[j - 1][1]]))
+        if j >= len(units):
+            break
+        # step back so that the next chunk starts with the trailing units of the current one
+        k, n_tokens = j, 0
+        while k - 1 > i and n_tokens + units[k - 1][2] <= overlap_tokens:
+            k -= 1
+            n_tokens += units[k][2]
+        i = k
+    return chunks
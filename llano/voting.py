@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+''' Aggregation of the results parsed from several completions of the same prompt (self-consistency).
+
+The agreement of a voted label, span or triple is the fraction of the samples which contain it,
+it is reported as its confidence.
+'''
+
+from collections import Counter
+from typing import Dict, Hashable, List, Optional, Tuple
+
+from .config import Tasks, DEFAULT_VOTE_THRESHOLD
+
+
+def vote_label(labels: List[Optional[str]]) -> Tuple[Optional[str], float]:
+    ''' Majority vote of single labels, None stands for a sample without a label.
+    Ties are broken by the order of the samples.
+    '''
+    counts = Counter(label for label in labels if label is not None)
+    if not counts:
+        return None, 0.
+    label, count = counts.most_common(1)[0]
+    return label, count / len(labels)
+
+
+def vote_items(samples: List[List[Hashable]],
+               threshold: float = DEFAULT_VOTE_THRESHOLD) -> List[Tuple[Hashable, float]]:
+    ''' Return the items contained by more than `threshold` of the samples with their agreement,
+    in the order they are first seen.
+    '''
+    counts = Counter(item for sample in samples for item in dict.fromkeys(sample))
+    n = len(samples)
+    return [(item, count / n) for item, count in counts.items() if count / n > threshold]
+
+
+def vote_spans(samples: List[List[Tuple]],
+               threshold: float = DEFAULT_VOTE_THRESHOLD) -> List[Tuple[Tuple, float]]:
+    ''' Vote (start, end, entity, entity_type) spans, then drop the spans overlapping one with a higher
+    agreement, or a longer one on a tie. The spans are returned in text order.
+    '''
+    kept = []
+    voted = sorted(vote_items(samples, threshold), key=lambda x: (-x[1], x[0][0] - x[0][1], x[0][0]))
+    for span, agreement in voted:
+        if all(span[1] <= other[0] or span[0] >= other[1] for other, _ in kept):
+            kept.append((span, agreement))
+    return sorted(kept, key=lambda x: (x[0][0], x[0][1]))
+
+
+def vote_results(task: str, results: List[Dict], threshold: float = DEFAULT_VOTE_THRESHOLD) -> Dict:
+    ''' Aggregate the parsed results of the samples of a task into a result with a `confidence`.
+    Data augmentation has nothing to vote, the sentences of all the samples are merged.
+    '''
+    ret = {'text': results[0]['text']}
+    if task == Tasks.Classification:
+        label, agreement = vote_label([r.get('label') for r in results])
+        if label is not None:
+            ret['label'] = label
+            ret['confidence'] = agreement
+    elif task == Tasks.MultiLabelClassification:
+        voted = vote_items([r.get('label', []) for r in results], threshold)
+        if voted:
+            ret['label'] = [label for label, _ in voted]
+            ret['confidence'] = [agreement for _, agreement in voted]
+    elif task == Tasks.NER:
+        voted = vote_spans([r.get('entities', []) for r in results], threshold)
+        if voted:
+            ret['entities'] = [span for span, _ in voted]
+            ret['confidence'] = [agreement for _, agreement in voted]
+    elif task == Tasks.RelationExtraction:
+        voted = vote_items([r['triples'] for r in results], threshold)
+        ret['triples'] = [triple for triple, _ in voted]
+        ret['confidence'] = [agreement for _, agreement in voted]
+    elif task == Tasks.DataAugmentation:
+        ret['sentences'] = list(dict.fromkeys(sentence for r in results for sentence in r['sentences']))
+    return ret
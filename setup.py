@@ -51,6 +51,13 @@ setup(
         'Topic :: Text Processing :: Indexing',
         'Topic :: Text Processing :: Linguistic',
     ],
+    entry_points={
+        'console_scripts': ['llano=llano.cli:main', 'llano-jobs=llano.jobs:main'],
+    },
     install_requires=requirements,
+    extras_require={
+        'fewshot': ['numpy'],
+        'export': ['pyarrow'],
+    },
     tests_require=test_requirements,
 )
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+from llano.models.base import BaseModel
+
+
+class WhitespaceTokenizer:
+    def encode(self, text):
+        return text.split()
+
+
+class FakeModel(BaseModel):
+    ''' Answer prompts with canned responses, keyed by a substring of the prompt.
+    '''
+    max_tokens = 4096
+
+    def __init__(self, responses):
+        super().__init__()
+        self.responses = responses
+
+    def _respond(self, text):
+        for key, response in self.responses.items():
+            if key in text:
+                return {'request': {'prompt': text}, 'meta': {}, 'response': response, 'result': None}
+        raise KeyError(text)
+
+    def count_tokens(self, text):
+        return len(self.tokenizer.encode(text))
+
+    def count_tokens_batch(self, texts, num_threads=8):
+        return [self.count_tokens(text) for text in texts]
+
+    def predict(self, text):
+        return self._respond(text)
+
+    async def apredict(self, text):
+        return self._respond(text)
+
+    def predict_stream(self, text):
+        ''' Stream the response in pieces of 3 characters, counting the pieces consumed.
+        '''
+        self.n_streamed = 0
+        response = self._respond(text)['response']
+        for i in range(0, len(response), 3):
+            self.n_streamed += 1
+            yield response[i: i + 3]
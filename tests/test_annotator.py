@@ -1,7 +1,12 @@
 # -*- coding: utf-8 -*-
 
+import asyncio
+
 import pytest
 
+from llano.parsing import iter_tuples
+from tests.fake import FakeModel, WhitespaceTokenizer
+
 
 @pytest.mark.parametrize("test_input,labels,expected", [
     ('(a, A), (a,A), ("a", B), ("a  , B), (a",  ,  "B),(a",  ,  \'B),(a"\',,,, ,  \'B), (a"\',,,, ,  \'B"    ),(a,B/C)',
@@ -19,6 +24,8 @@ def test_ner_regex(test_input, labels, expected):
         entity, entity_type = match.group('entity'), match.group('entity_type')
         pairs.append((entity, entity_type))
     assert pairs == expected
+    # the linear-time parser reads the same pairs
+    assert [pair for _, pair in iter_tuples(test_input, labels, 2)] == expected
 
 @pytest.mark.parametrize("test_input,labels,expected", [
     (
@@ -45,4 +52,188 @@ def test_relation_extraction_regex(test_input, labels, expected):
         predicate = GPTAnnotator.re_strip(match.group('predicate'))
         object = GPTAnnotator.re_strip(match.group('object'))
         triples.append((subject, predicate, object))
-    assert triples == expected
\ No newline at end of file
+    assert triples == expected
+    assert [tuple(GPTAnnotator.re_strip(x) for x in triple)
+            for _, triple in iter_tuples(test_input, labels, 3)] == expected
+
+@pytest.mark.parametrize("task,label_mapping,response,kwargs", [
+    ('ner', {'people': 'PEO', 'company': 'COM'}, '(Elon Musk, people), (SpaceX, company)', {'formatter': 'BIO'}),
+    ('classification', {'positive': 'POS', 'negative': 'NEG'}, 'positive', {'formatter': 'jsonl'}),
+    ('multilabel_classification', {'sports': 'S', 'tech': 'T'}, 'sports, tech', {}),
+    ('data_augmentation', None, '1. Musk founded SpaceX.\n2. SpaceX was founded by Musk.', {'size': 2}),
+    ('relation_extraction', {'founder of': 'founder of'}, '[(Elon Musk, founder of, SpaceX)]', {}),
+])
+def test_async_tag_matches_sync(task, label_mapping, response, kwargs):
+    import asyncio
+    from llano import GPTAnnotator
+
+    annotator = GPTAnnotator(FakeModel({'Elon Musk': response}), task=task, language='en',
+                             label_mapping=label_mapping)
+    texts = [f'Elon Musk founded SpaceX {i}.' for i in range(10)]
+    expected = [annotator.tag(text, **kwargs) for text in texts]
+
+    async def run():
+        single = await annotator.atag(texts[0], **kwargs)
+        many = [ret async for ret in annotator.atag_many(iter(texts), concurrency=3, **kwargs)]
+        return single, many
+
+    def without_timings(ret):
+        return dict(ret, meta={k: v for k, v in ret['meta'].items() if k != 'timings'})
+
+    single, many = asyncio.run(run())
+    expected = [without_timings(ret) for ret in expected]
+    assert without_timings(single) == expected[0]
+    assert [without_timings(ret) for ret in many] == expected
+
+
+def test_tag_batch_keeps_order_and_reports_errors():
+    from llano import GPTAnnotator
+
+    annotator = GPTAnnotator(FakeModel({'good': 'positive'}), task='classification', language='en',
+                             label_mapping={'positive': 'POS', 'negative': 'NEG'})
+    texts = [f'good {i}' if i % 3 else f'bad {i}' for i in range(50)]
+    rets = annotator.tag_batch(texts, num_workers=4)
+    assert [ret['result']['text'] for ret in rets] == texts
+    for text, ret in zip(texts, rets):
+        if text.startswith('good'):
+            assert ret['result']['label'] == 'positive' and 'error' not in ret
+        else:
+            assert ret['error'].startswith('KeyError')
+    with pytest.raises(KeyError):
+        list(annotator.imap(texts, num_workers=4, raise_on_error=True))
+
+
+def test_tag_packed_splits_response_and_falls_back():
+    from llano import GPTAnnotator
+
+    model = FakeModel({
+        'Following are the 3 given sentences':
+            '[1] (Elon Musk, people)\n[3] (SpaceX, companyy)',  # 2 is missing, 3 cannot be parsed
+        'Elon Musk founded Tesla': '(Tesla, company)',
+        'SpaceX launched': '(SpaceX, company)',
+        'Following are the 2 given sentences': '[2] None\n[1] (Bob, people)',
+    })
+    model.tokenizer = WhitespaceTokenizer()
+    annotator = GPTAnnotator(model, task='ner', language='en', label_mapping={'people': 'PEO', 'company': 'COM'})
+    texts = ['Elon Musk is here', 'Elon Musk founded Tesla', 'SpaceX launched', 'Bob is here', 'Nothing']
+    rets = annotator.tag_packed(texts, max_pack_size=3, num_workers=2)
+    assert [ret['result']['text'] for ret in rets] == texts
+    assert rets[0]['result']['entities'] == [(0, 9, 'Elon Musk', 'PEO')]
+    assert rets[0]['meta']['pack_size'] == 3
+    assert rets[1]['result']['entities'] == [(18, 23, 'Tesla', 'COM')]
+    assert 'pack_size' not in rets[1]['meta']
+    assert rets[2]['result']['entities'] == [(0, 6, 'SpaceX', 'COM')]
+    assert rets[3]['result']['entities'] == [(0, 3, 'Bob', 'PEO')]
+    assert 'entities' not in rets[4]['result'] and 'error' not in rets[4]
+
+    packs = list(annotator.iter_packs(texts, max_prompt_tokens=75))
+    assert sum(packs, []) == texts and len(packs) > 1
+
+
+def test_prompt_tokens_are_counted_from_the_static_prefix():
+    from llano import GPTAnnotator
+
+    model = FakeModel({})
+    model.tokenizer = WhitespaceTokenizer()
+    annotator = GPTAnnotator(model, task='ner', language='en', label_mapping={'people': 'PEO'})
+    texts = ['Elon Musk is here', 'Bob']
+    for text in texts:
+        prompt = annotator.render_prompt(text, hint='hint')
+        assert prompt.n_tokens == len(prompt.split())
+    assert len(annotator._static_tokens) == 1
+    assert annotator.count_prompt_tokens(texts, hint='hint') == [
+        len(annotator.render_prompt(text, hint='hint').split()) for text in texts]
+
+
+def test_long_text_is_chunked_and_merged():
+    import asyncio
+    from llano import GPTAnnotator
+
+    model = FakeModel({
+        'Alice met Bob': '(Alice, people), (Bob, people), (Paris, location)',
+        'Carol stayed in London': '(Bob, people), (Paris, location), (Carol, people), (London, location)',
+    })
+    model.tokenizer = WhitespaceTokenizer()
+    annotator = GPTAnnotator(model, task='ner', language='en', label_mapping={'people': 'PEO', 'location': 'LOC'},
+                             max_chunk_tokens=8, chunk_overlap_tokens=4)
+    text = 'Alice met Bob. Bob left for Paris. Carol stayed in London.'
+    assert len(annotator.split_text(text)) == 2
+    ret = annotator.tag(text, formatter='segment')
+    assert ret['meta']['n_chunks'] == 2
+    assert [entity for *_, entity, _ in ret['result']['entities']] == ['Alice', 'Bob', 'Bob', 'Paris', 'Carol', 'London']
+    for start, end, entity, _ in ret['result']['entities']:
+        assert text[start: end] == entity
+    assert asyncio.run(annotator.atag(text, formatter='segment'))['result'] == ret['result']
+
+
+def test_chunks_of_a_long_text_are_annotated_with_bounded_concurrency():
+    from llano import GPTAnnotator
+    from llano.config import DEFAULT_CHUNK_WORKERS
+
+    class SlowModel(FakeModel):
+        n_running = max_running = 0
+
+        async def apredict(self, text):
+            self.n_running += 1
+            self.max_running = max(self.max_running, self.n_running)
+            await asyncio.sleep(0.01)
+            self.n_running -= 1
+            return self._respond(text)
+
+    model = SlowModel({'Alice': '(Alice, people)'})
+    model.tokenizer = WhitespaceTokenizer()
+    annotator = GPTAnnotator(model, task='ner', language='en', label_mapping={'people': 'PEO'},
+                             max_chunk_tokens=8, chunk_overlap_tokens=0)
+    text = ' '.join(['Alice met Bob.'] * 40)
+    assert len(annotator.split_text(text)) > DEFAULT_CHUNK_WORKERS
+    ret = asyncio.run(annotator.atag(text))
+    assert len(ret['result']['entities']) == 40 and model.max_running == DEFAULT_CHUNK_WORKERS
+
+
+def test_ner_locates_entities_with_longest_match():
+    from llano import GPTAnnotator
+    from llano.matcher import AhoCorasick
+
+    assert AhoCorasick(['he', 'she', 'hers', '']).find_all('ushers she') == [(1, 4), (7, 10)]
+
+    annotator = GPTAnnotator(FakeModel({'New York': '(New York, location), (New York City, location), (NYC, location)'}),
+                             task='ner', language='en', label_mapping={'location': 'LOC'})
+    ret = annotator.tag('New York City, aka NYC, is in New York.')
+    assert ret['result']['entities'] == [
+        (0, 13, 'New York City', 'LOC'), (19, 22, 'NYC', 'LOC'), (30, 38, 'New York', 'LOC')]
+    annotator.label_mapping = {'place': 'LOC'}
+    assert 'entities' not in annotator.tag('New York City, aka NYC, is in New York.')['result']
+
+
+def test_stream_yields_incrementally_and_stops_early():
+    from llano import GPTAnnotator
+
+    labels = {'sports': 'S', 'sports news': 'SN', 'tech': 'T'}
+    model = FakeModel({'match': 'sports news. Explanation: the sentence is about a football match.'})
+    annotator = GPTAnnotator(model, task='classification', language='en', label_mapping=labels)
+    ret = annotator.tag('a football match', stream=True)
+    assert ret['result']['label'] == 'sports news'
+    assert ret['meta']['early_stopped'] and model.n_streamed == 4
+    assert list(annotator.stream('a football match')) == ['sports news']
+
+    model = FakeModel({'Musk': '(Elon Musk, people), (SpaceX, company), (Mars, planet)'})
+    annotator = GPTAnnotator(model, task='ner', language='en', label_mapping={'people': 'PEO', 'company': 'COM'})
+    text = 'Elon Musk founded SpaceX, Musk said.'
+    assert list(annotator.stream(text)) == [(0, 9, 'Elon Musk', 'PEO'), (18, 24, 'SpaceX', 'COM')]
+
+    # as `tag`, the occurrences of `York` within `New York` are not returned
+    model = FakeModel({'York': '(New York, location), (York, location)'})
+    annotator = GPTAnnotator(model, task='ner', language='en', label_mapping={'location': 'LOC'})
+    places = 'From York to New York.'
+    expected = [(13, 21, 'New York', 'LOC'), (5, 9, 'York', 'LOC')]
+    assert list(annotator.stream(places)) == expected
+    assert annotator.tag(places)['result']['entities'] == sorted(expected)
+
+    async def astream():
+        return [item async for item in annotator.astream(places)]
+
+    assert asyncio.run(astream()) == expected
+
+    model = FakeModel({'Musk': '1. Musk set up SpaceX.\n2. SpaceX was founded by Musk.'})
+    annotator = GPTAnnotator(model, task='data_augmentation', language='en')
+    assert list(annotator.stream(text, size=2)) == ['Musk set up SpaceX.', 'SpaceX was founded by Musk.']
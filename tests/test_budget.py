@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+from llano.budget import CompletionBudget
+
+
+def test_budget_adapts_to_the_observed_completions():
+    budget = CompletionBudget(quantile=0.9, headroom=1., margin=0, min_samples=10, window=100)
+    assert budget.get(10, prior=3.) == 30
+    for i in range(10):
+        budget.observe(10, 10 if i else 40)
+    # 1 token per unit of scale, the outlier is above the quantile
+    assert budget.get(10, prior=3.) == 10
+    for _ in range(200):
+        budget.observe(1, 4)
+    assert budget.get(10, prior=3.) == 40
+    assert budget.stats()['samples'] == 210
+
+
+def test_truncated_completions_are_retried_with_the_whole_budget(monkeypatch):
+    from benchmarks.fake_server import FakeOpenAIServer
+    from llano import GPTAnnotator, GPTModel
+    from llano.models import gpt
+    from tests.fake import WhitespaceTokenizer
+
+    monkeypatch.setattr(gpt, 'get_tokenizer', lambda model, cache_dir=None: WhitespaceTokenizer())
+    responses = {'Alice': 'positive', 'Bob': '(Bob, people), (Paris, location), (Alice, people)'}
+    with FakeOpenAIServer(responses) as server:
+        model = GPTModel('key', api_base=server.url, cache=False)
+        annotator = GPTAnnotator(model, task='classification', language='en', completion_budget=True,
+                                 label_mapping={'positive': 'POS', 'negative': 'NEG'})
+        ret = annotator.tag('Alice is great')
+        # the label, its separator and the margin
+        assert ret['result']['label'] == 'positive' and server.max_tokens == [1 + 2 + 16]
+        assert ret['meta']['max_tokens'] == 19 and ret['meta']['finish_reason'] == 'stop'
+
+        budget = CompletionBudget(headroom=1., margin=0, min_samples=1)
+        budget.observe(4, 4)
+        annotator = GPTAnnotator(model, task='ner', language='en', completion_budget=budget,
+                                 label_mapping={'people': 'PEO', 'location': 'LOC'})
+        ret = annotator.tag('Bob lives in Paris')
+        assert server.max_tokens[1] == 4 and server.max_tokens[2] > 4
+        assert ret['result']['entities'] == [(0, 3, 'Bob', 'PEO'), (13, 18, 'Paris', 'LOC')]
+        assert ret['meta']['truncated_tokens'] == 4 and ret['meta']['completion_tokens'] == 6 + 4
+        # the full completion is observed
+        assert budget.stats()['samples'] == 2
+
+        # the budget is off by default
+        annotator = GPTAnnotator(model, task='ner', language='en', label_mapping={'people': 'PEO', 'location': 'LOC'})
+        annotator.tag('Bob lives in Paris')
+        assert server.max_tokens[-1] == model.max_tokens - len(annotator.render_prompt('Bob lives in Paris').split()) - 7
+
+
+def test_packed_prompts_ask_for_the_budgets_of_their_texts(monkeypatch):
+    from benchmarks.fake_server import FakeOpenAIServer
+    from llano import GPTAnnotator, GPTModel
+    from llano.models import gpt
+    from tests.fake import WhitespaceTokenizer
+
+    monkeypatch.setattr(gpt, 'get_tokenizer', lambda model, cache_dir=None: WhitespaceTokenizer())
+    with FakeOpenAIServer({'[2]': '[1] positive\n[2] negative'}) as server:
+        model = GPTModel('key', api_base=server.url, cache=False)
+        annotator = GPTAnnotator(model, task='classification', language='en', completion_budget=True,
+                                 label_mapping={'positive': 'POS', 'negative': 'NEG'})
+        rets = annotator.tag_packed(['Alice is great', 'Bob is bad'], num_workers=1)
+        assert [ret['result']['label'] for ret in rets] == ['positive', 'negative']
+        # the label and its separator of each text, the margin, and the numbers of the outputs
+        assert server.max_tokens == [2 * 3 + 16 + 2 * 4]
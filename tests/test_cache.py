@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+from llano.cache import ResponseCache
+
+
+def test_memory_cache_is_bounded_by_bytes():
+    cache = ResponseCache(max_bytes=100)
+    for i in range(10):
+        cache.set(str(i), {'response': 'x' * 20})
+    assert cache.memory.n_bytes <= 100
+    assert cache.get('0') is None
+    assert cache.get('9') == {'response': 'x' * 20}
+    stats = cache.stats()
+    assert stats['hits'] == 1 and stats['misses'] == 1
+
+
+def test_disk_cache_persists_and_expires(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    key = ResponseCache.make_key('gpt-3.5-turbo', {'temperature': 0}, 'hello')
+    assert key != ResponseCache.make_key('gpt-3.5-turbo', {'temperature': 1}, 'hello')
+
+    cache = ResponseCache(path)
+    cache.set(key, {'response': '你好'})
+    cache.close()
+
+    cache = ResponseCache(path, ttl=60)
+    assert cache.get(key) == {'response': '你好'}
+    assert cache.stats()['disk_hits'] == 1
+    assert cache.get(key) == {'response': '你好'}
+    assert cache.stats()['memory_hits'] == 1
+
+    cache = ResponseCache(path, ttl=0.01)
+    time.sleep(0.02)
+    assert cache.get(key) is None
+    assert len(cache.disk) == 0
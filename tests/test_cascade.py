@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+
+from tests.fake import FakeModel
+
+
+class CountingModel(FakeModel):
+    def __init__(self, responses):
+        super().__init__(responses)
+        self.prompts = []
+
+    def predict(self, text):
+        self.prompts.append(text)
+        return super().predict(text)
+
+
+def test_unparsed_outputs_are_escalated():
+    from llano import GPTAnnotator
+
+    cheap = CountingModel({'Alice': 'positive', 'Bob': 'I am not sure', 'Carol': 'unknown'})
+    strong = CountingModel({'Bob': 'negative', 'Carol': 'maybe'})
+    annotator = GPTAnnotator(cheap, task='classification', language='en',
+                             label_mapping={'positive': 'POS', 'negative': 'NEG'}, cascade=[strong])
+    rets = annotator.tag_batch(['Alice is great', 'Bob is bad', 'Carol is here'], num_workers=2)
+    assert [ret['result'].get('label') for ret in rets] == ['positive', 'negative', None]
+    assert [ret['meta']['cascade_level'] for ret in rets] == [0, 1, 1]
+    assert len(cheap.prompts) == 3 and len(strong.prompts) == 2
+    assert annotator.cascade_stats() == {'items': 3, 'answered': [1, 2], 'escalated': [2]}
+
+    # an explicit none is a parsed NER output
+    ner = GPTAnnotator(CountingModel({'Dave': 'None'}), task='ner', language='en',
+                       label_mapping={'people': 'PEO'}, cascade=[strong])
+    assert 'entities' not in asyncio.run(ner.atag('Dave is here'))['result']
+    assert ner.cascade_stats()['escalated'] == [0]
+
+
+def test_low_agreement_is_escalated():
+    from llano import GPTAnnotator
+
+    class SamplingModel(FakeModel):
+        def predict(self, text):
+            ret = super().predict(text)
+            ret['responses'] = ret['response'].split('|')
+            ret['response'] = ret['responses'][0]
+            return ret
+
+    cheap = SamplingModel({'Alice': 'positive|negative|positive', 'Bob': 'negative|negative|negative'})
+    strong = SamplingModel({'Alice': 'negative|negative|negative'})
+    annotator = GPTAnnotator(cheap, task='classification', language='en',
+                             label_mapping={'positive': 'POS', 'negative': 'NEG'},
+                             cascade=[strong], min_confidence=0.8)
+    alice, bob = annotator.tag('Alice is here'), annotator.tag('Bob is here')
+    assert (alice['result']['label'], alice['meta']['cascade_level']) == ('negative', 1)
+    assert (bob['result']['label'], bob['meta']['cascade_level']) == ('negative', 0)
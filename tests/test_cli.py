@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+import pytest
+
+from llano.cli import build_parser, annotate
+from tests.fake import FakeModel
+
+
+class Interrupt(BaseException):
+    pass
+
+
+class InterruptedModel(FakeModel):
+    def predict(self, text):
+        if 'Dave' in text:
+            raise Interrupt()
+        return super().predict(text)
+
+
+class FailingModel(FakeModel):
+    def predict(self, text):
+        if 'Carol' in text:
+            raise ValueError('bad request')
+        return super().predict(text)
+
+
+class FailingInterruptedModel(InterruptedModel, FailingModel):
+    pass
+
+
+def test_annotate_resumes_from_checkpoint(tmp_path):
+    from llano import GPTAnnotator
+
+    input_path = tmp_path / 'corpus.jsonl'
+    names = ['Alice', 'Bob', 'Carol', 'Dave', 'Eve']
+    with open(input_path, 'w') as writer:
+        for name in names:
+            writer.write(json.dumps({'text': f'{name} is here'}) + '\n')
+    responses = {name: f'({name}, people)' for name in names}
+    label_mapping = {'people': 'PEO'}
+
+    def make_args(output):
+        return build_parser().parse_args([
+            '--task', 'ner', '--input', str(input_path), '--output', str(output),
+            '--formatter', 'BIO', '--num-workers', '1', '--checkpoint-every', '2'])
+
+    output = tmp_path / 'corpus.conll'
+    annotator = GPTAnnotator(InterruptedModel(responses), task='ner', language='en', label_mapping=label_mapping)
+    with pytest.raises(Interrupt):
+        annotate(annotator, make_args(output))
+    assert json.loads((tmp_path / 'corpus.conll.ckpt').read_text())['n_records'] == 2
+
+    annotator = GPTAnnotator(FakeModel(responses), task='ner', language='en', label_mapping=label_mapping)
+    assert annotate(annotator, make_args(output)) == {'n_records': 5, 'n_errors': 0}
+
+    expected = tmp_path / 'expected.conll'
+    annotate(annotator, make_args(expected))
+    assert output.read_text() == expected.read_text()
+    assert output.read_text().count('\tB-PEO') == 5
+
+    # the errors after the checkpoint are written again on resume, but only once
+    output = tmp_path / 'failing.conll'
+    annotator = GPTAnnotator(FailingInterruptedModel(responses), task='ner', language='en',
+                             label_mapping=label_mapping)
+    with pytest.raises(Interrupt):
+        annotate(annotator, make_args(output))
+    annotator = GPTAnnotator(FailingModel(responses), task='ner', language='en', label_mapping=label_mapping)
+    assert annotate(annotator, make_args(output)) == {'n_records': 5, 'n_errors': 1}
+    errors = (tmp_path / 'failing.conll.errors.jsonl').read_text().splitlines()
+    assert [json.loads(line)['text'] for line in errors] == ['Carol is here']
+
+
+def test_annotate_to_parquet(tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    from llano import GPTAnnotator
+
+    input_path = tmp_path / 'corpus.txt'
+    input_path.write_text('Alice is here\nBob is here\n')
+    output = tmp_path / 'corpus.parquet'
+    args = build_parser().parse_args(['--task', 'ner', '--input', str(input_path), '--output', str(output),
+                                      '--formatter', 'parquet', '--num-workers', '1'])
+    annotator = GPTAnnotator(FakeModel({'Alice': '(Alice, people)', 'Bob': '(Bob, people)'}),
+                             task='ner', language='en', label_mapping={'people': 'PEO'})
+    assert annotate(annotator, args) == {'n_records': 2, 'n_errors': 0}
+    rows = pq.read_table(output).to_pylist()
+    assert [row['text'] for row in rows] == ['Alice is here', 'Bob is here']
+    assert rows[1]['entities'][0]['entity'] == 'Bob'
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+from llano.dedup import NearDuplicateIndex
+from tests.fake import FakeModel, WhitespaceTokenizer
+
+
+def test_near_duplicate_index():
+    from llano.dedup import NearDuplicateIndex
+
+    index = NearDuplicateIndex(threshold=0.8)
+    texts = [
+        'Elon Musk founded SpaceX in 2002 in Hawthorne, California.',
+        'Bob lives in Paris.',
+        'ELON MUSK founded SpaceX in 2002 in Hawthorne California!',
+        'Elon Musk founded SpaceX in 2002 in Hawthorne, California, USA.',
+        'Bob lives in Rome.',
+    ]
+    assert [index.add(text) for text in texts] == [0, 1, 0, 0, 4]
+    assert index.stats()['duplicates'] == 2
+
+    exact = NearDuplicateIndex(threshold=1.)
+    assert [exact.add(text) for text in texts] == [0, 1, 0, 3, 4]
+
+    # the least recently matched representative is evicted
+    bounded = NearDuplicateIndex(threshold=0.8, max_texts=2)
+    assert [bounded.add(text) for text in texts + texts[:2]] == [0, 1, 0, 0, 4, 0, 6]
+    assert sorted(bounded._shingles) == [0, 6] and sorted(set(bounded._exact.values())) == [0, 6]
+    assert sum(len(bucket) for bucket in bounded._buckets) == 2 * bounded.bands
+
+
+def test_align_normalized():
+    from llano.dedup import align_normalized, normalize_text
+
+    text = ' ＥＬＯＮ  Musk, here!'
+    normalized, offsets = align_normalized(text)
+    assert normalized == normalize_text(text) == 'elon musk here'
+    assert text[offsets[0]: offsets[8] + 1] == 'ＥＬＯＮ  Musk'
+
+
+def test_duplicates_are_annotated_once_and_reanchored():
+    from llano import GPTAnnotator
+
+    class CountingModel(FakeModel):
+        n_calls = 0
+
+        def predict(self, text):
+            self.n_calls += 1
+            return super().predict(text)
+
+    model = CountingModel({'Musk': '(Elon Musk, people), (SpaceX, company)', 'Bob': '(Bob, people)'})
+    model.tokenizer = WhitespaceTokenizer()
+    annotator = GPTAnnotator(model, task='ner', language='en', label_mapping={'people': 'PEO', 'company': 'COM'})
+    texts = ['Elon Musk founded SpaceX.', 'Bob is here', 'Yesterday, Elon Musk founded SpaceX.',
+             'Elon Musk founded SpaceX!', 'bob is here']
+    rets = annotator.tag_batch(texts, num_workers=2, dedup=True, formatter='BIO')
+    assert model.n_calls == 3
+    assert [ret['result']['text'] for ret in rets] == texts
+    assert rets[3]['meta']['duplicate_of'] == 0
+    assert rets[3]['result']['entities'] == [(0, 9, 'Elon Musk', 'PEO'), (18, 24, 'SpaceX', 'COM')]
+    assert rets[3]['result']['formatted_result'].endswith('!\tO')
+    # the entities are located in duplicates which differ in case and punctuation
+    assert rets[4]['result']['entities'] == [(0, 3, 'bob', 'PEO')] and rets[4]['meta']['duplicate_of'] == 1
+
+    packed = annotator.tag_packed(texts, max_pack_size=1, dedup=True, formatter='BIO')
+    assert [ret['result'] for ret in packed] == [ret['result'] for ret in rets]
+
+
+def test_duplicates_whose_entities_are_not_found_are_annotated():
+    from llano import GPTAnnotator
+
+    model = FakeModel({'Elon': '(Elon Musk, people)', 'Rome': '(Bob, people), (Rome, location)',
+                       'Paris': '(Bob, people), (Paris, location)'})
+    model.tokenizer = WhitespaceTokenizer()
+    annotator = GPTAnnotator(model, task='ner', language='en', label_mapping={'people': 'PEO', 'location': 'LOC'})
+    texts = ['Elon Musk here.', 'elon Musk here', 'Bob lives in Paris, France.', 'Bob lives in Rome, France.']
+    rets = list(annotator.imap(texts, num_workers=1, dedup=NearDuplicateIndex(threshold=0.5)))
+    assert rets[1]['result']['entities'] == [(0, 9, 'elon Musk', 'PEO')]
+    assert rets[3]['result']['entities'] == [(0, 3, 'Bob', 'PEO'), (13, 17, 'Rome', 'LOC')]
+    assert 'duplicate_of' not in rets[3]['meta']
+
+    # a duplicate of an evicted representative is annotated
+    rets = list(annotator.imap(['Elon Musk here.', 'Elon Musk here!'], num_workers=1,
+                               dedup=NearDuplicateIndex(max_texts=0)))
+    assert rets[1]['result']['entities'] == [(0, 9, 'Elon Musk', 'PEO')] and 'duplicate_of' not in rets[1]['meta']
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+import io
+import json
+import random
+
+import pytest
+
+from llano.export import CorpusExporter, get_ner_segments
+from tests.fake import FakeModel
+
+
+def reference_bio(text, entities):
+    # the per character formatter the exporter replaces
+    ret = []
+    for segment, label in get_ner_segments(text, entities):
+        if label == 'O':
+            ret.append('\n'.join([f'{w}\t{t}' for w, t in zip(segment, [label] * len(segment))]))
+        else:
+            head = f'{segment[0]}\tB-{label}'
+            if len(segment) > 1:
+                head += '\n'
+                head += '\n'.join([f'{w}\tI-{t}' for w, t in zip(segment[1:], [label] * len(segment[1:]))])
+            ret.append(head)
+    return '\n'.join(ret)
+
+
+def random_result(rand):
+    text = ''.join(rand.choice('ab c,中文') for _ in range(rand.randint(0, 30)))
+    entities, start = [], 0
+    while start < len(text):
+        start += rand.randint(0, 5)
+        end = min(start + rand.randint(1, 4), len(text))
+        if start < end:
+            entities.append((start, end, text[start: end], rand.choice(['PEO', 'LOC'])))
+        start = end
+    return {'text': text, 'entities': entities} if entities else {'text': text}
+
+
+def test_ner_exports_match_the_formatters():
+    from llano import GPTAnnotator
+
+    rand = random.Random(0)
+    results = [random_result(rand) for _ in range(200)]
+    for formatter, format_ner in (('BIO', reference_bio), ('segment', GPTAnnotator.format_ner_to_segment)):
+        writer = io.BytesIO()
+        with CorpusExporter(writer, formatter, buffer_size=64) as exporter:
+            exporter.write_all({'result': result} for result in results)
+        expected = ''.join(format_ner(r['text'], r.get('entities', [])) + '\n\n' for r in results)
+        assert writer.getvalue().decode('utf-8') == expected
+    assert all(GPTAnnotator.format_ner_to_bio(r['text'], r.get('entities', [])) ==
+               reference_bio(r['text'], r.get('entities', [])) for r in results)
+
+
+def test_jsonl_export_matches_the_formatted_result():
+    from llano import GPTAnnotator
+
+    model = FakeModel({'Musk': 'Output: positive', 'Bob': 'Output: negative'})
+    annotator = GPTAnnotator(model, task='classification', language='en',
+                             label_mapping={'positive': 'POS', 'negative': 'NEG'})
+    texts = ['Elon Musk is "great"', 'Bob is bad']
+    writer = io.BytesIO()
+    with CorpusExporter(writer, 'jsonl') as exporter:
+        exporter.write_all(annotator.imap(texts))
+    expected = ''.join(annotator.tag(text, formatter='jsonl')['result']['formatted_result'] + '\n' for text in texts)
+    assert writer.getvalue().decode('utf-8') == expected
+
+
+    # the confidence of the voting is not exported, as in the formatted result
+    class SamplingModel(FakeModel):
+        def predict(self, text):
+            ret = super().predict(text)
+            ret['responses'] = ret['response'].split('|')
+            ret['response'] = ret['responses'][0]
+            return ret
+
+    annotator.model = SamplingModel({'Musk': 'positive|negative|positive', 'Bob': 'negative'})
+    rets = [annotator.tag(text, formatter='jsonl') for text in texts]
+    assert rets[0]['result']['confidence'] == 2 / 3
+    for task in (None, 'classification'):
+        writer = io.BytesIO()
+        with CorpusExporter(writer, 'jsonl', task=task) as exporter:
+            exporter.write_all(rets)
+        assert writer.getvalue().decode('utf-8') == ''.join(ret['result']['formatted_result'] + '\n' for ret in rets)
+
+
+def test_parquet_export(tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+
+    path = tmp_path / 'corpus.parquet'
+    with open(path, 'wb') as writer, CorpusExporter(writer, 'parquet', task='ner', buffer_size=2) as exporter:
+        exporter.write({'result': {'text': 'Bob is here', 'entities': [(0, 3, 'Bob', 'PEO')]}})
+        exporter.write({'result': {'text': 'no'}})
+        exporter.write({'result': {'text': 'Al', 'entities': [(0, 2, 'Al', 'PEO')]}})
+    table = pq.read_table(path)
+    assert table.num_rows == 3
+    rows = table.to_pylist()
+    assert rows[0]['tags'] == ['B-PEO', 'I-PEO', 'I-PEO'] + ['O'] * 8
+    assert rows[0]['entities'] == [{'start': 0, 'end': 3, 'entity': 'Bob', 'label': 'PEO'}]
+    assert rows[1] == {'text': 'no', 'entities': [], 'tags': ['O', 'O']}
+    assert json.loads(json.dumps(rows[2]['tags'])) == ['B-PEO', 'I-PEO']
+
+    with pytest.raises(ValueError):
+        CorpusExporter(io.BytesIO(), 'parquet')
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from tests.fake import FakeModel, WhitespaceTokenizer
+
+np = pytest.importorskip('numpy')
+
+
+EXAMPLES = [
+    ('Elon Musk founded SpaceX.', '(Elon Musk, people), (SpaceX, company)'),
+    ('Bill Gates founded Microsoft.', '(Bill Gates, people), (Microsoft, company)'),
+    ('Bob lives in Paris.', '(Bob, people), (Paris, location)'),
+    ('Alice moved to Rome last year.', '(Alice, people), (Rome, location)'),
+]
+
+
+def test_index_is_saved_and_memory_mapped(tmp_path):
+    from llano.fewshot import ExampleIndex
+
+    index = ExampleIndex.build(EXAMPLES, n_features=1 << 12)
+    index.save(str(tmp_path))
+    loaded = ExampleIndex.load(str(tmp_path))
+    assert isinstance(loaded.weights, np.memmap)
+    assert len(loaded) == len(EXAMPLES) and loaded.examples[3] == EXAMPLES[3]
+    for query in ('Larry Page founded Google.', 'Carol lives in Rome.'):
+        expected = index.search(query, 2)
+        assert loaded.retrieve(query, 2) == [EXAMPLES[i] for i, _ in expected]
+        # same ranking as a brute-force cosine similarity
+        assert [i for i, _ in expected] == brute_force(index, query)[:2]
+    assert index.retrieve('Bob lives in Paris!', 1) == [EXAMPLES[2]]
+    assert index.search('???', 3) == []
+
+
+def brute_force(index, query):
+    from llano.fewshot import featurize
+
+    def vector(text):
+        v = np.zeros(index.n_features)
+        for f, tf in featurize(text, n_features=index.n_features).items():
+            v[f] += tf * index.idf[f]
+        return v / (np.linalg.norm(v) or 1)
+
+    q = vector(query)
+    scores = [float(vector(text) @ q) for text, _ in EXAMPLES]
+    return sorted(range(len(EXAMPLES)), key=lambda i: -scores[i])
+
+
+def test_examples_are_added_to_the_prompt_within_budget():
+    from llano import GPTAnnotator
+    from llano.fewshot import ExampleIndex
+
+    model = FakeModel({'Page': '(Larry Page, people)'})
+    model.tokenizer = WhitespaceTokenizer()
+    index = ExampleIndex.build(EXAMPLES, n_features=1 << 12)
+    annotator = GPTAnnotator(model, task='ner', language='en', label_mapping={'people': 'PEO'},
+                             examples=index, n_examples=2, max_example_tokens=15)
+    prompt = annotator.render_prompt('Larry Page founded Google.')
+    assert 'Input: Elon Musk founded SpaceX.\nOutput: (Elon Musk, people), (SpaceX, company)' in prompt
+    # the second example does not fit in the budget
+    assert prompt.count('Input:') == 1
+    # line breaks are counted as a token each, an upper bound
+    assert len(prompt.split()) <= prompt.n_tokens <= len(prompt.split()) + 1
+    assert 'retrieve' in prompt.timings
+    assert annotator.tag('Larry Page founded Google.')['result']['entities'] == [(0, 10, 'Larry Page', 'PEO')]
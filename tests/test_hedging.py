@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import itertools
+import time
+
+import pytest
+
+from llano.hedging import Hedger
+
+
+def test_hedge_delay_is_a_quantile_of_the_latencies():
+    hedger = Hedger(quantile=0.9, min_samples=10)
+    for seconds in range(1, 10):
+        hedger.observe(seconds)
+    assert hedger.get_delay() is None
+    hedger.observe(10)
+    assert hedger.get_delay() == 9
+    hedger.record(True, True)
+    hedger.record(False)
+    assert hedger.stats() == {'requests': 2, 'hedged': 1, 'hedge_wins': 1, 'hedge_rate': 0.5, 'delay': 9}
+
+
+def make_model(monkeypatch, server, **kwargs):
+    from llano import GPTModel
+    from llano.models import gpt
+    from tests.fake import WhitespaceTokenizer
+
+    monkeypatch.setattr(gpt, 'get_tokenizer', lambda model, cache_dir=None: WhitespaceTokenizer())
+    return GPTModel(['key-a', 'key-b'], api_base=server.url, cache=False, **kwargs)
+
+
+def test_slow_requests_are_hedged_on_another_key(monkeypatch):
+    from benchmarks.fake_server import FakeOpenAIServer
+
+    with FakeOpenAIServer(default_response='positive') as server:
+        hedger = Hedger(quantile=0.5, min_samples=1)
+        hedger.observe(0.05)
+        model = make_model(monkeypatch, server, hedging=hedger)
+        # the first attempt of every request is slow
+        server.latency = itertools.cycle([1., 0.]).__next__
+        start = time.perf_counter()
+        ret = model.predict('Alice is great')
+        assert time.perf_counter() - start < 0.8
+        assert ret['response'] == 'positive' and ret['meta']['hedged'] and ret['meta']['hedge_won']
+        assert [stats['requests'] for stats in model.scheduler.stats().values()] == [1, 1]
+        # the loser holds its key until its response arrives
+        assert sum(stats['in_flight'] for stats in model.scheduler.stats().values()) == 1
+        time.sleep(1.2)
+        assert sum(stats['in_flight'] for stats in model.scheduler.stats().values()) == 0
+        assert not model._attempts
+
+        # fast requests are not hedged
+        server.latency = lambda: 0.
+        assert not model.predict('Eve is great')['meta']['hedged']
+
+        async def apredict():
+            async with model:
+                return await model.apredict('Bob is great')
+
+        server.latency = itertools.cycle([1., 0.]).__next__
+        assert asyncio.run(apredict())['meta']['hedge_won'] and server.n_requests == 5
+        stats = model.hedge_stats()
+        assert stats['requests'] == 3 and stats['hedged'] == 2 and stats['hedge_wins'] == 2
+
+
+def test_requests_time_out_at_their_deadline(monkeypatch):
+    from benchmarks.fake_server import FakeOpenAIServer
+
+    with FakeOpenAIServer(default_response='positive', latency=1.) as server:
+        model = make_model(monkeypatch, server, deadline=0.2)
+        start = time.perf_counter()
+        with pytest.raises(TimeoutError):
+            model.predict('Alice is great')
+
+        async def apredict():
+            async with model:
+                return await model.apredict('Alice is great')
+
+        with pytest.raises(TimeoutError):
+            asyncio.run(apredict())
+        assert time.perf_counter() - start < 1.5
+
+
+def test_hedged_requests_which_time_out_are_counted(monkeypatch):
+    from benchmarks.fake_server import FakeOpenAIServer
+
+    with FakeOpenAIServer(default_response='positive', latency=1.) as server:
+        hedger = Hedger(quantile=0.5, min_samples=1)
+        hedger.observe(0.05)
+        model = make_model(monkeypatch, server, deadline=0.3, hedging=hedger, max_retries=0)
+        with pytest.raises(TimeoutError):
+            model.predict('Alice is great')
+        assert model.hedge_stats()['requests'] == 1 and model.hedge_stats()['hedged'] == 1
+        model.close()
+
+
+def test_attempts_do_not_wait_for_threads(monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+    from benchmarks.fake_server import FakeOpenAIServer
+
+    with FakeOpenAIServer(default_response='positive', latency=0.3) as server:
+        hedger = Hedger(quantile=0.5, min_samples=1)
+        hedger.observe(10.)
+        model = make_model(monkeypatch, server, hedging=hedger)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(100) as executor:
+            list(executor.map(model.predict, [f'text {i}' for i in range(100)]))
+        # the attempts of 100 concurrent requests run at once
+        assert time.perf_counter() - start < 0.6 and model._executor_size >= 100
+        model.close()
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import subprocess
+
+
+def test_import_does_not_load_heavy_dependencies():
+    code = ('import sys, llano, llano.config, llano.matcher, llano.annotators.stream, llano.cli; '
+            'print(",".join(m for m in ("openai", "tiktoken", "jinja2") if m in sys.modules))')
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+    assert output.strip() == ''
+
+
+def test_tokenizer_is_loaded_on_first_use(monkeypatch):
+    from llano import GPTModel
+    from llano.models import gpt
+    from tests.fake import WhitespaceTokenizer
+
+    loaded = []
+    monkeypatch.setattr(gpt, 'get_tokenizer',
+                        lambda model, cache_dir=None: loaded.append(cache_dir) or WhitespaceTokenizer())
+    model = GPTModel('key', cache=False, tokenizer_cache_dir='/opt/tokenizers')
+    assert not loaded
+    assert model.count_tokens('a b c') == 3 and model.count_tokens('d') == 1
+    assert loaded == ['/opt/tokenizers']
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+from tests.fake import WhitespaceTokenizer
+
+
+def test_stage_timings_cache_flags_and_usage(monkeypatch):
+    import openai
+    from llano import GPTAnnotator, GPTModel
+    from llano.instrumentation import Instrumentation
+    from llano.models import gpt
+
+    monkeypatch.setattr(gpt, 'get_tokenizer', lambda model, cache_dir=None: WhitespaceTokenizer())
+
+    def create(api_key=None, **kwargs):
+        return {'choices': [{'message': {'role': 'assistant', 'content': '(Bob, people)'}}],
+                'usage': {'prompt_tokens': 10, 'completion_tokens': 3, 'total_tokens': 13}}
+
+    monkeypatch.setattr(openai.ChatCompletion, 'create', create)
+    instrumentation = Instrumentation()
+    events = []
+    unsubscribe = instrumentation.subscribe(lambda task, meta: events.append((task, meta['cache_hit'])))
+    annotator = GPTAnnotator(GPTModel('sk-key-0001'), task='ner', language='en',
+                             label_mapping={'people': 'PEO'}, instrumentation=instrumentation)
+    first = annotator.tag('Bob is here', formatter='BIO')
+    second = annotator.tag('Bob is here', formatter='BIO')
+    unsubscribe()
+    annotator.tag('Bob is here')
+
+    assert not first['meta']['cache_hit'] and second['meta']['cache_hit']
+    assert set(first['meta']['timings']) == {'render', 'tokenize', 'queue_wait', 'network', 'parse', 'format'}
+    assert 'network' not in second['meta']['timings']
+    assert events == [('ner', False), ('ner', True)]
+
+    snapshot = instrumentation.snapshot()
+    assert snapshot['requests']['ner'] == {'miss': 1, 'hit': 2}
+    assert snapshot['tokens']['ner'] == {'sk-...0001': {'prompt': 10, 'completion': 3}}
+    text = instrumentation.to_prometheus()
+    assert 'llano_tokens_total{task="ner",api_key="sk-...0001",type="prompt"} 10' in text
+    assert 'llano_stage_count_total{task="ner",stage="network"} 1' in text
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+import time
+import multiprocessing
+
+from llano.jobs import WorkQueue, run_worker, build_parser, run
+from tests.fake import FakeModel
+
+
+NAMES = [f'Name{i}' for i in range(40)]
+
+
+def make_annotator():
+    from llano import GPTAnnotator
+
+    model = FakeModel({name: f'({name}, people)' for name in NAMES})
+    return GPTAnnotator(model, task='ner', language='en', label_mapping={'people': 'PEO'})
+
+
+def test_leases_are_committed_once(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'job.db'), lease_seconds=0.05, max_attempts=2)
+    assert queue.add(['a', 'b', 'c'], batch_size=2) == 3
+    assert queue.claim('w1', 2) == [(1, 'a'), (2, 'b')]
+    time.sleep(0.1)
+    # the leases of w1 expired, they are given to w2
+    assert queue.claim('w2', 5) == [(1, 'a'), (2, 'b'), (3, 'c')]
+    assert queue.complete('w1', [(1, {'result': 'w1'})]) == 0
+    assert queue.complete('w2', [(1, {'result': 'w2'}), (2, {'result': 'w2'})]) == 2
+    assert queue.complete('w2', [(1, {'result': 'again'})]) == 0
+    queue.fail('w2', [(3, 'boom')])
+    # retried until max_attempts
+    assert queue.claim('w2', 5) == [(3, 'c')]
+    queue.fail('w2', [(3, 'boom')])
+    progress = queue.progress()
+    assert (progress['done'], progress['failed'], progress['pending']) == (2, 1, 0)
+    assert progress['items_per_s'] > 0 and progress['active_workers'] == 1
+    assert [output for _, output in queue.results(batch_size=1)] == [{'result': 'w2'}] * 2
+    assert list(queue.failures()) == [(3, 'c', 'boom')]
+    assert queue.retry_failed() == 1 and not queue.is_finished()
+
+
+def work(path):
+    run_worker(WorkQueue(path), make_annotator(), batch_size=3, num_workers=2)
+
+
+def test_workers_share_a_job(tmp_path):
+    path = str(tmp_path / 'job.db')
+    args = build_parser().parse_args(['create', path, '--task', 'ner', '--label-mapping', '{"people": "PEO"}',
+                                      '--input', str(tmp_path / 'corpus.txt')])
+    (tmp_path / 'corpus.txt').write_text(''.join(f'{name} is here\n' for name in NAMES))
+    assert run(args) == {'n_texts': len(NAMES)}
+    assert WorkQueue(path).get_config()['label_mapping'] == {'people': 'PEO'}
+
+    context = multiprocessing.get_context('fork')
+    workers = [context.Process(target=work, args=(path, )) for _ in range(3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    queue = WorkQueue(path)
+    assert queue.is_finished() and queue.progress()['done'] == len(NAMES)
+
+    output = tmp_path / 'corpus.conll'
+    args = build_parser().parse_args(['export', path, '--output', str(output), '--formatter', 'BIO'])
+    assert run(args) == {'n_records': len(NAMES)}
+    expected = ''.join(make_annotator().tag(f'{name} is here', formatter='BIO')['result']['formatted_result'] + '\n\n'
+                       for name in NAMES)
+    assert output.read_text() == expected
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+import random
+import re
+import time
+
+from llano.parsing import iter_json_records, iter_json_tuples, iter_tuples
+from tests.fake import FakeModel
+
+
+LABELS = ['A', 'B', 'AB']
+ALTERNATION = '|'.join(re.escape(label) for label in sorted(LABELS, key=len, reverse=True))
+# the backtracking regexes of the annotator, restricted to tuples within a line and a pair of parentheses
+NER_REGEX = re.compile(r'\((?P<entity>[^)\n]+)\,[^)\n]*?(?P<entity_type>%s)[^)\n]*\)' % ALTERNATION)
+RELATION_REGEX = re.compile(r'\((?P<subject>[^)\n]+)\,[\'" \t]*?(?P<predicate>%s)[\'" \t]*?\,(?P<object>[^)\n]+)\)'
+                            % ALTERNATION)
+
+
+def test_tuples_match_the_regexes_on_random_outputs():
+    rng = random.Random(0)
+    for _ in range(5000):
+        text = ''.join(rng.choice('(),"\' aAB\n') for _ in range(rng.randint(0, 30)))
+        assert [pair for _, pair in iter_tuples(text, LABELS, 2)] == [
+            matched.group('entity', 'entity_type') for matched in NER_REGEX.finditer(text)]
+        assert [triple for _, triple in iter_tuples(text, LABELS, 3)] == [
+            matched.group('subject', 'predicate', 'object') for matched in RELATION_REGEX.finditer(text)]
+
+
+def test_tuples_are_not_read_past_their_parentheses():
+    from llano import GPTAnnotator
+
+    ner_regex = GPTAnnotator.make_ner_extraction_regex(['people', 'A'])
+    relation_regex = GPTAnnotator.make_relation_extraction_regex(LABELS)
+    # the legacy regexes look for the entity type after the closing parenthesis,
+    # and for the fields of a relation across line breaks
+    for output, legacy in [('(Bob, x) people)', [('Bob', 'people')]), ('(,(((,)A "),', [(',(((', 'A')])]:
+        assert [matched.group('entity', 'entity_type') for matched in ner_regex.finditer(output)] == legacy
+        assert list(iter_tuples(output, ['people', 'A'], 2)) == []
+    output = 'xx(,"\n"BAB(B,\nA,()\nA)live"'
+    assert [matched.group('subject', 'predicate', 'object') for matched in relation_regex.finditer(output)] == [
+        ('B', 'A', '(')]
+    assert list(iter_tuples(output, LABELS, 3)) == []
+    # the well-formed tuples of the same outputs are read
+    assert [pair for _, pair in iter_tuples('(Bob, x) people) (Eve, people)', ['people'], 2)] == [('Eve', 'people')]
+
+
+def test_adversarial_outputs_are_parsed_in_linear_time():
+    outputs = [
+        '(a,' * 100000,  # the entity regex backtracks over every comma of every group
+        '(' + 'x, ' * 100000 + 'A)',
+        '(' + 'x, A ' * 100000 + ')',
+        '"' * 100000,
+        '[{' * 100000,
+        '[{"entity": "a", "entity_type": ' * 50000,
+    ]
+    start = time.perf_counter()
+    for output in outputs:
+        list(iter_tuples(output, LABELS, 2))
+        list(iter_tuples(output, LABELS, 3))
+        list(iter_json_records(output))
+    assert time.perf_counter() - start < 5.
+
+
+def test_json_records_are_read_tolerantly():
+    response = ('```json\n[{"entity": "Bob", "entity_type": "people"}, ["Paris", "location"], '
+                '{"entity_type": "company", "entity": "Space\\"X"}, {"entity": "Tr')
+    assert list(iter_json_tuples(response, 2)) == [
+        ('Bob', 'people'), ('Paris', 'location'), ('Space"X', 'company')]
+    assert list(iter_json_records('{"sentences": ["a", "b"]} and {"label": "c"}')) == [['a', 'b'], {'label': 'c'}]
+
+
+def test_json_output_format():
+    from llano import GPTAnnotator
+
+    model = FakeModel({
+        'Bob': '[{"entity": "Bob", "entity_type": "people"}, {"entity": "Paris", "entity_type": "location"}]',
+        'Eve': '[]',
+        'Tom': '(Tom, people)',
+    })
+    annotator = GPTAnnotator(model, task='ner', language='en', label_mapping={'people': 'PEO', 'location': 'LOC'},
+                             output_format='json')
+    assert 'JSON' in annotator.render_prompt('Bob')
+    assert annotator.tag('Bob lives in Paris')['result']['entities'] == [
+        (0, 3, 'Bob', 'PEO'), (13, 18, 'Paris', 'LOC')]
+    assert annotator._is_parsed(annotator.tag('Eve'), '[]')
+    # tuples are still read
+    assert annotator.tag('Tom')['result']['entities'] == [(0, 3, 'Tom', 'PEO')]
+
+    model = FakeModel({'Li': '{"triples": [{"subject": "Li", "predicate": "live in", "object": "Shanghai"}, '
+                             '{"subject": "Li", "predicate": "like", "object": "tea"}]}'})
+    annotator = GPTAnnotator(model, task='relation_extraction', language='zh_cn', label_mapping={'live in': 'live in'},
+                             output_format='json')
+    assert annotator.tag('Li')['result']['triples'] == [('Li', 'live in', 'Shanghai')]
+
+    model = FakeModel({'Hi': '["Hello.", "Hey."]'})
+    annotator = GPTAnnotator(model, task='data_augmentation', language='en', output_format='json')
+    assert annotator.tag('Hi', size=2)['result']['sentences'] == ['Hello.', 'Hey.']
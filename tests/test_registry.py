@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+from tests.fake import FakeModel
+
+
+def test_prompts_match_the_template():
+    from llano import GPTAnnotator
+    from llano.config import Tasks, Languages
+
+    for task in Tasks.values():
+        for language in Languages.values():
+            annotator = GPTAnnotator(FakeModel({}), task=task, language=language,
+                                     label_mapping={'people': 'PEO', 'location': 'LOC'})
+            for hint in (None, 'Bob is a person {{ text }}'):
+                text = 'Bob lives in {{ Paris }}'
+                assert annotator._render(text, hint=hint, size=2) == annotator._render_template(text, hint=hint, size=2)
+
+
+def test_custom_template_directory(tmp_path):
+    from llano import GPTAnnotator
+    from llano.registry import TemplateRegistry
+
+    (tmp_path / 'templates').mkdir()
+    (tmp_path / 'templates' / 'classification.en.jinja').write_text(
+        'Labels: {{ labels|join("|") }}\nText: {{ text }}\nText again: {{ text|upper }}')
+    registry = TemplateRegistry(template_dirs=[str(tmp_path / 'templates')], bytecode_cache=str(tmp_path / 'cache'))
+    annotator = GPTAnnotator(FakeModel({}), task='classification', language='en',
+                             label_mapping={'positive': 'POS', 'negative': 'NEG'}, registry=registry)
+    # the text is not used once as is, the template is rendered
+    assert annotator.get_static_parts() is None
+    assert annotator._render('good') == 'Labels: positive|negative\nText: good\nText again: GOOD'
+    # the built-in templates are still found
+    assert 'NER' in GPTAnnotator(FakeModel({}), task='ner', language='en', label_mapping={'people': 'PEO'},
+                                 registry=registry)._render('Bob')
+    assert os.listdir(tmp_path / 'cache')
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from tests.fake import FakeModel
+
+
+def test_recorded_responses_are_replayed(tmp_path):
+    from llano import GPTAnnotator
+    from llano.models import RecordingModel, ReplayModel
+
+    path = str(tmp_path / 'responses.jsonl')
+    model = RecordingModel(FakeModel({'Bob': '(Bob, people)'}), path)
+    annotator = GPTAnnotator(model, task='ner', language='en', label_mapping={'people': 'PEO'})
+    expected = annotator.tag('Bob is here', formatter='BIO')
+
+    annotator.model = ReplayModel.from_jsonl(path)
+    ret = annotator.tag('Bob is here', formatter='BIO')
+    assert ret['result'] == expected['result'] and ret['meta']['replayed']
+    with pytest.raises(KeyError):
+        annotator.tag('Alice is here')
+
+
+def test_gpt_model_against_fake_server(monkeypatch):
+    from benchmarks.fake_server import FakeOpenAIServer
+    from llano import GPTAnnotator, GPTModel
+    from llano.models import gpt
+    from tests.fake import WhitespaceTokenizer
+
+    monkeypatch.setattr(gpt, 'get_tokenizer', lambda model, cache_dir=None: WhitespaceTokenizer())
+    with FakeOpenAIServer(default_response='positive', rate_limit_ratio=0.3) as server:
+        model = GPTModel(['key-a', 'key-b'], api_base=server.url, cache=False, max_retries=20)
+        model.scheduler.backoff = lambda attempt: 0.
+        annotator = GPTAnnotator(model, task='classification', language='en',
+                                 label_mapping={'positive': 'POS', 'negative': 'NEG'})
+        rets = annotator.tag_batch([f'good {i}' for i in range(20)], num_workers=4, raise_on_error=True)
+        assert [ret['result']['label'] for ret in rets] == ['positive'] * 20
+        assert list(annotator.stream('good')) and server.n_requests == 20 + server.n_throttled + 1
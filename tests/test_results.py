@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+import io
+import pickle
+
+import pytest
+
+from llano import GPTAnnotator
+from llano.export import CorpusExporter
+from llano.results import Annotation, Entity
+from tests.fake import FakeModel
+
+
+LABELS = {'people': 'PEO', 'location': 'LOC'}
+RESPONSES = {'Bob': '(Bob, people), (Paris, location)', 'Eve': 'None'}
+
+
+@pytest.mark.parametrize('task, labels, responses, formatter', [
+    ('ner', LABELS, RESPONSES, 'BIO'),
+    ('classification', {'positive': 'POS', 'negative': 'NEG'}, {'Bob': 'positive', 'Eve': '?'}, 'jsonl'),
+    ('multilabel_classification', {'positive': 'POS', 'happy': 'HAP'}, {'Bob': 'positive, happy', 'Eve': '?'},
+     'jsonl'),
+    ('relation_extraction', {'live': 'LIVE'}, {'Bob': '(Bob, live, Paris)', 'Eve': 'None'}, 'jsonl'),
+])
+def test_typed_results_match_dicts(task, labels, responses, formatter):
+    texts = ['Bob lives in Paris', 'Eve']
+    model = FakeModel(responses)
+    rets = GPTAnnotator(model, task=task, language='en', label_mapping=labels).tag_batch(texts, formatter=formatter)
+    annotator = GPTAnnotator(model, task=task, language='en', label_mapping=labels, typed_results=True)
+    records = annotator.tag_batch(texts, formatter=formatter)
+    for ret, record in zip(rets, records):
+        assert isinstance(record, Annotation)
+        for output in (ret, record):
+            output['meta'].pop('timings')
+        assert record.to_dict() == ret
+        assert record['result']['text'] == ret['result']['text']
+
+    for output in (rets, records):
+        writer = io.BytesIO()
+        CorpusExporter(writer, formatter, task=task).write_all(output)
+        output.append(writer.getvalue())
+    assert records[-1] == rets[-1]
+
+
+def test_records_are_immutable():
+    annotator = GPTAnnotator(FakeModel(RESPONSES), task='ner', language='en', label_mapping=LABELS,
+                             typed_results=True)
+    ret = annotator.tag('Bob lives in Paris', formatter='segment')
+    result = ret.result
+    assert result.entities[0] == Entity(0, 3, 'Bob', 'PEO') and result.entities[1].label == 'LOC'
+    assert 'confidence' not in result and result.get('confidence') is None
+    with pytest.raises(AttributeError):
+        result.entities = ()
+    with pytest.raises(TypeError):
+        ret['result'] = None
+    assert not hasattr(result, '__dict__')
+    assert result.formatted_result == 'Bob\tPEO\n lives in \tO\nParis\tLOC'
+    assert pickle.loads(pickle.dumps(ret)) == ret
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+import pytest
+
+from llano.scheduler import KeyScheduler
+
+
+def test_scheduler_balances_keys_and_cools_down_throttled_key():
+    scheduler = KeyScheduler(['key-a', 'key-b'], rpm=600, tpm=100000)
+    first = scheduler.acquire(100)
+    second = scheduler.acquire(100)
+    assert {first, second} == {'key-a', 'key-b'}
+    scheduler.release(first, throttled=True)
+    scheduler.release(second)
+    for _ in range(5):
+        assert scheduler.acquire(100) == second
+        scheduler.release(second)
+    stats = scheduler.stats()
+    assert sum(s['requests'] for s in stats.values()) == 7
+    assert sum(s['throttled'] for s in stats.values()) == 1
+
+
+def test_scheduler_waits_when_all_keys_are_saturated():
+    scheduler = KeyScheduler(['key-a'], rpm=1200)  # one request per 50ms after the burst
+    for _ in range(1200):
+        scheduler.release(scheduler.acquire())
+    start = time.monotonic()
+    scheduler.release(scheduler.acquire())
+    assert time.monotonic() - start >= 0.03
+
+
+def test_gpt_model_retries_on_rate_limit(monkeypatch):
+    import openai
+    from llano import GPTModel
+    from llano.models import gpt
+
+    class Tokenizer:
+        def encode(self, text):
+            return text.split()
+
+    monkeypatch.setattr(gpt, 'get_tokenizer', lambda model, cache_dir=None: Tokenizer())
+    used_keys = []
+
+    def create(api_key=None, **kwargs):
+        used_keys.append(api_key)
+        if len(used_keys) == 1:
+            raise openai.error.RateLimitError('throttled')
+        return {'choices': [{'message': {'role': 'assistant', 'content': 'ok'}}],
+                'usage': {'prompt_tokens': 1, 'completion_tokens': 1, 'total_tokens': 2}}
+
+    monkeypatch.setattr(openai.ChatCompletion, 'create', create)
+    model = GPTModel(['key-a', 'key-b'], cache=False, max_retries=1)
+    assert model.predict('hello')['response'] == 'ok'
+    assert len(used_keys) == 2 and used_keys[0] != used_keys[1]
+
+    model = GPTModel('key-a', cache=False, max_retries=0)
+    used_keys.clear()
+    with pytest.raises(openai.error.RateLimitError):
+        model.predict('hello')
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+
+from tests.fake import WhitespaceTokenizer
+
+
+def test_connections_are_pooled_per_key(monkeypatch):
+    from benchmarks.fake_server import FakeOpenAIServer
+    from llano import GPTAnnotator, GPTModel
+    from llano.models import gpt
+
+    monkeypatch.setattr(gpt, 'get_tokenizer', lambda model, cache_dir=None: WhitespaceTokenizer())
+    with FakeOpenAIServer(default_response='positive') as server:
+        with GPTModel('key-a', api_base=server.url, cache=False, request_timeout=10) as model:
+            annotator = GPTAnnotator(model, task='classification', language='en',
+                                     label_mapping={'positive': 'POS', 'negative': 'NEG'})
+            for _ in range(3):
+                # each batch runs on a new thread pool
+                annotator.tag_batch([f'good {i}' for i in range(8)], num_workers=4, raise_on_error=True)
+            assert server.n_requests == 24 and server.n_connections <= 4
+
+            async def run():
+                await asyncio.gather(*[annotator.atag(f'good {i}') for i in range(8)])
+                await asyncio.gather(*[annotator.atag(f'good {i}') for i in range(8)])
+                await model.aclose()
+
+            n_connections = server.n_connections
+            asyncio.run(run())
+            assert server.n_requests == 40 and server.n_connections - n_connections <= 8
+        assert model.session_pool.closed and model.session_pool.stats() == {'sessions': 0, 'async_sessions': 0}
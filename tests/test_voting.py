@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+from llano.voting import vote_label, vote_spans, vote_results
+
+
+def test_votes():
+    assert vote_label(['POS', None, 'NEG', 'POS']) == ('POS', 0.5)
+    assert vote_label([None, None]) == (None, 0.)
+    samples = [
+        [(0, 3, 'Bob', 'PEO'), (12, 17, 'Paris', 'LOC')],
+        [(0, 3, 'Bob', 'PEO'), (12, 17, 'Paris', 'LOC')],
+        [(0, 3, 'Bob', 'PEO'), (12, 14, 'Pa', 'LOC')],
+    ]
+    assert vote_spans(samples) == [((0, 3, 'Bob', 'PEO'), 1.), ((12, 17, 'Paris', 'LOC'), 2 / 3)]
+    # overlapping spans, the one with the higher agreement wins
+    assert vote_spans(samples, threshold=0.) == [((0, 3, 'Bob', 'PEO'), 1.), ((12, 17, 'Paris', 'LOC'), 2 / 3)]
+    triples = [{'text': 't', 'triples': [('a', 'b', 'c')]}, {'text': 't', 'triples': [('a', 'b', 'c'), ('d', 'e', 'f')]}]
+    assert vote_results('relation_extraction', triples, threshold=0.5) == {
+        'text': 't', 'triples': [('a', 'b', 'c')], 'confidence': [1.]}
+
+
+def test_completions_are_sampled_in_one_request(monkeypatch):
+    from benchmarks.fake_server import FakeOpenAIServer
+    from llano import GPTAnnotator, GPTModel
+    from llano.models import gpt
+    from tests.fake import WhitespaceTokenizer
+
+    monkeypatch.setattr(gpt, 'get_tokenizer', lambda model, cache_dir=None: WhitespaceTokenizer())
+    responses = {
+        'Bob': ['(Bob, people), (Paris, location)', '(Bob, people)', '(Bob, people), (Paris, location)'],
+        'Alice': ['positive', 'negative', 'positive'],
+    }
+    with FakeOpenAIServer(responses) as server:
+        model = GPTModel('key', api_base=server.url, cache=False, n=3)
+        annotator = GPTAnnotator(model, task='ner', language='en',
+                                 label_mapping={'people': 'PEO', 'location': 'LOC'})
+        ret = annotator.tag('Bob lives in Paris', formatter='BIO')
+        assert server.n_requests == 1
+        assert len(ret['responses']) == 3 and ret['meta']['n_samples'] == 3
+        assert ret['result']['entities'] == [(0, 3, 'Bob', 'PEO'), (13, 18, 'Paris', 'LOC')]
+        assert ret['result']['confidence'] == [1., 2 / 3]
+        assert ret['result']['formatted_result'] == GPTAnnotator.format_ner_to_bio(
+            ret['result']['text'], ret['result']['entities'])
+
+        annotator = GPTAnnotator(model, task='classification', language='en',
+                                 label_mapping={'positive': 'POS', 'negative': 'NEG'})
+        ret = annotator.tag('Alice is great', formatter='jsonl')
+        assert ret['result']['label'] == 'positive' and ret['result']['confidence'] == 2 / 3
+        assert ret['result']['formatted_result'] == '{"text": "Alice is great", "label": "positive"}'
+
+
+def test_packed_completions_are_voted_per_item(monkeypatch):
+    from benchmarks.fake_server import FakeOpenAIServer
+    from llano import GPTAnnotator, GPTModel
+    from llano.models import gpt
+    from tests.fake import WhitespaceTokenizer
+
+    monkeypatch.setattr(gpt, 'get_tokenizer', lambda model, cache_dir=None: WhitespaceTokenizer())
+    responses = {'Following are the 2 given sentences': [
+        '[1] positive\n[2] negative', '[1] negative\n[2] negative', '[1] positive\n[2] positive']}
+    with FakeOpenAIServer(responses) as server:
+        model = GPTModel('key', api_base=server.url, cache=False, n=3)
+        annotator = GPTAnnotator(model, task='classification', language='en',
+                                 label_mapping={'positive': 'POS', 'negative': 'NEG'})
+        alice, bob = annotator.tag_packed(['Alice is great', 'Bob is bad'])
+        assert server.n_requests == 1
+        assert alice['responses'] == [' positive\n', ' negative\n', ' positive\n']
+        assert (alice['result']['label'], alice['result']['confidence']) == ('positive', 2 / 3)
+        assert bob['responses'] == [' negative', ' negative', ' positive']
+        assert (bob['result']['label'], bob['result']['confidence']) == ('negative', 2 / 3)
+        assert alice['meta']['n_samples'] == 3 and alice['meta']['pack_index'] == 0